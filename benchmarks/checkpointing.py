@@ -0,0 +1,106 @@
+"""Benchmark of activation checkpointing in RandLa-Net: activation memory, peak memory and steps/s of training.
+
+Activation memory is the size of the tensors saved for backward during a forward pass, which is
+what checkpointing reduces, whatever the device. Peak memory of a training step is also reported
+on GPU. Batches are random clouds, with neighbors searched once beforehand so that only the neural
+network is timed.
+
+Usage:
+    python benchmarks/checkpointing.py --batch-size 8 --num-points 40000 --device cuda
+
+"""
+
+import argparse
+import time
+
+import torch
+from torch_geometric.data import Batch, Data
+
+from myria3d.models.modules.pyg_randla_net import PyGRandLANet, build_neighbors_hierarchy
+
+NUM_FEATURES = 9
+NUM_CLASSES = 7
+SETTINGS = {
+    "none": {},
+    "lfa": {"checkpointing": "lfa"},
+    "blocks": {"checkpointing": "blocks"},
+    "dense": {"lfa_mode": "dense"},
+    "dense_lfa": {"lfa_mode": "dense", "checkpointing": "lfa"},
+    "dense_blocks": {"lfa_mode": "dense", "checkpointing": "blocks"},
+}
+
+
+def saved_activations_bytes(net, batch, hierarchy):
+    """Bytes of distinct tensors saved for backward by a forward pass."""
+    storages = {}
+
+    def pack(tensor):
+        storage = tensor.untyped_storage()
+        storages[storage.data_ptr()] = storage.nbytes()
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        net(batch.x, batch.pos, batch.batch, batch.ptr, hierarchy=hierarchy)
+    return sum(storages.values())
+
+
+def benchmark(settings, batch, hierarchy, num_steps, device):
+    torch.manual_seed(0)
+    net = PyGRandLANet(NUM_FEATURES, NUM_CLASSES, return_logits=True, **settings).to(device)
+    optimizer = torch.optim.Adam(net.parameters())
+    criterion = torch.nn.CrossEntropyLoss()
+    activations = saved_activations_bytes(net, batch, hierarchy)
+
+    def step():
+        optimizer.zero_grad()
+        logits = net(batch.x, batch.pos, batch.batch, batch.ptr, hierarchy=hierarchy)
+        criterion(logits, batch.y).backward()
+        optimizer.step()
+
+    step()  # warmup
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+    start = time.perf_counter()
+    for _ in range(num_steps):
+        step()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    steps_per_second = num_steps / (time.perf_counter() - start)
+    peak = torch.cuda.max_memory_allocated(device) if device.type == "cuda" else float("nan")
+    return activations, peak, steps_per_second
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--num-points", type=int, default=12500, help="Points per cloud.")
+    parser.add_argument("--num-steps", type=int, default=5, help="Timed steps per setting.")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--settings", nargs="+", default=list(SETTINGS), choices=list(SETTINGS))
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    generator = torch.Generator().manual_seed(0)
+    batch = Batch.from_data_list(
+        [
+            Data(
+                x=torch.rand((args.num_points, NUM_FEATURES), generator=generator),
+                pos=torch.rand((args.num_points, 3), generator=generator),
+                y=torch.randint(NUM_CLASSES, (args.num_points,), generator=generator),
+            )
+            for _ in range(args.batch_size)
+        ]
+    ).to(device)
+    hierarchy = build_neighbors_hierarchy(batch.pos, batch.batch, batch.ptr.cpu(), 16, 4)
+
+    print(f"{'setting':<16}{'activations (GB)':>18}{'peak (GB)':>12}{'steps/s':>10}")
+    for name in args.settings:
+        activations, peak, steps_per_second = benchmark(
+            SETTINGS[name], batch, hierarchy, args.num_steps, device
+        )
+        print(f"{name:<16}{activations / 1e9:>18.2f}{peak / 1e9:>12.2f}{steps_per_second:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
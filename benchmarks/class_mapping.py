@@ -0,0 +1,66 @@
+"""Benchmark of mapping of classification codes: np.vectorize against lookup tables.
+
+Codes of TargetTransform are mapped to consecutive integers, as for each training sample, and
+class indices are mapped back to codes, as by Interpolator for each predicted tile.
+
+Usage:
+    python benchmarks/class_mapping.py --num-points 1000000
+
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from myria3d.pctl.transforms.transforms import TargetTransform
+
+CLASSIFICATION_PREPROCESSING_DICT = {3: 5, 4: 5, 160: 64, 161: 64, 162: 64, 0: 1, 7: 1, 66: 1}
+CLASSIFICATION_DICT = {1: "unclassified", 2: "ground", 5: "vegetation", 6: "building", 9: "water"}
+
+
+def vectorized_target_transform(y):
+    """Mapping of TargetTransform before lookup tables."""
+    preprocessing = CLASSIFICATION_PREPROCESSING_DICT
+    d = {code: index for index, code in enumerate(CLASSIFICATION_DICT)}
+    d.update({65: 65})
+    y = np.vectorize(lambda code: preprocessing.get(code, code))(y)
+    return torch.LongTensor(np.vectorize(lambda code: d.get(code))(y))
+
+
+def timeit(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--num-points", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    codes = np.array([1, 2, 3, 4, 5, 6, 9, 65, 66])
+    y = np.random.default_rng(0).choice(codes, args.num_points).astype(np.int32)
+    target_transform = TargetTransform(CLASSIFICATION_PREPROCESSING_DICT, CLASSIFICATION_DICT)
+    reverse_mapper = dict(enumerate(CLASSIFICATION_DICT))
+    class_codes = torch.tensor(list(CLASSIFICATION_DICT))
+    preds = torch.randint(len(CLASSIFICATION_DICT), (args.num_points,))
+
+    print(f"{'mapping':<24}{'np.vectorize (s)':>18}{'lookup table (s)':>18}{'speedup':>10}")
+    expected, vectorize_duration = timeit(vectorized_target_transform, y)
+    for name, data in [("target (numpy)", y), ("target (torch)", torch.from_numpy(y))]:
+        mapped, duration = timeit(target_transform.transform, data)
+        assert torch.equal(mapped, expected)
+        speedup = vectorize_duration / duration
+        print(f"{name:<24}{vectorize_duration:>18.4f}{duration:>18.4f}{speedup:>10.0f}")
+
+    expected, vectorize_duration = timeit(np.vectorize(reverse_mapper.get), preds)
+    mapped, duration = timeit(class_codes.__getitem__, preds)
+    assert np.array_equal(mapped.numpy(), expected)
+    speedup = vectorize_duration / duration
+    print(f"{'predictions':<24}{vectorize_duration:>18.4f}{duration:>18.4f}{speedup:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
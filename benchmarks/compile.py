@@ -0,0 +1,101 @@
+"""Benchmark of torch.compile for training steps of RandLa-Net: steps/s with and without compilation.
+
+Batches are random clouds with varying numbers of points, as subtiles after GridSampling, so that
+recompilations for new shapes are accounted for. Neighbors are searched in each step, as with the
+default config, or once beforehand with --precomputed-hierarchy, as with the `precomputed` config
+of `datamodule/transforms/hierarchy`. The first steps of each setting are excluded from timings.
+
+Usage:
+    python benchmarks/compile.py --num-steps 20 --batch-size 4 --max-points 12000
+
+"""
+
+import argparse
+import time
+
+import torch
+from torch_geometric.data import Batch, Data
+
+from myria3d.models.modules.pyg_randla_net import PyGRandLANet, build_neighbors_hierarchy
+
+NUM_FEATURES = 9
+NUM_CLASSES = 7
+
+
+def make_batches(num_batches, batch_size, min_points, max_points, precomputed_hierarchy):
+    generator = torch.Generator().manual_seed(0)
+    batches = []
+    for _ in range(num_batches):
+        num_points = torch.randint(min_points, max_points + 1, (batch_size,), generator=generator)
+        batch = Batch.from_data_list(
+            [
+                Data(
+                    x=torch.rand((n, NUM_FEATURES), generator=generator),
+                    pos=torch.rand((n, 3), generator=generator),
+                    y=torch.randint(NUM_CLASSES, (n,), generator=generator),
+                )
+                for n in num_points.tolist()
+            ]
+        )
+        hierarchy = None
+        if precomputed_hierarchy:
+            hierarchy = build_neighbors_hierarchy(batch.pos, batch.batch, batch.ptr, 16, 4)
+        batches.append((batch, hierarchy))
+    return batches
+
+
+def benchmark(batches, compile, num_warmup_steps, lfa_mode, backend):
+    torch.manual_seed(0)
+    net = PyGRandLANet(NUM_FEATURES, NUM_CLASSES, return_logits=True, lfa_mode=lfa_mode)
+    forward = net.forward
+    if compile:
+        forward = torch.compile(net.forward, dynamic=True, backend=backend)
+    optimizer = torch.optim.Adam(net.parameters())
+    criterion = torch.nn.CrossEntropyLoss()
+
+    start = time.perf_counter()
+    for step, (batch, hierarchy) in enumerate(batches):
+        if step == num_warmup_steps:
+            warmup_duration = time.perf_counter() - start
+            start = time.perf_counter()
+        optimizer.zero_grad()
+        logits = forward(batch.x, batch.pos, batch.batch, batch.ptr, hierarchy=hierarchy)
+        loss = criterion(logits, batch.y)
+        loss.backward()
+        optimizer.step()
+    duration = time.perf_counter() - start
+    return warmup_duration, (len(batches) - num_warmup_steps) / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--num-steps", type=int, default=20, help="Timed steps per setting.")
+    parser.add_argument("--num-warmup-steps", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--min-points", type=int, default=6000)
+    parser.add_argument("--max-points", type=int, default=12000)
+    parser.add_argument("--lfa-mode", default="sparse", choices=["sparse", "dense"])
+    parser.add_argument("--precomputed-hierarchy", action="store_true")
+    parser.add_argument("--backend", default="inductor", help="Backend of torch.compile.")
+    parser.add_argument("--num-threads", type=int, default=None, help="Threads of torch on CPU.")
+    args = parser.parse_args()
+
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+    batches = make_batches(
+        args.num_warmup_steps + args.num_steps,
+        args.batch_size,
+        args.min_points,
+        args.max_points,
+        args.precomputed_hierarchy,
+    )
+    print(f"{'compile':<10}{'warmup (s)':>12}{'steps/s':>10}")
+    for compile in [False, True]:
+        warmup_duration, steps_per_second = benchmark(
+            batches, compile, args.num_warmup_steps, args.lfa_mode, args.backend
+        )
+        print(f"{str(compile):<10}{warmup_duration:>12.1f}{steps_per_second:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
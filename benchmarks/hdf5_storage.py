@@ -0,0 +1,86 @@
+"""Benchmark of HDF5 storage options and schemas: file size, bytes read and samples/s of HDF5Dataset.__getitem__.
+
+An existing HDF5 dataset is converted with each storage setting, then samples are read in a random
+order. Bytes read are counted at the file level, i.e. before any OS caching, which is what matters
+on a network filesystem.
+
+Usage:
+    python benchmarks/hdf5_storage.py --hdf5-file-path path/to/dataset.hdf5 --output-dir /tmp/hdf5_storage
+
+"""
+
+import argparse
+import io
+import os
+import time
+
+import h5py
+import numpy as np
+
+from myria3d.pctl.dataset.hdf5 import HDF5Dataset, convert_hdf5_layout
+
+SETTINGS = {
+    "uncompressed": None,
+    "lzf": {"compression": "lzf"},
+    "lzf_shuffle": {"compression": "lzf", "shuffle": True},
+    "gzip_1_shuffle": {"compression": "gzip", "compression_level": 1, "shuffle": True},
+    "gzip_4_shuffle": {"compression": "gzip", "compression_level": 4, "shuffle": True},
+    "blosc_lz4_shuffle": {"compression": "blosc", "compression_level": 5, "shuffle": True},
+}
+
+
+class ByteCountingFile(io.FileIO):
+    """A file object that counts the bytes read from it."""
+
+    bytes_read = 0
+
+    def readinto(self, buffer):
+        n = super().readinto(buffer)
+        self.bytes_read += n or 0
+        return n
+
+
+def benchmark(hdf5_file_path: str, num_samples: int, seed: int = 0):
+    dataset = HDF5Dataset(
+        hdf5_file_path,
+        epsg=None,
+        las_paths_by_split_dict=None,
+        train_transform=None,
+        eval_transform=None,
+    )
+    indices = np.random.default_rng(seed).permutation(len(dataset))[:num_samples]
+    counting_file = ByteCountingFile(hdf5_file_path, "r")
+    dataset.dataset = h5py.File(counting_file, "r")
+    start = time.perf_counter()
+    for idx in indices:
+        dataset[int(idx)]
+    duration = time.perf_counter() - start
+    dataset.dataset.close()
+    counting_file.close()
+    return counting_file.bytes_read, len(indices) / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--hdf5-file-path", required=True, help="HDF5 dataset to convert.")
+    parser.add_argument("--output-dir", required=True, help="Where to write converted datasets.")
+    parser.add_argument("--layout", default="groups", choices=["groups", "flat"])
+    parser.add_argument("--schema", default="standard", choices=["standard", "compact"])
+    parser.add_argument("--chunk-rows", type=int, default=None, help="Points per chunk.")
+    parser.add_argument("--num-samples", type=int, default=500, help="Samples read per setting.")
+    parser.add_argument("--settings", nargs="+", default=list(SETTINGS), choices=list(SETTINGS))
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    print(f"{'setting':<20}{'size (MB)':>12}{'read (MB)':>12}{'samples/s':>12}")
+    for name in args.settings:
+        storage = dict(SETTINGS[name] or {}, chunk_rows=args.chunk_rows)
+        hdf5_file_path = os.path.join(args.output_dir, f"{args.layout}_{args.schema}_{name}.hdf5")
+        convert_hdf5_layout(args.hdf5_file_path, hdf5_file_path, args.layout, storage, args.schema)
+        bytes_read, samples_per_second = benchmark(hdf5_file_path, args.num_samples)
+        size = os.path.getsize(hdf5_file_path)
+        print(f"{name:<20}{size / 1e6:>12.1f}{bytes_read / 1e6:>12.1f}{samples_per_second:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
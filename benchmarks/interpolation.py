@@ -0,0 +1,71 @@
+"""Benchmark of interpolation of logits back to all points of subtiles: points/s of each engine.
+
+Batches are random subtiles, with a fraction of their points kept as subsampled points, as with
+GridSampling. Interpolated logits of each engine are compared to those of the first one.
+
+Usage:
+    python benchmarks/interpolation.py --batch-size 10 --num-points 60000 --num-workers 1 4
+
+"""
+
+import argparse
+import time
+
+import torch
+from torch_geometric.data import Batch, Data
+
+from myria3d.models.interpolation import interpolate_logits_to_full_subtiles
+from myria3d.pctl.dataloader.dataloader import GeometricNoneProofCollater
+
+NUM_CLASSES = 7
+
+
+def make_batch(batch_size, num_points, sampling_ratio):
+    generator = torch.Generator().manual_seed(0)
+    samples = []
+    for _ in range(batch_size):
+        pos = torch.rand((num_points, 3), generator=generator) * 50
+        num_sampled = int(num_points * sampling_ratio)
+        sampled = torch.randperm(num_points, generator=generator)[:num_sampled]
+        samples.append(
+            Data(
+                pos=pos[sampled],
+                copies={"pos_copy": pos, "pos_sampled_copy": pos[sampled]},
+            )
+        )
+    batch: Batch = GeometricNoneProofCollater()(samples)
+    logits = torch.rand((batch.num_nodes, NUM_CLASSES), generator=generator)
+    return batch, logits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--num-points", type=int, default=60000, help="Points per subtile.")
+    parser.add_argument("--sampling-ratio", type=float, default=0.2)
+    parser.add_argument("--k", type=int, default=10, help="Number of neighbors.")
+    parser.add_argument("--num-repeats", type=int, default=3)
+    engines = ["knn_interpolate", "kdtree"]
+    parser.add_argument("--engines", nargs="+", default=engines, choices=engines)
+    parser.add_argument("--num-workers", type=int, nargs="+", default=[1, 4])
+    args = parser.parse_args()
+
+    batch, logits = make_batch(args.batch_size, args.num_points, args.sampling_ratio)
+    num_points = batch.copies["pos_copy"].size(0)
+    reference = None
+    print(f"{'engine':<18}{'workers':>8}{'points/s':>14}{'max diff':>12}")
+    for engine in args.engines:
+        for num_workers in args.num_workers:
+            start = time.perf_counter()
+            for _ in range(args.num_repeats):
+                interpolated = interpolate_logits_to_full_subtiles(
+                    logits, batch, args.k, num_workers, engine
+                )
+            points_per_second = args.num_repeats * num_points / (time.perf_counter() - start)
+            reference = interpolated if reference is None else reference
+            max_diff = (interpolated - reference).abs().max().item()
+            print(f"{engine:<18}{num_workers:>8}{points_per_second:>14.0f}{max_diff:>12.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Benchmark of CPU optimizations of a trained model: IoU, agreement with the float model, and seconds per batch.
+
+Batches of an existing HDF5 dataset are prepared with the eval transforms of the repository config,
+and neighbors of each batch are searched once, so that all variants of the neural network see the
+same points and neighborhoods. IoU is computed on subsampled points, as during validation.
+
+Usage:
+    python benchmarks/quantization.py --ckpt-path path/to/checkpoint.ckpt \
+        --hdf5-file-path path/to/dataset.hdf5 --overrides experiment=RandLaNet_base_run_FR
+
+"""
+
+import argparse
+import os
+import time
+
+import hydra
+import torch
+from hydra import compose, initialize_config_dir
+from torchmetrics.classification import MulticlassConfusionMatrix
+
+from myria3d.metrics.iou import iou
+from myria3d.models.model import Model
+from myria3d.models.modules.pyg_randla_net import build_neighbors_hierarchy
+from myria3d.models.quantization import optimize_for_cpu_inference
+from myria3d.pctl.dataloader.dataloader import GeometricNoneProofDataloader
+from myria3d.pctl.transforms.transforms import get_neighbors_hierarchy
+
+CONFIGS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "configs")
+QUANTIZATIONS = [None, "fold_bn", "dynamic_int8"]
+
+
+@torch.no_grad()
+def benchmark(ckpt_path, hdf5_file_path, overrides, split, num_batches, batch_size):
+    with initialize_config_dir(config_dir=CONFIGS_DIR, version_base=None):
+        config = compose(
+            config_name="config",
+            overrides=[
+                "work_dir=.",
+                f"datamodule.hdf5_file_path={hdf5_file_path}",
+                f"datamodule.batch_size={batch_size}",
+            ]
+            + overrides,
+        )
+    datamodule = hydra.utils.instantiate(config.datamodule)
+    dataset = datamodule.dataset.valdata if split == "val" else datamodule.dataset.testdata
+    dataloader = GeometricNoneProofDataloader(dataset, batch_size=batch_size, shuffle=False)
+
+    net = Model.load_from_checkpoint(ckpt_path, map_location="cpu").model.eval()
+    nets = {q: optimize_for_cpu_inference(net, q) for q in QUANTIZATIONS}
+    num_classes = len(config.dataset_description.classification_dict)
+    confmats = {q: MulticlassConfusionMatrix(num_classes) for q in QUANTIZATIONS}
+    agreements = {q: [] for q in QUANTIZATIONS}
+    durations = {q: 0.0 for q in QUANTIZATIONS}
+
+    batches = [batch for _, batch in zip(range(num_batches), dataloader) if batch is not None]
+    for batch in batches:
+        hierarchy = get_neighbors_hierarchy(batch) or build_neighbors_hierarchy(
+            batch.pos, batch.batch, batch.ptr, net.num_neighbors, net.decimation
+        )
+        float_preds = None
+        for q, quantized_net in nets.items():
+            start = time.perf_counter()
+            logits = quantized_net(batch.x, batch.pos, batch.batch, batch.ptr, hierarchy=hierarchy)
+            durations[q] += time.perf_counter() - start
+            preds = logits.argmax(dim=1)
+            float_preds = preds if float_preds is None else float_preds
+            confmats[q].update(preds, batch.y)
+            agreements[q].append((preds == float_preds).float().mean())
+
+    print(f"{'quantization':<16}{'IoU':>10}{'agreement':>12}{'s/batch':>12}")
+    for q in QUANTIZATIONS:
+        mean_iou = iou(confmats[q].compute()).mean().item()
+        agreement = torch.stack(agreements[q]).mean().item()
+        seconds = durations[q] / len(batches)
+        print(f"{str(q):<16}{mean_iou:>10.4f}{agreement:>12.4f}{seconds:>12.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ckpt-path", required=True, help="Trained model.")
+    parser.add_argument("--hdf5-file-path", required=True, help="HDF5 dataset.")
+    parser.add_argument("--overrides", nargs="*", default=[], help="Overrides of the hydra config.")
+    parser.add_argument("--split", default="val", choices=["val", "test"])
+    parser.add_argument("--num-batches", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--num-threads", type=int, default=None, help="Threads of torch on CPU.")
+    args = parser.parse_args()
+
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+    benchmark(
+        args.ckpt_path,
+        args.hdf5_file_path,
+        args.overrides,
+        args.split,
+        args.num_batches,
+        args.batch_size,
+    )
+
+
+if __name__ == "__main__":
+    main()
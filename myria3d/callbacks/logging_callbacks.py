@@ -0,0 +1,49 @@
+from pytorch_lightning import Callback, LightningModule, Trainer
+
+from myria3d.utils import utils
+
+log = utils.get_logger(__name__)
+
+
+class LogSampleCacheStats(Callback):
+    """Logs the hit rate of the cache of samples in shared memory, at the end of each epoch.
+
+    The hit rate covers all accesses to the cache since the previous epoch, by all DataLoader
+    workers and all ranks on the node (i.e. both training and validation samples), during this run
+    only. Does nothing if the datamodule has no cache of samples.
+
+    """
+
+    def __init__(self):
+        self._previous_stats = {"hits": 0, "misses": 0}
+
+    def on_train_start(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        # The cache outlives runs: hits and misses of previous runs are not counted.
+        sample_cache = self._get_sample_cache(trainer)
+        if sample_cache is not None:
+            self._previous_stats = sample_cache.stats()
+
+    def on_train_epoch_end(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        sample_cache = self._get_sample_cache(trainer)
+        if sample_cache is None:
+            return
+        stats = sample_cache.stats()
+        hits = stats["hits"] - self._previous_stats["hits"]
+        misses = stats["misses"] - self._previous_stats["misses"]
+        self._previous_stats = stats
+        if not hits + misses:
+            return
+        hit_rate = hits / (hits + misses)
+        pl_module.log("sample_cache/hit_rate", hit_rate, on_step=False, on_epoch=True)
+        pl_module.log(
+            "sample_cache/size_bytes", float(stats["size"]), on_step=False, on_epoch=True
+        )
+        log.info(
+            f"Sample cache: {hit_rate:.1%} hit rate ({hits} hits, {misses} misses), "
+            f"{stats['size'] / 1e9:.2f} GB used."
+        )
+
+    @staticmethod
+    def _get_sample_cache(trainer: Trainer):
+        dataset = getattr(trainer.datamodule, "dataset", None)
+        return getattr(dataset, "sample_cache", None)
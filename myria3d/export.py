@@ -0,0 +1,50 @@
+import os
+import os.path as osp
+
+import hydra
+import torch
+from omegaconf import DictConfig
+from pytorch_lightning import LightningDataModule
+
+from myria3d.models.export import make_package
+from myria3d.models.model import Model
+from myria3d.utils import utils
+
+log = utils.get_logger(__name__)
+
+
+def get_export_path(config: DictConfig) -> str:
+    """Path of the package: predict.export_path, or the checkpoint basename in predict.output_dir."""
+    export_path = config.predict.get("export_path")
+    if export_path:
+        return export_path
+    basename = osp.splitext(osp.basename(config.predict.ckpt_path))[0]
+    return osp.join(config.predict.output_dir, f"{basename}.package.pt")
+
+
+@utils.eval_time
+def export(config: DictConfig) -> str:
+    """Export a trained model and its preprocessing as a package for lightweight inference.
+
+    The package holds the neural network, the predict transforms of the datamodule, and the
+    parameters of interpolation, as set in the configuration of inference. It is used by
+    myria3d.predict_exported, which needs neither Lightning checkpoints nor hydra configurations.
+
+    Args:
+        config (DictConfig): Configuration composed by Hydra, as for inference.
+
+    Returns:
+        str: path to the package.
+
+    """
+    assert os.path.exists(config.predict.ckpt_path)
+
+    datamodule: LightningDataModule = hydra.utils.instantiate(config.datamodule)
+    model = Model.load_from_checkpoint(config.predict.ckpt_path, map_location="cpu")
+    package = make_package(model, datamodule, config)
+
+    export_path = get_export_path(config)
+    os.makedirs(osp.dirname(osp.abspath(export_path)), exist_ok=True)
+    torch.save(package, export_path)
+    log.info(f"Model exported to: \n {export_path}\n")
+    return export_path
@@ -0,0 +1,122 @@
+"""A self-contained package of a trained neural network and of its preprocessing, for lightweight inference.
+
+A package is a single file written with torch.save. It holds the weights of the neural network
+with the hyperparameters needed to rebuild it, the (already instantiated) transforms that turn a
+LAS file into samples, and the parameters of the interpolation of predictions back to the LAS.
+Inference from a package needs neither the Lightning checkpoint nor the hydra configuration.
+
+"""
+
+from typing import Any, Dict, Union
+
+import torch
+from omegaconf import DictConfig, OmegaConf
+from torch import nn
+from torch_geometric.data import Batch
+
+from myria3d.models.interpolation import interpolate_logits_to_full_subtiles
+from myria3d.pctl.transforms.transforms import get_neighbors_hierarchy
+
+PACKAGE_FORMAT_VERSION = 1
+
+
+def make_package(model: nn.Module, datamodule, config: DictConfig) -> Dict[str, Any]:
+    """Gather the neural network of a trained model and the preprocessing of a datamodule into a package.
+
+    Args:
+        model (nn.Module): trained lightning module, of class myria3d.models.model.Model.
+        datamodule (HDF5LidarDataModule): datamodule whose predict transforms are packaged.
+        config (DictConfig): configuration of inference, for dataset description and interpolation.
+
+    Returns:
+        Dict[str, Any]: the package, ready to be saved with torch.save.
+
+    """
+    interpolator_config = OmegaConf.to_container(config.predict.interpolator, resolve=True)
+    dataset_description = OmegaConf.to_container(config.dataset_description, resolve=True)
+    dataset_description.pop("_convert_", None)
+    return {
+        "format_version": PACKAGE_FORMAT_VERSION,
+        # Classes are pickled by reference, and the myria3d code is needed to load the package.
+        "neural_net_class": type(model.model),
+        "neural_net_hparams": dict(model.hparams.neural_net_hparams),
+        "state_dict": {k: v.cpu() for k, v in model.model.state_dict().items()},
+        "interpolation_k": model.hparams.interpolation_k,
+        "num_workers": model.hparams.num_workers,
+        "interpolation_engine": model.hparams.get("interpolation_engine", "knn_interpolate"),
+        "dataset_description": dataset_description,
+        "inference_dataset": {
+            "epsg": datamodule.epsg,
+            "points_pre_transform": datamodule.points_pre_transform,
+            "pre_filter": datamodule.pre_filter,
+            "transform": datamodule.predict_transform,
+            "tile_width": datamodule.tile_width,
+            "subtile_width": datamodule.subtile_width,
+            "subtile_overlap": datamodule.subtile_overlap_predict,
+            "subtile_splitting_method": datamodule.subtile_splitting_method,
+        },
+        "batch_size": datamodule.batch_size,
+        "interpolator": {
+            "interpolation_k": interpolator_config["interpolation_k"],
+            "classification_dict": dataset_description["classification_dict"],
+            "probas_to_save": interpolator_config["probas_to_save"],
+            "predicted_classification_channel": interpolator_config.get(
+                "predicted_classification_channel", "PredictedClassification"
+            ),
+            "entropy_channel": interpolator_config.get("entropy_channel", "entropy"),
+            "accumulator_dtype": interpolator_config.get("accumulator_dtype", "float32"),
+            "accumulator_dir": interpolator_config.get("accumulator_dir"),
+        },
+    }
+
+
+def load_package(package_path: str) -> Dict[str, Any]:
+    """Load a package written by myria3d.export.
+
+    Raises:
+        ValueError: if the package was written in another format version.
+
+    """
+    # Packages hold pickled transforms, and not only tensors.
+    package = torch.load(package_path, map_location="cpu", weights_only=False)
+    if package.get("format_version") != PACKAGE_FORMAT_VERSION:
+        raise ValueError(
+            f"Package {package_path} has format version {package.get('format_version')}, "
+            f"but version {PACKAGE_FORMAT_VERSION} is expected. Export the model again."
+        )
+    return package
+
+
+class ExportedModel(nn.Module):
+    """The neural network of a package, with the interpolation of logits back to all points of subtiles.
+
+    Equivalent to the inference mode of myria3d.models.model.Model, without Lightning.
+
+    """
+
+    def __init__(self, package: Union[str, Dict[str, Any]]):
+        """Initialization method.
+
+        Args:
+            package (Union[str, Dict[str, Any]]): a package, or the path to a package file.
+
+        """
+        super().__init__()
+        if isinstance(package, str):
+            package = load_package(package)
+        self.model = package["neural_net_class"](**package["neural_net_hparams"])
+        self.model.load_state_dict(package["state_dict"])
+        self.interpolation_k = package["interpolation_k"]
+        self.num_workers = package["num_workers"]
+        self.interpolation_engine = package.get("interpolation_engine", "knn_interpolate")
+
+    def forward(self, batch: Batch) -> torch.Tensor:
+        """Predict logits of all points of the subtiles of a batch (N, C), on CPU."""
+        hierarchy = get_neighbors_hierarchy(batch)
+        if hierarchy is not None:
+            logits = self.model(batch.x, batch.pos, batch.batch, batch.ptr, hierarchy=hierarchy)
+        else:
+            logits = self.model(batch.x, batch.pos, batch.batch, batch.ptr)
+        return interpolate_logits_to_full_subtiles(
+            logits, batch, self.interpolation_k, self.num_workers, self.interpolation_engine
+        )
@@ -1,19 +1,145 @@
 import logging
 import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Literal, Optional, Tuple, Union
 
 import numpy as np
 import pdal
 import torch
+from scipy.spatial import cKDTree
 from torch.distributions import Categorical
-from torch_scatter import scatter_sum
+from torch_geometric.data import Batch
+from torch_geometric.nn import knn_interpolate
 
 from pdaltools import las_info
 
-from myria3d.pctl.dataset.utils import get_pdal_info_metadata, get_pdal_reader
+from myria3d.pctl.dataloader.dataloader import make_batch_vector
+from myria3d.pctl.dataset.las_header import read_las_header
+from myria3d.pctl.dataset.utils import get_pdal_reader, pdal_read_las_array_and_metadata
 
 log = logging.getLogger(__name__)
 
+INTERPOLATION_ENGINE = Literal["knn_interpolate", "kdtree"]
+# Number of points of which probabilities are computed at once when saving predictions.
+REDUCTION_CHUNK_SIZE = 1_000_000
+
+
+def get_batch_tensor_by_enumeration(pos_x: List[np.ndarray]) -> torch.Tensor:
+    """Get batch tensor (e.g. [0,0,1,1,2,2,...,B-1,B-1] )
+    from shape B,N,... to shape (N,...).
+    """
+    return make_batch_vector([len(sample_pos) for sample_pos in pos_x])
+
+
+def get_num_interpolation_workers(num_workers: Optional[int]) -> int:
+    """Number of threads of interpolation, defaulting to the CPUs available to this process."""
+    if num_workers:
+        return num_workers
+    return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+
+
+def kdtree_interpolate(
+    x: torch.Tensor,
+    pos_x: torch.Tensor,
+    pos_y: torch.Tensor,
+    batch_x: torch.Tensor,
+    batch_y: torch.Tensor,
+    k: int,
+    num_workers: int = 1,
+) -> torch.Tensor:
+    """Inverse-distance interpolation of features, like torch_geometric's knn_interpolate.
+
+    A KD-tree is built over the points of each sample, and samples are interpolated in parallel
+    by a pool of threads: scipy queries and torch operations release the GIL. Neighbors and
+    weights are computed once per point and shared by all channels of the features.
+
+    Args:
+        x (torch.Tensor): features of the source points (N, C), on CPU.
+        pos_x (torch.Tensor): positions of the source points (N, 3).
+        pos_y (torch.Tensor): positions of the target points (M, 3).
+        batch_x (torch.Tensor): sorted batch vector of the source points (N,).
+        batch_y (torch.Tensor): sorted batch vector of the target points (M,).
+        k (int): number of neighbors.
+        num_workers (int, optional): number of threads. Defaults to 1.
+
+    Returns:
+        torch.Tensor: interpolated features of the target points (M, C).
+
+    """
+    num_samples = int(max(batch_x.max(), batch_y.max())) + 1 if batch_y.numel() else 0
+    ptr_x = torch.cumsum(torch.bincount(batch_x, minlength=num_samples), 0).tolist()
+    ptr_y = torch.cumsum(torch.bincount(batch_y, minlength=num_samples), 0).tolist()
+    y = x.new_zeros((pos_y.size(0), x.size(1)))
+
+    def interpolate_sample(i: int) -> None:
+        start_x, end_x = ptr_x[i - 1] if i else 0, ptr_x[i]
+        start_y, end_y = ptr_y[i - 1] if i else 0, ptr_y[i]
+        if start_x == end_x or start_y == end_y:
+            return
+        sample_k = min(k, end_x - start_x)
+        tree = cKDTree(pos_x[start_x:end_x].numpy())
+        distances, neighbors = tree.query(pos_y[start_y:end_y].numpy(), k=sample_k)
+        distances = torch.from_numpy(distances).view(-1, sample_k).to(x.dtype)
+        neighbors = torch.from_numpy(neighbors).view(-1, sample_k)
+        # Same weights as knn_interpolate: inverse of squared distances.
+        weights = 1.0 / torch.clamp(distances.square(), min=1e-16)
+        weights = weights / weights.sum(dim=1, keepdim=True)
+        y[start_y:end_y] = torch.einsum("mk,mkc->mc", weights, x[start_x:end_x][neighbors])
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        list(executor.map(interpolate_sample, range(num_samples)))
+    return y
+
+
+def interpolate_logits_to_full_subtiles(
+    logits: torch.Tensor,
+    batch: Batch,
+    interpolation_k: int,
+    num_workers: Optional[int] = 1,
+    engine: INTERPOLATION_ENGINE = "knn_interpolate",
+) -> torch.Tensor:
+    """Interpolate logits of subsampled points back to all points of their subtiles.
+
+    Args:
+        logits (torch.Tensor): logits of subsampled points.
+        batch (Batch): batch with copies of positions before and after subsampling, and the
+            `pos_copy_batch` vector of full positions made by GeometricNoneProofCollater.
+        interpolation_k (int): number of neighbors for inverse-distance averaging of logits.
+        num_workers (int, optional): number of workers of the knn search, or None for all
+            available CPUs. Defaults to 1.
+        engine (INTERPOLATION_ENGINE, optional): "knn_interpolate" from torch_geometric, or
+            "kdtree" for KD-trees of samples queried in parallel threads. Defaults to
+            "knn_interpolate".
+
+    Returns:
+        torch.Tensor: logits of all points of the subtiles, on CPU and in full precision.
+
+    """
+    if engine not in ["knn_interpolate", "kdtree"]:
+        raise ValueError(
+            f"Argument `engine` should be 'knn_interpolate' or 'kdtree'. (Current value: {engine})"
+        )
+    # KNN is way faster on CPU than on GPU by a 3 to 4 factor. Copies of positions are kept on CPU
+    # by transfer_batch_to_device, so that only logits and the batch vector may need a transfer.
+    # Logits may be in reduced precision under autocast, and are interpolated in full precision.
+    logits = logits.float().cpu()
+    if "pos_copy_batch" in batch:
+        batch_y = batch.pos_copy_batch
+    else:
+        # Batches from another collater, e.g. with Lightning's overfit_batches.
+        batch_y = get_batch_tensor_by_enumeration(batch.idx_in_original_cloud)
+    interpolate = kdtree_interpolate if engine == "kdtree" else knn_interpolate
+    return interpolate(
+        logits,
+        batch.copies["pos_sampled_copy"],
+        batch.copies["pos_copy"],
+        batch_x=batch.batch.cpu(),
+        batch_y=batch_y,
+        k=interpolation_k,
+        num_workers=get_num_interpolation_workers(num_workers),
+    )
+
 
 class Interpolator:
     """A class to load, update with classification, update with probas (optionnal), and save a LAS."""
@@ -25,6 +151,8 @@ class Interpolator:
         probas_to_save: Union[List[str], Literal["all"]] = "all",
         predicted_classification_channel: Optional[str] = "PredictedClassification",
         entropy_channel: Optional[str] = "entropy",
+        accumulator_dtype: Literal["float32", "float16"] = "float32",
+        accumulator_dir: Optional[str] = None,
     ):
         """Initialization method.
         Args:
@@ -32,6 +160,9 @@ class Interpolator:
             classification_dict (Dict[int, str], optional): Mapper from classification code to class name (e.g. {6:building}). Defaults {}.
             probas_to_save (List[str] or "all", optional): Specific probabilities to save as new LAS dimensions.
             Override with None for no saving of probabilities. Defaults to "all".
+            accumulator_dtype (str, optional): dtype of the sums of logits of all points, "float32" or "float16". Defaults to "float32".
+            accumulator_dir (str, optional): Directory of a temporary file to memory-map the sums of logits to, e.g. on a local disk.
+            Defaults to None, to keep them in memory.
 
 
         """
@@ -53,9 +184,47 @@ class Interpolator:
             class_index: class_code
             for class_index, class_code in enumerate(classification_dict.keys())
         }
+        # Same mapping as a lookup table, indexed by class index.
+        self.class_codes = torch.tensor(list(classification_dict.keys()), dtype=torch.long)
+
+        if accumulator_dtype not in ["float32", "float16"]:
+            raise ValueError(
+                "Argument `accumulator_dtype` should be 'float32' or 'float16'. "
+                f"(Current value: {accumulator_dtype})"
+            )
+        self.accumulator_dtype = accumulator_dtype
+        self.accumulator_dir = accumulator_dir
+        self.nb_points: Optional[int] = None
+        # Sums of logits (nb_points, C) and numbers of predictions (nb_points,) of all points,
+        # allocated at the first batch, when the number of classes is known.
+        self.summed_logits: Optional[torch.Tensor] = None
+        self.prediction_counts: Optional[torch.Tensor] = None
+
+    def allocate_accumulator(self, src_las: str, nb_points: Optional[int] = None) -> None:
+        """Prepare the accumulation of predictions for all points of a LAS.
 
-        self.logits: List[torch.Tensor] = []
-        self.idx_in_full_cloud_list: List[np.ndarray] = []
+        Args:
+            src_las (str): path to the LAS to predict on.
+            nb_points (int, optional): number of points of the LAS, if already known. Defaults to
+                None, to read it from the LAS header.
+
+        """
+        if nb_points is None:
+            # Read number of points only from las header in order to minimize memory usage
+            nb_points = read_las_header(src_las).point_count
+        self.nb_points = nb_points
+        self.summed_logits = None
+        self.prediction_counts = torch.zeros((nb_points,), dtype=torch.int32)
+
+    def _allocate_summed_logits(self, num_classes: int) -> torch.Tensor:
+        shape = (self.nb_points, num_classes)
+        if self.accumulator_dir is None:
+            return torch.zeros(shape, dtype=getattr(torch, self.accumulator_dtype))
+        # The temporary file has no name, and its disk space is freed with the memory map.
+        os.makedirs(self.accumulator_dir, exist_ok=True)
+        with tempfile.TemporaryFile(dir=self.accumulator_dir) as f:
+            memmap = np.memmap(f, dtype=self.accumulator_dtype, mode="w+", shape=shape)
+        return torch.from_numpy(memmap)
 
     def load_full_las_for_update(self, src_las: str, epsg: str) -> Tuple[np.ndarray, Dict]:
         """Loads a LAS and adds necessary extradim.
@@ -85,43 +254,104 @@ class Interpolator:
             pipeline |= pdal.Filter.assign(value=f"{self.entropy_channel}=0")
 
         pipeline.execute()
-        writer_params = las_info.get_writer_parameters_from_reader_metadata(
-            pipeline.metadata, a_srs=f"EPSG:{epsg}" if str(epsg).isdigit() else epsg
+        return pipeline.arrays[0], self.get_writer_parameters(pipeline.metadata, epsg)
+
+    def read_las_with_prediction_dimensions(
+        self, src_las: str, epsg: str
+    ) -> Tuple[np.ndarray, Dict]:
+        """Read a LAS once, for both inference and update with predictions.
+
+        Unlike load_full_las_for_update, new dimensions are added with numpy, so that the
+        same array can be split into samples before inference (see InferenceDataset).
+
+        """
+        las, metadata = pdal_read_las_array_and_metadata(src_las, epsg)
+        return self.add_prediction_dimensions(las), self.get_writer_parameters(metadata, epsg)
+
+    @staticmethod
+    def get_writer_parameters(metadata: Dict, epsg: str) -> Dict:
+        """Parameters of a LAS writer, from the metadata of the pipeline that read the LAS."""
+        return las_info.get_writer_parameters_from_reader_metadata(
+            metadata, a_srs=f"EPSG:{epsg}" if str(epsg).isdigit() else epsg
         )
-        return pipeline.arrays[0], writer_params
 
-    def store_predictions(self, logits, idx_in_original_cloud) -> None:
-        """Keep a list of predictions made so far."""
-        self.logits += [logits]
-        self.idx_in_full_cloud_list += idx_in_original_cloud
+    def add_prediction_dimensions(self, las: np.ndarray) -> np.ndarray:
+        """Same as the pdal filters of load_full_las_for_update, for a LAS that was already read.
 
-    @torch.no_grad()
-    def reduce_predicted_logits(self, nb_points) -> Tuple[torch.Tensor, np.ndarray]:
-        """Interpolate logits to points without predictions using an inverse-distance weightning scheme.
+        The named array is extended with new dimensions, which are doubles as with pdal.
+
+        Args:
+            las (np.ndarray): named array with all dimensions of a LAS.
 
         Returns:
-            torch.Tensor, torch.Tensor: interpolated logits classification
+            np.ndarray: the extended array, with null probabilities and entropy, and predicted
+            classification initialized with Classification.
 
         """
+        # Dimensions in the same order as with pdal.
+        dims = [(dim, np.float64) for dim in self.probas_to_save]
+        copy_classification = self.predicted_classification_channel not in [None, "Classification"]
+        if copy_classification:
+            # Copy from Classification to preserve data type
+            dims.append((self.predicted_classification_channel, las.dtype["Classification"]))
+        if self.entropy_channel:
+            dims.append((self.entropy_channel, np.float64))
+        new_dims = [(dim, dtype) for dim, dtype in dims if dim not in las.dtype.names]
+        dims_to_reset = [dim for dim, dtype in dims if dim != self.predicted_classification_channel]
 
-        # Concatenate elements from different batches
-        logits: torch.Tensor = torch.cat(self.logits).cpu()
-        idx_in_full_cloud: np.ndarray = np.concatenate(self.idx_in_full_cloud_list)
-        del self.logits
-        del self.idx_in_full_cloud_list
+        if new_dims:
+            extended_las = np.zeros(
+                las.shape, dtype=[(dim, las.dtype[dim]) for dim in las.dtype.names] + new_dims
+            )
+            for dim in las.dtype.names:
+                extended_las[dim] = las[dim]
+            las = extended_las
+        for dim in dims_to_reset:
+            las[dim] = 0
+        if copy_classification:
+            # Also preserves values of artefacts.
+            las[self.predicted_classification_channel] = las["Classification"]
+        return las
 
-        # We scatter_sum logits based on idx, in case there are multiple predictions for a point.
-        # scatter_sum reorders logits based on index,they therefore match las order.
-        reduced_logits = torch.zeros((nb_points, logits.size(1)))
-        scatter_sum(logits, torch.from_numpy(idx_in_full_cloud), out=reduced_logits, dim=0)
-        # reduced_logits contains logits ordered by their idx in original cloud !
-        # We need to select the points for which we have a prediction via idx_in_full_cloud.
-        # NB1 : some points may not contain any predictions if they were in small areas.
+    @torch.no_grad()
+    def store_predictions(self, logits, idx_in_original_cloud) -> None:
+        """Add logits of a batch to the sums of logits of their points in the original cloud.
+
+        Points may be predicted several times, e.g. with overlapping subtiles, and their logits
+        are summed. Memory is bounded by the (nb_points, C) sums, whatever the number of batches.
+
+        """
+        if self.prediction_counts is None:
+            raise RuntimeError("Call allocate_accumulator(src_las) before storing predictions.")
+        if self.summed_logits is None:
+            self.summed_logits = self._allocate_summed_logits(logits.size(1))
+        index = torch.from_numpy(np.concatenate(idx_in_original_cloud)).long()
+        logits = logits.detach().cpu().to(self.summed_logits.dtype)
+        self.summed_logits.index_add_(0, index, logits)
+        self.prediction_counts.index_add_(0, index, torch.ones_like(index, dtype=torch.int32))
+
+    @torch.no_grad()
+    def reduce_predicted_logits(self) -> Tuple[torch.Tensor, np.ndarray]:
+        """Sums of logits of points with at least one prediction, in the order of the original cloud.
+
+        NB: some points may not have any prediction, e.g. if they were in small areas.
 
-        return reduced_logits[idx_in_full_cloud], idx_in_full_cloud
+        Returns:
+            torch.Tensor, np.ndarray: summed logits in full precision, and indices of their points.
+
+        """
+        idx_in_full_cloud = torch.nonzero(self.prediction_counts).squeeze(1)
+        return self.summed_logits[idx_in_full_cloud].float(), idx_in_full_cloud.numpy()
 
     @torch.no_grad()
-    def reduce_predictions_and_save(self, raw_path: str, output_dir: str, epsg: str) -> str:
+    def reduce_predictions_and_save(
+        self,
+        raw_path: str,
+        output_dir: str,
+        epsg: str,
+        las: Optional[np.ndarray] = None,
+        writer_params: Optional[Dict] = None,
+    ) -> str:
         """Interpolate all predicted probabilites to their original points in LAS file, and save.
 
         Args:
@@ -130,48 +360,52 @@ class Interpolator:
             output_dir (Optional[str], optional): Directory to save output LAS with new predicted classification, entropy,
             and probabilities. Defaults to None.
             epsg (str): epsg to force the reading with
+            las (np.ndarray, optional): LAS already read and extended with add_prediction_dimensions, which is updated
+            in place. Defaults to None, to read the LAS again with load_full_las_for_update.
+            writer_params (Dict, optional): parameters of the LAS writer, required with `las` (see get_writer_parameters).
         Returns:
             str: path of the updated, saved LAS file.
 
         """
         basename = os.path.basename(raw_path)
-        # Read number of points only from las metadata in order to minimize memory usage
-        nb_points = get_pdal_info_metadata(raw_path)["count"]
-        logits, idx_in_full_cloud = self.reduce_predicted_logits(nb_points)
-
-        probas = torch.nn.Softmax(dim=1)(logits)
-
-        if self.predicted_classification_channel:
-            preds = torch.argmax(logits, dim=1)
-            preds = np.vectorize(self.reverse_mapper.get)(preds)
-
-        del logits
-
-        # Read las after fetching all information to write into it
-        las, writer_params = self.load_full_las_for_update(raw_path, epsg)
-
-        for idx, class_name in enumerate(self.classification_dict.values()):
-            if class_name in self.probas_to_save:
+        # Read las first: probabilities are computed and written chunk by chunk, so that at most a
+        # chunk of logits is copied out of the accumulator at a time.
+        if las is None:
+            las, writer_params = self.load_full_las_for_update(raw_path, epsg)
+        idx_in_full_cloud = torch.nonzero(self.prediction_counts).squeeze(1)
+        class_indices_to_save = [
+            (idx, class_name)
+            for idx, class_name in enumerate(self.classification_dict.values())
+            if class_name in self.probas_to_save
+        ]
+        for chunk_idx in torch.split(idx_in_full_cloud, REDUCTION_CHUNK_SIZE):
+            logits = self.summed_logits[chunk_idx].float()
+            probas = torch.nn.Softmax(dim=1)(logits)
+            chunk_idx = chunk_idx.numpy()
+            for idx, class_name in class_indices_to_save:
                 # NB: Values for which we do not have a prediction (i.e. artefacts) get null probabilities.
-                las[class_name][idx_in_full_cloud] = probas[:, idx]
+                las[class_name][chunk_idx] = probas[:, idx]
+            if self.predicted_classification_channel:
+                # NB: Values for which we do not have a prediction (i.e. artefacts) keep their original class.
+                preds = torch.argmax(logits, dim=1)
+                las[self.predicted_classification_channel][chunk_idx] = self.class_codes[preds]
+            if self.entropy_channel:
+                # NB: Values for which we do not have a prediction (i.e. artefacts) get null entropy.
+                las[self.entropy_channel][chunk_idx] = Categorical(probs=probas).entropy()
+        del idx_in_full_cloud
+        self.summed_logits = None
+        self.prediction_counts = None
 
         if self.predicted_classification_channel:
-            # NB: Values for which we do not have a prediction (i.e. artefacts) keep their original class.
-            las[self.predicted_classification_channel][idx_in_full_cloud] = preds
             log.info(
                 f"Saving predicted classes to channel {self.predicted_classification_channel}."
                 "Channel name can be changed by setting `predict.interpolator.predicted_classification_channel`."
             )
-            del preds
-
         if self.entropy_channel:
-            # NB: Values for which we do not have a prediction (i.e. artefacts) get null entropy.
-            las[self.entropy_channel][idx_in_full_cloud] = Categorical(probs=probas).entropy()
             log.info(
                 f"Saving Shannon entropy of probabilities to channel {self.entropy_channel}."
                 "Channel name can be changed by setting `predict.interpolator.entropy_channel`"
             )
-        del idx_in_full_cloud
 
         os.makedirs(output_dir, exist_ok=True)
         out_f = os.path.join(output_dir, basename)
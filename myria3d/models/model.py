@@ -2,12 +2,17 @@ import torch
 from pytorch_lightning import LightningModule
 from torch import nn
 from torch_geometric.data import Batch
-from torch_geometric.nn import knn_interpolate
 from torchmetrics.classification import MulticlassJaccardIndex
 from myria3d.callbacks.comet_callbacks import log_comet_cm
 
 from myria3d.metrics.iou import iou
+from myria3d.models.interpolation import (
+    get_batch_tensor_by_enumeration,
+    interpolate_logits_to_full_subtiles,
+)
 from myria3d.models.modules.pyg_randla_net import PyGRandLANet
+from myria3d.pctl.dataloader.dataloader import transfer_batch_to_device
+from myria3d.pctl.transforms.transforms import get_neighbors_hierarchy
 from myria3d.utils import utils
 
 log = utils.get_logger(__name__)
@@ -69,6 +74,9 @@ class Model(LightningModule):
         self.softmax = nn.Softmax(dim=1)
         self.criterion = kwargs.get("criterion")
 
+        # Compiled lazily, at the first forward pass (see forward).
+        self._compiled_neural_net_forward = None
+
     def on_fit_start(self) -> None:
         self.criterion = self.criterion.to(self.device)
         self.train_iou = MulticlassJaccardIndex(self.hparams.num_classes).to(self.device)
@@ -85,6 +93,12 @@ class Model(LightningModule):
                 metric_name, class_iou, on_step=False, on_epoch=True, metric_attribute=metric_name
             )
 
+    def transfer_batch_to_device(self, batch, device: torch.device, dataloader_idx: int):
+        """Keep copies used for interpolation on CPU, instead of moving them to device and back."""
+        if isinstance(batch, Batch):
+            return transfer_batch_to_device(batch, device)
+        return super().transfer_batch_to_device(batch, device, dataloader_idx)
+
     def forward(self, batch: Batch) -> torch.Tensor:
         """Forward pass of neural network.
 
@@ -97,7 +111,19 @@ class Model(LightningModule):
             torch.Tensor (B*N,C): logits
 
         """
-        logits = self.model(batch.x, batch.pos, batch.batch, batch.ptr)
+        neural_net = self.model
+        if self.hparams.get("compile", False):
+            if self._compiled_neural_net_forward is None:
+                # Compiling the forward method rather than the module keeps the keys of checkpoints.
+                # Dynamic shapes avoid recompilations for each new number of points.
+                self._compiled_neural_net_forward = torch.compile(self.model.forward, dynamic=True)
+            neural_net = self._compiled_neural_net_forward
+        hierarchy = get_neighbors_hierarchy(batch)
+        if hierarchy is not None:
+            # Neighbors were precomputed in DataLoader workers.
+            logits = neural_net(batch.x, batch.pos, batch.batch, batch.ptr, hierarchy=hierarchy)
+        else:
+            logits = neural_net(batch.x, batch.pos, batch.batch, batch.ptr)
         if self.training or "copies" not in batch:
             # In training mode and for validation, we directly optimize on subsampled points, for
             # 1) Speed of training - because interpolation multiplies a step duration by a 5-10 factor!
@@ -105,17 +131,12 @@ class Model(LightningModule):
             return batch.y, logits  # B*N, C
 
         # During evaluation on test data and inference, we interpolate predictions back to original positions
-        # KNN is way faster on CPU than on GPU by a 3 to 4 factor.
-        logits = logits.cpu()
-        batch_y = self._get_batch_tensor_by_enumeration(batch.idx_in_original_cloud)
-        logits = knn_interpolate(
-            logits.cpu(),
-            batch.copies["pos_sampled_copy"].cpu(),
-            batch.copies["pos_copy"].cpu(),
-            batch_x=batch.batch.cpu(),
-            batch_y=batch_y.cpu(),
-            k=self.hparams.interpolation_k,
-            num_workers=self.hparams.num_workers,
+        logits = interpolate_logits_to_full_subtiles(
+            logits,
+            batch,
+            self.hparams.interpolation_k,
+            self.hparams.num_workers,
+            self.hparams.get("interpolation_engine", "knn_interpolate"),
         )
         targets = None  # no targets in inference mode.
         if "transformed_y_copy" in batch.copies:
@@ -268,4 +289,4 @@ class Model(LightningModule):
         """Get batch tensor (e.g. [0,0,1,1,2,2,...,B-1,B-1] )
         from shape B,N,... to shape (N,...).
         """
-        return torch.cat([torch.full((len(sample_pos),), i) for i, sample_pos in enumerate(pos_x)])
+        return get_batch_tensor_by_enumeration(pos_x)
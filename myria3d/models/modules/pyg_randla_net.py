@@ -1,23 +1,28 @@
+import contextlib
 import os.path as osp
 from numbers import Number
-from typing import Tuple
+from typing import List, Literal, NamedTuple, Optional, Tuple
 
 import torch
 import torch.nn.functional as F
 import torch_geometric.transforms as T
 from torch import LongTensor, Tensor
 from torch.nn import Linear
+from torch.nn.modules.batchnorm import _BatchNorm
+from torch.utils.checkpoint import checkpoint
 from torch_geometric.datasets import ShapeNet
 from torch_geometric.loader import DataLoader
 from torch_geometric.nn import MLP
 from torch_geometric.nn.conv import MessagePassing
-from torch_geometric.nn.pool import knn_graph
+from torch_geometric.nn.pool import knn, knn_graph
 from torch_geometric.nn.unpool import knn_interpolate
 from torch_geometric.utils import softmax
 from torch_scatter import scatter
 from torchmetrics.functional import jaccard_index
 from tqdm import tqdm
 
+CHECKPOINTING_TYPE = Optional[Literal["blocks", "lfa"]]
+
 
 class PyGRandLANet(torch.nn.Module):
     def __init__(
@@ -27,10 +32,40 @@ class PyGRandLANet(torch.nn.Module):
         decimation: int = 4,
         num_neighbors: int = 16,
         return_logits: bool = False,
+        lfa_mode: str = "sparse",
+        lfa_chunk_size: Optional[int] = None,
+        lfa_recompute: bool = False,
+        checkpointing: CHECKPOINTING_TYPE = None,
     ):
+        """Initialization method.
+
+        Args:
+            num_features (int): number of input features.
+            num_classes (int): number of classes.
+            decimation (int, optional): decimation factor of each encoder level. Defaults to 4.
+            num_neighbors (int, optional): number of neighbors of points in local feature aggregation. Defaults to 16.
+            return_logits (bool, optional): return logits instead of log-probabilities. Defaults to False.
+            lfa_mode (str, optional): implementation of local feature aggregation, "sparse" (message passing over
+                edges) or "dense" (on (N, K, d) neighborhoods, with less memory). Defaults to "sparse".
+            lfa_chunk_size (int, optional): with the dense mode, number of points of chunks in attentive pooling.
+                Defaults to None (no chunking).
+            lfa_recompute (bool, optional): with the dense mode, recompute attentive pooling during backward
+                instead of keeping its activations in memory. Defaults to False.
+            checkpointing (str, optional): activation checkpointing during training, which recomputes
+                activations during backward instead of keeping them in memory: "blocks" for each encoder
+                block, "lfa" for each local feature aggregation, or None. Defaults to None.
+
+        """
         super().__init__()
+        if checkpointing not in [None, "blocks", "lfa"]:
+            raise ValueError(
+                "Argument `checkpointing` should be null, 'blocks' or 'lfa'. "
+                f"(Current value: {checkpointing})"
+            )
+        self.checkpointing = checkpointing
 
         self.decimation = decimation
+        self.num_neighbors = num_neighbors
         # An option to return logits instead of probas
         self.return_logits = return_logits
 
@@ -40,10 +75,16 @@ class PyGRandLANet(torch.nn.Module):
         d_bottleneck = max(32, num_classes, num_features)
 
         self.fc0 = Linear(num_features, d_bottleneck)
-        self.block1 = DilatedResidualBlock(num_neighbors, d_bottleneck, 32)
-        self.block2 = DilatedResidualBlock(num_neighbors, 32, 128)
-        self.block3 = DilatedResidualBlock(num_neighbors, 128, 256)
-        self.block4 = DilatedResidualBlock(num_neighbors, 256, 512)
+        lfa_kwargs = dict(
+            lfa_mode=lfa_mode,
+            lfa_chunk_size=lfa_chunk_size,
+            lfa_recompute=lfa_recompute,
+            lfa_checkpointing=checkpointing == "lfa",
+        )
+        self.block1 = DilatedResidualBlock(num_neighbors, d_bottleneck, 32, **lfa_kwargs)
+        self.block2 = DilatedResidualBlock(num_neighbors, 32, 128, **lfa_kwargs)
+        self.block3 = DilatedResidualBlock(num_neighbors, 128, 256, **lfa_kwargs)
+        self.block4 = DilatedResidualBlock(num_neighbors, 256, 512, **lfa_kwargs)
         self.mlp_summit = SharedMLP([512, 512])
         self.fp4 = FPModule(1, SharedMLP([512 + 256, 256]))
         self.fp3 = FPModule(1, SharedMLP([256 + 128, 128]))
@@ -52,20 +93,26 @@ class PyGRandLANet(torch.nn.Module):
         self.mlp_classif = SharedMLP([d_bottleneck, 64, 32], dropout=[0.0, 0.5])
         self.fc_classif = Linear(32, num_classes)
 
-    def forward(self, x, pos, batch, ptr):
+    def forward(self, x, pos, batch, ptr, hierarchy: Optional["NeighborsHierarchy"] = None):
         x = x if x is not None else pos
+        if hierarchy is None:
+            # Sizes of clouds are only read on host by decimations: a single transfer per step.
+            hierarchy = build_neighbors_hierarchy(
+                pos, batch, ptr.cpu(), self.num_neighbors, self.decimation
+            )
+        edge_index, idx_decim, upsample_idx = hierarchy
 
-        b1_out = self.block1(self.fc0(x), pos, batch)
-        b1_out_decimated, ptr1 = decimate(b1_out, ptr, self.decimation)
+        b1_out = self._run_block(self.block1, self.fc0(x), pos, batch, edge_index[0])
+        b1_out_decimated = tuple(tensor[idx_decim[0]] for tensor in b1_out)
 
-        b2_out = self.block2(*b1_out_decimated)
-        b2_out_decimated, ptr2 = decimate(b2_out, ptr1, self.decimation)
+        b2_out = self._run_block(self.block2, *b1_out_decimated, edge_index[1])
+        b2_out_decimated = tuple(tensor[idx_decim[1]] for tensor in b2_out)
 
-        b3_out = self.block3(*b2_out_decimated)
-        b3_out_decimated, ptr3 = decimate(b3_out, ptr2, self.decimation)
+        b3_out = self._run_block(self.block3, *b2_out_decimated, edge_index[2])
+        b3_out_decimated = tuple(tensor[idx_decim[2]] for tensor in b3_out)
 
-        b4_out = self.block4(*b3_out_decimated)
-        b4_out_decimated, _ = decimate(b4_out, ptr3, self.decimation)
+        b4_out = self._run_block(self.block4, *b3_out_decimated, edge_index[3])
+        b4_out_decimated = tuple(tensor[idx_decim[3]] for tensor in b4_out)
 
         mlp_out = (
             self.mlp_summit(b4_out_decimated[0]),
@@ -73,10 +120,10 @@ class PyGRandLANet(torch.nn.Module):
             b4_out_decimated[2],
         )
 
-        fp4_out = self.fp4(*mlp_out, *b3_out_decimated)
-        fp3_out = self.fp3(*fp4_out, *b2_out_decimated)
-        fp2_out = self.fp2(*fp3_out, *b1_out_decimated)
-        fp1_out = self.fp1(*fp2_out, *b1_out)
+        fp4_out = self.fp4(*mlp_out, *b3_out_decimated, upsample_idx[3])
+        fp3_out = self.fp3(*fp4_out, *b2_out_decimated, upsample_idx[2])
+        fp2_out = self.fp2(*fp3_out, *b1_out_decimated, upsample_idx[1])
+        fp1_out = self.fp1(*fp2_out, *b1_out, upsample_idx[0])
 
         x = self.mlp_classif(fp1_out[0])
         logits = self.fc_classif(x)
@@ -84,9 +131,14 @@ class PyGRandLANet(torch.nn.Module):
         if self.return_logits:
             return logits
 
-        probas = logits.log_softmax(dim=-1)
+        probas = logits.float().log_softmax(dim=-1)
         return probas
 
+    def _run_block(self, block: "DilatedResidualBlock", *args):
+        if self.checkpointing == "blocks" and self.training and torch.is_grad_enabled():
+            return checkpoint_module(block, *args)
+        return block(*args)
+
 
 # Default activation, BatchNorm, and resulting MLP used by RandLA-Net authors
 lrelu02_kwargs = {"negative_slope": 0.2}
@@ -123,7 +175,9 @@ class LocalFeatureAggregation(MessagePassing):
         out = self.mlp_post_attention(out)  # N, d_out
         return out
 
-    def message(self, x_j: Tensor, pos_i: Tensor, pos_j: Tensor, index: Tensor) -> Tensor:
+    def message(
+        self, x_j: Tensor, pos_i: Tensor, pos_j: Tensor, index: Tensor, size_i: Optional[int]
+    ) -> Tensor:
         """Local Spatial Encoding (locSE) and attentive pooling of features.
 
         Args:
@@ -132,6 +186,8 @@ class LocalFeatureAggregation(MessagePassing):
             pos_j (Tensor): neighboors positions (K,3)
             index (Tensor): index of centroid positions
                 (e.g. [0,...,0,1,...,1,...,N,...,N])
+            size_i (int, optional): number of centroids N, so that the softmax does not read it
+                from index, which would synchronize with the device and break compiled graphs.
 
         returns:
             (Tensor): locSE weighted by feature attention scores.
@@ -147,22 +203,110 @@ class LocalFeatureAggregation(MessagePassing):
         # Attention will weight the different features of x
         # along the neighborhood dimension.
         att_features = self.mlp_attention(local_features)  # N * K, d_out
-        att_scores = softmax(att_features, index=index)  # N * K, d_out
+        # Softmax in full precision, even under autocast, where exp would overflow in float16.
+        att_scores = softmax(att_features.float(), index=index, num_nodes=size_i)  # N * K, d_out
+        att_scores = att_scores.to(local_features.dtype)
 
         return att_scores * local_features  # N * K, d_out
 
 
+class DenseLocalFeatureAggregation(LocalFeatureAggregation):
+    """LocalFeatureAggregation on dense (N, K, d) neighborhoods, with less memory.
+
+    Neighborhoods from knn_graph hold the same number K of neighbors for each point, so that
+    features of edges can be reshaped to (N, K, d), and the softmax and sum over neighbors
+    computed along a dimension instead of by scatter operations over edges.
+
+    Attentive pooling, which holds the widest tensors (N, K, d_out), can further be computed by
+    chunks of points, and recomputed during backward instead of being kept in memory. Both are
+    exact, since attentive pooling has no batch normalization. When some clouds have fewer than
+    K points, neighborhoods are not dense and the sparse implementation is used instead.
+
+    """
+
+    def __init__(
+        self,
+        channels: int,
+        num_neighbors: int,
+        chunk_size: Optional[int] = None,
+        recompute: bool = False,
+    ):
+        super().__init__(channels)
+        self.num_neighbors = num_neighbors
+        self.chunk_size = chunk_size
+        self.recompute = recompute
+
+    def forward(self, edge_index, x, pos):
+        num_nodes = x.size(0)
+        if edge_index.size(1) != num_nodes * self.num_neighbors:
+            return super().forward(edge_index, x, pos)
+        # knn_graph sorts edges by target, i.e. by centroid.
+        neighbors = edge_index[0].view(num_nodes, self.num_neighbors)  # N, K
+
+        # Encode local neighboorhod structural information
+        pos_j = pos[neighbors]  # N, K, 3
+        pos_i = pos.unsqueeze(1).expand_as(pos_j)  # N, K, 3
+        pos_diff = pos_j - pos_i
+        distance = torch.sqrt((pos_diff * pos_diff).sum(2, keepdim=True))
+        relative_infos = torch.cat([pos_i, pos_j, pos_diff, distance], dim=2)  # N, K, 10
+        local_spatial_encoding = self.mlp_encoder(relative_infos.view(-1, 10)).view(
+            num_nodes, self.num_neighbors, -1
+        )  # N, K, d_out // 2
+
+        chunk_size = self.chunk_size or num_nodes
+        out = []
+        for start in range(0, num_nodes, chunk_size):
+            args = (
+                x,
+                neighbors[start : start + chunk_size],
+                local_spatial_encoding[start : start + chunk_size],
+            )
+            if self.recompute and torch.is_grad_enabled():
+                out.append(checkpoint(self.attentive_pooling, *args, use_reentrant=False))
+            else:
+                out.append(self.attentive_pooling(*args))
+        out = torch.cat(out, dim=0) if len(out) > 1 else out[0]  # N, d_out
+        out = self.mlp_post_attention(out)  # N, d_out
+        return out
+
+    def attentive_pooling(
+        self, x: Tensor, neighbors: Tensor, local_spatial_encoding: Tensor
+    ) -> Tensor:
+        """Attentive pooling of features of dense neighborhoods.
+
+        Args:
+            x (Tensor): features of all points (N, d)
+            neighbors (Tensor): indices of neighbors of a chunk of points (n, K)
+            local_spatial_encoding (Tensor): locSE of the chunk of points (n, K, d_out // 2)
+
+        returns:
+            (Tensor): locSE weighted by feature attention scores, summed over neighbors (n, d_out).
+
+        """
+        local_features = torch.cat([x[neighbors], local_spatial_encoding], dim=2)  # n, K, d_out
+        att_features = self.mlp_attention(local_features.view(-1, local_features.size(2)))
+        att_scores = torch.softmax(
+            att_features.view_as(local_features), dim=1, dtype=torch.float32
+        ).to(local_features.dtype)  # n, K, d_out
+        return (att_scores * local_features).sum(dim=1)  # n, d_out
+
+
 class DilatedResidualBlock(torch.nn.Module):
     def __init__(
         self,
         num_neighbors,
         d_in: int,
         d_out: int,
+        lfa_mode: str = "sparse",
+        lfa_chunk_size: Optional[int] = None,
+        lfa_recompute: bool = False,
+        lfa_checkpointing: bool = False,
     ):
         super().__init__()
         self.num_neighbors = num_neighbors
         self.d_in = d_in
         self.d_out = d_out
+        self.lfa_checkpointing = lfa_checkpointing
 
         # MLP on input
         self.mlp1 = SharedMLP([d_in, d_out // 8])
@@ -171,35 +315,100 @@ class DilatedResidualBlock(torch.nn.Module):
         # MLP on output
         self.mlp2 = SharedMLP([d_out // 2, d_out], act=None)
 
-        self.lfa1 = LocalFeatureAggregation(d_out // 4)
-        self.lfa2 = LocalFeatureAggregation(d_out // 2)
+        if lfa_mode == "dense":
+            lfa_kwargs = dict(
+                num_neighbors=num_neighbors, chunk_size=lfa_chunk_size, recompute=lfa_recompute
+            )
+            self.lfa1 = DenseLocalFeatureAggregation(d_out // 4, **lfa_kwargs)
+            self.lfa2 = DenseLocalFeatureAggregation(d_out // 2, **lfa_kwargs)
+        elif lfa_mode == "sparse":
+            self.lfa1 = LocalFeatureAggregation(d_out // 4)
+            self.lfa2 = LocalFeatureAggregation(d_out // 2)
+        else:
+            raise ValueError(
+                f"Argument `lfa_mode` should be 'sparse' or 'dense'. (Current value: {lfa_mode})"
+            )
 
         self.lrelu = torch.nn.LeakyReLU(**lrelu02_kwargs)
 
-    def forward(self, x, pos, batch):
-        edge_index = knn_graph(pos, self.num_neighbors, batch=batch, loop=True)
+    def forward(self, x, pos, batch, edge_index: Optional[Tensor] = None):
+        if edge_index is None:
+            edge_index = knn_graph(pos, self.num_neighbors, batch=batch, loop=True)
 
         shortcut_of_x = self.shortcut(x)  # N, d_out
         x = self.mlp1(x)  # N, d_out//8
-        x = self.lfa1(edge_index, x, pos)  # N, d_out//2
-        x = self.lfa2(edge_index, x, pos)  # N, d_out//2
+        x = self._run_lfa(self.lfa1, edge_index, x, pos)  # N, d_out//2
+        x = self._run_lfa(self.lfa2, edge_index, x, pos)  # N, d_out//2
         x = self.mlp2(x)  # N, d_out
         x = self.lrelu(x + shortcut_of_x)  # N, d_out
 
         return x, pos, batch
 
+    def _run_lfa(self, lfa: LocalFeatureAggregation, edge_index, x, pos):
+        if self.lfa_checkpointing and self.training and torch.is_grad_enabled():
+            return checkpoint_module(lfa, edge_index, x, pos)
+        return lfa(edge_index, x, pos)
+
+
+@contextlib.contextmanager
+def frozen_batch_norm_statistics(module: torch.nn.Module):
+    """Do not update running statistics of BatchNorm layers of a module, e.g. while recomputing it."""
+    batch_norms = [
+        m for m in module.modules() if isinstance(m, _BatchNorm) and m.track_running_stats
+    ]
+    momentums = [bn.momentum for bn in batch_norms]
+    nums_batches_tracked = [bn.num_batches_tracked.clone() for bn in batch_norms]
+    for bn in batch_norms:
+        bn.momentum = 0.0
+    try:
+        yield
+    finally:
+        for bn, momentum, num_batches_tracked in zip(
+            batch_norms, momentums, nums_batches_tracked
+        ):
+            bn.momentum = momentum
+            bn.num_batches_tracked.copy_(num_batches_tracked)
+
+
+def checkpoint_module(module: torch.nn.Module, *args):
+    """Call a module with activation checkpointing: its activations are recomputed during backward.
+
+    Running statistics of BatchNorm layers are only updated by the forward pass, and not a second
+    time by the recomputation. The recomputation normalizes with the same batch statistics anyway.
+
+    """
+    num_calls = 0
+
+    def run(*args):
+        nonlocal num_calls
+        num_calls += 1
+        if num_calls == 1:
+            return module(*args)
+        with frozen_batch_norm_statistics(module):
+            return module(*args)
+
+    return checkpoint(run, *args, use_reentrant=False)
+
 
-def decimation_indices(ptr: LongTensor, decimation_factor: Number) -> Tuple[Tensor, LongTensor]:
+def decimation_indices(
+    ptr: LongTensor, decimation_factor: Number, device: Optional[torch.device] = None
+) -> Tuple[Tensor, LongTensor]:
     """Get indices which downsample each point cloud by a decimation factor.
 
     Decimation happens separately for each cloud to prevent emptying smaller
     point clouds. Empty clouds are prevented: clouds will have a least
     one node after decimation.
 
+    All clouds are decimated at once: a random permutation of all nodes is sorted
+    by cloud (a stable sort, which keeps a random order within each cloud), and the
+    first nodes of each cloud are kept. Sizes of clouds are read from ptr, which
+    should therefore be on cpu to avoid a device-to-host synchronization.
+
     Args:
         ptr (LongTensor): indices of samples in the batch.
         decimation_factor (Number): value to divide number of nodes with.
             Should be higher than 1 for downsampling.
+        device (torch.device, optional): device of the returned indices. Defaults to the device of ptr.
 
     :rtype: (:class:`Tensor`, :class:`LongTensor`): indices for downsampling
         and resulting updated ptr.
@@ -210,34 +419,95 @@ def decimation_indices(ptr: LongTensor, decimation_factor: Number) -> Tuple[Tens
             "Argument `decimation_factor` should be higher than (or equal to) "
             f"1 for downsampling. (Current value: {decimation_factor})"
         )
+    device = ptr.device if device is None else device
 
     batch_size = ptr.size(0) - 1
     bincount = ptr[1:] - ptr[:-1]
     decimated_bincount = torch.div(bincount, decimation_factor, rounding_mode="floor")
     # Decimation should not empty clouds completely.
     decimated_bincount = torch.max(torch.ones_like(decimated_bincount), decimated_bincount)
-    idx_decim = torch.cat(
-        [
-            (ptr[i] + torch.randperm(bincount[i], device=ptr.device)[: decimated_bincount[i]])
-            for i in range(batch_size)
-        ],
-        dim=0,
-    )
     # Get updated ptr (e.g. for future decimations)
-    ptr_decim = ptr.clone()
-    for i in range(batch_size):
-        ptr_decim[i + 1] = ptr_decim[i] + decimated_bincount[i]
+    ptr_decim = torch.cat([ptr[:1], ptr[:1] + torch.cumsum(decimated_bincount, dim=0)])
+
+    num_nodes, num_nodes_decim = int(ptr[-1]), int(ptr_decim[-1])
+    clouds = torch.arange(batch_size, device=device)
+    # Random order of nodes, grouped by cloud.
+    batch = torch.repeat_interleave(clouds, bincount.to(device), output_size=num_nodes)
+    perm = torch.randperm(num_nodes, device=device)
+    perm = perm[torch.sort(batch[perm], stable=True).indices]
+    # The first decimated_bincount nodes of each cloud are kept.
+    batch_decim = torch.repeat_interleave(
+        clouds, decimated_bincount.to(device), output_size=num_nodes_decim
+    )
+    ptr, ptr_decim_on_device = ptr.to(device), ptr_decim.to(device)
+    rank_in_cloud = torch.arange(num_nodes_decim, device=device) - ptr_decim_on_device[batch_decim]
+    idx_decim = perm[ptr[batch_decim] + rank_in_cloud]
 
     return idx_decim, ptr_decim
 
 
 def decimate(tensors, ptr: Tensor, decimation_factor: int):
     """Decimate each element of the given tuple of tensors."""
-    idx_decim, ptr_decim = decimation_indices(ptr, decimation_factor)
+    idx_decim, ptr_decim = decimation_indices(ptr, decimation_factor, device=tensors[0].device)
     tensors_decim = tuple(tensor[idx_decim] for tensor in tensors)
     return tensors_decim, ptr_decim
 
 
+class NeighborsHierarchy(NamedTuple):
+    """Neighbors of points at each level of PyGRandLANet, computed once per forward pass.
+
+    Level 0 holds all points, and level l + 1 the points of level l that are kept by decimation.
+    Each element is a list with a tensor for each of the levels 0 to 3.
+
+    """
+
+    # knn graph of points of level l, shared by both local feature aggregations of its block.
+    edge_index: List[Tensor]
+    # Indices of points of level l + 1 among points of level l.
+    idx_decim: List[Tensor]
+    # Index of the nearest point of level l + 1 for each point of level l, to upsample features.
+    upsample_idx: List[Tensor]
+
+
+# Neighbor searches and decimations have data-dependent shapes: they are kept out of compiled graphs,
+# which are then broken once, before the layers of the network.
+@torch.compiler.disable
+def build_neighbors_hierarchy(
+    pos: Tensor,
+    batch: Tensor,
+    ptr: LongTensor,
+    num_neighbors: int,
+    decimation: int,
+    num_levels: int = 4,
+) -> NeighborsHierarchy:
+    """Search neighbors of points at all levels of PyGRandLANet, i.e. all of its knn searches.
+
+    Args:
+        pos (Tensor): positions of points (N, 3).
+        batch (Tensor): index of the cloud of each point (N,).
+        ptr (LongTensor): indices of samples in the batch, preferably on cpu (see decimation_indices).
+        num_neighbors (int): number of neighbors in knn graphs.
+        decimation (int): decimation factor between levels.
+        num_levels (int, optional): number of levels. Defaults to 4.
+
+    Returns:
+        NeighborsHierarchy: neighbors of points at all levels.
+
+    """
+    edge_index, idx_decim, upsample_idx = [], [], []
+    for _ in range(num_levels):
+        edge_index.append(knn_graph(pos, num_neighbors, batch=batch, loop=True))
+        idx, ptr = decimation_indices(ptr, decimation, device=pos.device)
+        pos_decim, batch_decim = pos[idx], batch[idx]
+        nearest = knn(pos_decim, pos, 1, batch_decim, batch)
+        upsample = torch.empty(pos.size(0), dtype=torch.long, device=pos.device)
+        upsample[nearest[0]] = nearest[1]
+        idx_decim.append(idx)
+        upsample_idx.append(upsample)
+        pos, batch = pos_decim, batch_decim
+    return NeighborsHierarchy(edge_index, idx_decim, upsample_idx)
+
+
 class FPModule(torch.nn.Module):
     """Upsampling with a skip connection."""
 
@@ -246,8 +516,14 @@ class FPModule(torch.nn.Module):
         self.k = k
         self.nn = nn
 
-    def forward(self, x, pos, batch, x_skip, pos_skip, batch_skip):
-        x = knn_interpolate(x, pos, pos_skip, batch, batch_skip, k=self.k)
+    def forward(
+        self, x, pos, batch, x_skip, pos_skip, batch_skip, upsample_idx: Optional[Tensor] = None
+    ):
+        if upsample_idx is not None and self.k == 1:
+            # Features of the nearest point, as given by knn_interpolate with a single neighbor.
+            x = x[upsample_idx]
+        else:
+            x = knn_interpolate(x, pos, pos_skip, batch, batch_skip, k=self.k)
         x = torch.cat([x, x_skip], dim=1)
         x = self.nn(x)
         return x, pos_skip, batch_skip
@@ -0,0 +1,102 @@
+"""Optimizations of a trained neural network for inference on CPU.
+
+BatchNorm layers of MLPs are folded into the Linear layers that precede them, which are then
+quantized to int8 with dynamic quantization: weights are stored in int8, and activations are
+quantized on the fly, batch by batch. This needs no calibration data.
+
+"""
+
+import copy
+from typing import Literal, Optional
+
+import torch
+from torch import nn
+from torch_geometric.nn import MLP
+
+from myria3d.utils import utils
+
+log = utils.get_logger(__name__)
+
+QUANTIZATION_TYPE = Optional[Literal["fold_bn", "dynamic_int8"]]
+
+
+def fold_linear_and_batch_norm(lin: nn.Module, bn: Optional[nn.BatchNorm1d]) -> nn.Linear:
+    """A Linear layer equivalent to a Linear layer followed by a BatchNorm in eval mode.
+
+    Args:
+        lin (nn.Module): a torch.nn.Linear or torch_geometric.nn.Linear layer.
+        bn (nn.BatchNorm1d, optional): a BatchNorm layer with running statistics, or None to
+            only convert the Linear layer.
+
+    Returns:
+        nn.Linear: the folded layer, always a torch.nn.Linear.
+
+    """
+    weight = lin.weight
+    bias = lin.bias if lin.bias is not None else torch.zeros_like(weight[:, 0])
+    if bn is not None:
+        scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+        weight = weight * scale.unsqueeze(1)
+        bias = (bias - bn.running_mean) * scale + bn.bias
+    folded = nn.Linear(weight.size(1), weight.size(0), bias=True).to(weight.device)
+    folded.weight.data.copy_(weight)
+    folded.bias.data.copy_(bias)
+    return folded
+
+
+@torch.no_grad()
+def fold_batch_norms(model: nn.Module) -> nn.Module:
+    """Fold BatchNorm layers of all MLPs of a model into their Linear layers, in place.
+
+    Linear layers of MLPs are replaced by torch.nn.Linear layers, which can then be quantized.
+
+    """
+    for module in model.modules():
+        if not isinstance(module, MLP):
+            continue
+        for i, lin in enumerate(module.lins):
+            norm = module.norms[i] if i < len(module.norms) else None
+            # torch_geometric.nn.BatchNorm wraps a torch BatchNorm.
+            bn = getattr(norm, "module", norm)
+            if isinstance(bn, nn.BatchNorm1d) and not module.act_first:
+                module.lins[i] = fold_linear_and_batch_norm(lin, bn)
+                module.norms[i] = nn.Identity()
+            elif not isinstance(lin, nn.Linear):
+                module.lins[i] = fold_linear_and_batch_norm(lin, None)
+    return model
+
+
+def check_quantization_device(device: torch.device) -> None:
+    """Raise a ValueError if a quantized model would not run on cpu."""
+    if torch.device(device).type != "cpu":
+        raise ValueError(
+            f"Quantized models only run on CPU, but device is {device}. Set predict.gpus=0."
+        )
+
+
+def optimize_for_cpu_inference(model: nn.Module, quantization: QUANTIZATION_TYPE) -> nn.Module:
+    """A copy of a neural network optimized for inference on CPU.
+
+    Args:
+        model (nn.Module): neural network in eval mode.
+        quantization (QUANTIZATION_TYPE): "fold_bn" to only fold BatchNorm layers, "dynamic_int8"
+            to also quantize Linear layers to int8, or None to return the model as is.
+
+    Returns:
+        nn.Module: the optimized copy of the neural network.
+
+    """
+    if quantization is None:
+        return model
+    if quantization not in ["fold_bn", "dynamic_int8"]:
+        raise ValueError(
+            "Argument `quantization` should be null, 'fold_bn' or 'dynamic_int8'. "
+            f"(Current value: {quantization})"
+        )
+    if model.training:
+        raise ValueError("BatchNorm layers can only be folded in eval mode.")
+    model = fold_batch_norms(copy.deepcopy(model).cpu())
+    if quantization == "dynamic_int8":
+        model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    log.info(f"Neural network optimized for inference on CPU (quantization: {quantization}).")
+    return model
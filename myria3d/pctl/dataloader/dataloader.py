@@ -1,6 +1,13 @@
+from typing import List, Union
+
+import torch
 from torch.utils.data import DataLoader
+from torch_geometric.data import Batch, Data
 from torch_geometric.loader.dataloader import Collater
 
+# Keys only used to interpolate logits back to all points of subtiles, which is done on CPU.
+KEYS_KEPT_ON_CPU = ["copies", "pos_copy_batch"]
+
 
 class GeometricNoneProofDataloader(DataLoader):
     """Torch geometric's dataloader is a simple torch Dataloader with a different Collater.
@@ -17,7 +24,12 @@ class GeometricNoneProofDataloader(DataLoader):
 
 
 class GeometricNoneProofCollater(Collater):
-    """A Collater that returns None when given empty batch."""
+    """A Collater that returns None when given empty batch.
+
+    Batches with copies of full positions (see CopyFullPos) also get a `pos_copy_batch` vector,
+    which assigns each of these positions to its sample, like `batch` does for `pos`.
+
+    """
 
     def __init__(self, follow_batch=None, exclude_keys=None):
         super().__init__(follow_batch, exclude_keys)
@@ -29,4 +41,33 @@ class GeometricNoneProofCollater(Collater):
         if not data_list:
             # empty
             return None
-        return super().__call__(data_list)
+        batch = super().__call__(data_list)
+        if "copies" in batch and "pos_copy" in batch.copies:
+            batch.pos_copy_batch = make_batch_vector(
+                [d.copies["pos_copy"].size(0) for d in data_list]
+            )
+        return batch
+
+
+def make_batch_vector(sizes: List[int]) -> torch.Tensor:
+    """Batch vector (e.g. [0,0,1,1,1,2,...]) of samples with the given numbers of points."""
+    sizes = torch.as_tensor(sizes, dtype=torch.long)
+    return torch.repeat_interleave(torch.arange(sizes.numel()), sizes)
+
+
+def transfer_batch_to_device(
+    batch: Union[Batch, Data], device: torch.device
+) -> Union[Batch, Data]:
+    """Move a batch to a device, except for keys only used by interpolation, which stay on CPU.
+
+    Interpolation runs on CPU, where KNN is faster, so that moving copies of full positions to
+    the device would only mean moving them back.
+
+    """
+    kept_on_cpu = {key: batch[key] for key in KEYS_KEPT_ON_CPU if key in batch}
+    for key in kept_on_cpu:
+        del batch[key]
+    batch = batch.to(device)
+    for key, value in kept_on_cpu.items():
+        batch[key] = value
+    return batch
@@ -0,0 +1,84 @@
+import copy
+from typing import Iterator, List, Sequence
+
+import numpy as np
+from torch.utils.data import BatchSampler, DistributedSampler, Sampler
+
+
+class PointBudgetBatchSampler(BatchSampler):
+    """Packs samples into batches of at most a given total number of points.
+
+    Samples are taken in the order of the underlying sampler (shuffled or not), and added to the
+    current batch until the next one would exceed the budget. A sample larger than the budget
+    forms a batch on its own.
+
+    With a DistributedSampler (injected by Lightning under DDP), each rank packs its own share
+    of the samples. Since packing yields a different number of batches on each rank, ranks with
+    fewer batches repeat their first ones, so that all ranks run the same number of steps.
+
+    """
+
+    def __init__(
+        self,
+        sampler: Sampler[int],
+        num_points: Sequence[int],
+        max_points: int,
+        drop_last: bool = False,
+    ):
+        """Initialization method.
+
+        Args:
+            sampler (Sampler[int]): sampler of indices of samples, e.g. a RandomSampler for shuffling.
+            num_points (Sequence[int]): number of points of each sample, aligned with indices of the sampler.
+            max_points (int): maximum number of points in a batch.
+            drop_last (bool, optional): drop the last batch, which is often smaller. Defaults to False.
+
+        """
+        self.sampler = sampler
+        self.num_points = np.asarray(num_points, dtype=np.int64)
+        self.max_points = int(max_points)
+        self.drop_last = drop_last
+        # BatchSampler attributes, read e.g. by Lightning: batches have no fixed number of samples.
+        self.batch_size = None
+        # Batches of the next epoch, packed once so that __len__ and __iter__ agree with a random sampler.
+        self._batches = None
+        self._batches_epoch = None
+
+    def __iter__(self) -> Iterator[List[int]]:
+        batches = self._get_batches()
+        self._batches = None
+        yield from batches
+
+    def __len__(self) -> int:
+        return len(self._get_batches())
+
+    def _get_batches(self) -> List[List[int]]:
+        epoch = getattr(self.sampler, "epoch", None)
+        if self._batches is not None and self._batches_epoch == epoch:
+            return self._batches
+        batches = self._pack(self.sampler)
+        if isinstance(self.sampler, DistributedSampler):
+            num_batches = 0
+            for rank in range(self.sampler.num_replicas):
+                # DistributedSampler is deterministic given its seed and epoch, shared by all ranks.
+                rank_sampler = copy.copy(self.sampler)
+                rank_sampler.rank = rank
+                num_batches = max(num_batches, len(self._pack(rank_sampler)))
+            # Ranks with fewer batches repeat their first ones.
+            batches = (batches * (num_batches // max(1, len(batches)) + 1))[:num_batches]
+        self._batches, self._batches_epoch = batches, epoch
+        return batches
+
+    def _pack(self, sampler: Sampler[int]) -> List[List[int]]:
+        batches = []
+        batch, batch_points = [], 0
+        for idx in sampler:
+            sample_points = int(self.num_points[idx])
+            if batch and batch_points + sample_points > self.max_points:
+                batches.append(batch)
+                batch, batch_points = [], 0
+            batch.append(idx)
+            batch_points += sample_points
+        if batch and not (self.drop_last and batches):
+            batches.append(batch)
+        return batches
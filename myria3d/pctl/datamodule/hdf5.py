@@ -1,19 +1,30 @@
 from numbers import Number
 from typing import Callable, Dict, List, Optional
 
+import numpy as np
 from matplotlib import pyplot as plt
 from numpy.typing import ArrayLike
 from pytorch_lightning import LightningDataModule
+from torch.utils.data import RandomSampler, SequentialSampler
 from torch_geometric.data import Data
 
 from myria3d.pctl.dataloader.dataloader import GeometricNoneProofDataloader
+from myria3d.pctl.dataloader.sampler import PointBudgetBatchSampler
 from myria3d.pctl.transforms.compose import CustomCompose
 from myria3d.pctl.dataset.hdf5 import HDF5Dataset
+from myria3d.pctl.dataset.hdf5_layout import (
+    HDF5_LAYOUT_TYPE,
+    HDF5_SCHEMA_TYPE,
+    HDF5_STORAGE_TYPE,
+)
 from myria3d.pctl.dataset.iterable import InferenceDataset
 from myria3d.pctl.dataset.utils import (
+    SPLIT_TYPE,
+    SUBTILE_SPLITTING_METHOD_TYPE,
     get_las_paths_by_split_dict,
     pre_filter_below_n_points,
 )
+from myria3d.pctl.transforms.transforms import MaximumNumNodes, MinimumNumNodes
 from myria3d.utils import utils
 
 log = utils.get_logger(__name__)
@@ -36,10 +47,19 @@ class HDF5LidarDataModule(LightningDataModule):
         subtile_width: Number = 50,
         subtile_overlap_train: Number = 0,
         subtile_overlap_predict: Number = 0,
+        subtile_splitting_method: SUBTILE_SPLITTING_METHOD_TYPE = "kdtree",
         batch_size: int = 12,
+        batch_max_points: Optional[int] = None,
         num_workers: int = 1,
         prefetch_factor: int = 2,
         transforms: Optional[Dict[str, TRANSFORMS_LIST]] = None,
+        create_hdf5_num_workers: int = 1,
+        hdf5_layout: HDF5_LAYOUT_TYPE = "groups",
+        hdf5_storage: Optional[HDF5_STORAGE_TYPE] = None,
+        hdf5_schema: HDF5_SCHEMA_TYPE = "standard",
+        sample_cache_bytes: int = 0,
+        sample_cache_dir: str = "/dev/shm/myria3d",
+        prefix_cache_path: Optional[str] = None,
         **kwargs,
     ):
         super().__init__()
@@ -58,10 +78,19 @@ class HDF5LidarDataModule(LightningDataModule):
         self.subtile_width = subtile_width
         self.subtile_overlap_train = subtile_overlap_train
         self.subtile_overlap_predict = subtile_overlap_predict
+        self.subtile_splitting_method = subtile_splitting_method
 
         self.batch_size = batch_size
+        self.batch_max_points = batch_max_points
         self.num_workers = num_workers
         self.prefetch_factor = prefetch_factor
+        self.create_hdf5_num_workers = create_hdf5_num_workers
+        self.hdf5_layout = hdf5_layout
+        self.hdf5_storage = hdf5_storage
+        self.hdf5_schema = hdf5_schema
+        self.sample_cache_bytes = sample_cache_bytes
+        self.sample_cache_dir = sample_cache_dir
+        self.prefix_cache_path = prefix_cache_path
 
         t = transforms
         self.preparation_train_transform: TRANSFORMS_LIST = t.get("preparations_train_list", [])
@@ -71,6 +100,7 @@ class HDF5LidarDataModule(LightningDataModule):
         )
         self.augmentation_transform: TRANSFORMS_LIST = t.get("augmentations_list", [])
         self.normalization_transform: TRANSFORMS_LIST = t.get("normalizations_list", [])
+        self.hierarchy_transform: TRANSFORMS_LIST = t.get("hierarchy_list", [])
 
     @property
     def train_transform(self) -> CustomCompose:
@@ -78,15 +108,24 @@ class HDF5LidarDataModule(LightningDataModule):
             self.preparation_train_transform
             + self.normalization_transform
             + self.augmentation_transform
+            + self.hierarchy_transform
         )
 
     @property
     def eval_transform(self) -> CustomCompose:
-        return CustomCompose(self.preparation_eval_transform + self.normalization_transform)
+        return CustomCompose(
+            self.preparation_eval_transform
+            + self.normalization_transform
+            + self.hierarchy_transform
+        )
 
     @property
     def predict_transform(self) -> CustomCompose:
-        return CustomCompose(self.preparation_predict_transform + self.normalization_transform)
+        return CustomCompose(
+            self.preparation_predict_transform
+            + self.normalization_transform
+            + self.hierarchy_transform
+        )
 
     def prepare_data_per_node(self, stage: Optional[str] = None):
         """Prepare dataset containing train, val, test data."""
@@ -105,6 +144,15 @@ class HDF5LidarDataModule(LightningDataModule):
         self.las_paths_by_split_dict = las_paths_by_split_dict
         self.dataset
 
+    def prepare_data(self):
+        """Precompute the deterministic prefix of transforms of all samples, if enabled.
+
+        Called on a single process per node, before setup is called on all processes.
+
+        """
+        if self.prefix_cache_path:
+            self.dataset.materialize_prefix_cache(num_workers=self.num_workers)
+
     # TODO: not needed ?
     def setup(self, stage: Optional[str] = None) -> None:
         """Instantiate the (already prepared) dataset (called on all GPUs)."""
@@ -140,10 +188,25 @@ class HDF5LidarDataModule(LightningDataModule):
             pre_filter=self.pre_filter,
             train_transform=self.train_transform,
             eval_transform=self.eval_transform,
+            create_hdf5_num_workers=self.create_hdf5_num_workers,
+            subtile_splitting_method=self.subtile_splitting_method,
+            hdf5_layout=self.hdf5_layout,
+            hdf5_storage=self.hdf5_storage,
+            hdf5_schema=self.hdf5_schema,
+            sample_cache_bytes=self.sample_cache_bytes,
+            sample_cache_dir=self.sample_cache_dir,
+            prefix_cache_path=self.prefix_cache_path,
         )
         return self._dataset
 
     def train_dataloader(self):
+        if self.batch_max_points:
+            return GeometricNoneProofDataloader(
+                dataset=self.dataset.traindata,
+                batch_sampler=self._get_point_budget_batch_sampler("train", shuffle=True),
+                num_workers=self.num_workers,
+                prefetch_factor=self.prefetch_factor,
+            )
         return GeometricNoneProofDataloader(
             dataset=self.dataset.traindata,
             batch_size=self.batch_size,
@@ -153,6 +216,13 @@ class HDF5LidarDataModule(LightningDataModule):
         )
 
     def val_dataloader(self):
+        if self.batch_max_points:
+            return GeometricNoneProofDataloader(
+                dataset=self.dataset.valdata,
+                batch_sampler=self._get_point_budget_batch_sampler("val", shuffle=False),
+                num_workers=self.num_workers,
+                prefetch_factor=self.prefetch_factor,
+            )
         return GeometricNoneProofDataloader(
             dataset=self.dataset.valdata,
             batch_size=self.batch_size,
@@ -160,6 +230,26 @@ class HDF5LidarDataModule(LightningDataModule):
             prefetch_factor=self.prefetch_factor,
         )
 
+    def _get_point_budget_batch_sampler(
+        self, split: SPLIT_TYPE, shuffle: bool
+    ) -> PointBudgetBatchSampler:
+        """Batch sampler packing samples of a split up to batch_max_points points per batch.
+
+        Numbers of points of samples are read from the index of the HDF5 dataset, and bounded by
+        the MinimumNumNodes and MaximumNumNodes transforms, if any, to estimate their size in batches.
+
+        """
+        subset = self.dataset.traindata if split == "train" else self.dataset.valdata
+        num_points = self.dataset.get_split_num_points(split)
+        transform = self.train_transform if split == "train" else self.eval_transform
+        for t in transform.transforms:
+            if isinstance(t, MinimumNumNodes):
+                num_points = np.maximum(num_points, t.num)
+            elif isinstance(t, MaximumNumNodes):
+                num_points = np.minimum(num_points, t.num)
+        sampler = RandomSampler(subset) if shuffle else SequentialSampler(subset)
+        return PointBudgetBatchSampler(sampler, num_points, self.batch_max_points)
+
     def test_dataloader(self):
         return GeometricNoneProofDataloader(
             dataset=self.dataset.testdata,
@@ -168,7 +258,7 @@ class HDF5LidarDataModule(LightningDataModule):
             prefetch_factor=self.prefetch_factor,
         )
 
-    def _set_predict_data(self, las_file_to_predict):
+    def _set_predict_data(self, las_file_to_predict, points=None):
         self.predict_dataset = InferenceDataset(
             las_file_to_predict,
             self.epsg,
@@ -178,6 +268,8 @@ class HDF5LidarDataModule(LightningDataModule):
             tile_width=self.tile_width,
             subtile_width=self.subtile_width,
             subtile_overlap=self.subtile_overlap_predict,
+            subtile_splitting_method=self.subtile_splitting_method,
+            points=points,
         )
 
     def predict_dataloader(self):
@@ -0,0 +1,253 @@
+"""A cache of decoded samples in shared memory, for HDF5Dataset.
+
+Samples are stored as files in a tmpfs directory (by default under /dev/shm), which lives in RAM.
+The cache is therefore shared by all DataLoader workers, and by all ranks on the same node, which
+open the same directory. It survives the end of a run, so that the next run on the same dataset
+starts warm. Caches of other datasets in the same parent directory (e.g. of a previous version of a
+rebuilt dataset) are deleted when a cache is created, unless a process still uses them.
+
+"""
+
+import fcntl
+import hashlib
+import os
+import pickle
+import re
+import shutil
+from contextlib import contextmanager
+from multiprocessing import util as multiprocessing_util
+from typing import Dict, Optional
+
+from torch.utils.data import get_worker_info
+
+from myria3d.pctl.dataset.hdf5_layout import SAMPLE_TYPE
+
+# Fraction of the budget to free up to when evicting, so that evictions are not too frequent.
+EVICTION_TARGET_RATIO = 0.9
+# Hits and misses of a process are added to its stats file every this many accesses, and at exit.
+STATS_FLUSH_INTERVAL = 1000
+# Caches are named after the md5 fingerprint of their dataset.
+CACHE_DIR_NAME_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+class SharedMemorySampleCache:
+    """A cache of samples in shared memory, with a byte budget and least-recently-used eviction.
+
+    Samples are populated on first access. A lock file serializes additions and evictions, while
+    reads are lock-free: a sample evicted while being accessed is simply a miss.
+
+    Each process counts its hits and misses in memory, and adds them from time to time to the stats
+    file of its slot (rank and DataLoader worker id), so that the number of stats files stays
+    bounded. Stats files are summed by stats().
+
+    Each process that uses the cache holds a shared lock on its in_use file, so that the cache is
+    not deleted as unused by caches created in the same parent directory.
+
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        """Initialization method.
+
+        Args:
+            cache_dir (str): directory of the cache, on a tmpfs (e.g. /dev/shm/...).
+            max_bytes (int): budget of the cache, in bytes.
+
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_bytes)
+        self.samples_dir = os.path.join(cache_dir, "samples")
+        self.stats_dir = os.path.join(cache_dir, "stats")
+        self._lock_path = os.path.join(cache_dir, "lock")
+        self._stats_lock_path = os.path.join(cache_dir, "stats.lock")
+        self._size_path = os.path.join(cache_dir, "size")
+        self._in_use_path = os.path.join(cache_dir, "in_use")
+        self._pid = None
+        self._stats = {"hits": 0, "misses": 0}
+        self._mark_in_use()
+        self._delete_unused_sibling_caches()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_in_use_file"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._mark_in_use()
+
+    def get(self, key: str) -> Optional[SAMPLE_TYPE]:
+        """Get a sample from the cache. None if it is not cached."""
+        path = self._get_sample_path(key)
+        try:
+            with open(path, "rb") as f:
+                sample = pickle.load(f)
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+        try:
+            # The modification time serves as last access time for LRU eviction.
+            os.utime(path)
+        except FileNotFoundError:
+            pass  # Evicted by another process since it was loaded.
+        self._count("hits")
+        return sample
+
+    def put(self, key: str, sample: SAMPLE_TYPE) -> None:
+        """Add a sample to the cache, evicting least recently used samples if over budget."""
+        data = pickle.dumps(sample, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return
+        path = self._get_sample_path(key)
+        with self._lock():
+            if os.path.exists(path):
+                # Added by another worker in the meantime.
+                return
+            size = self._read_size()
+            if size + len(data) > self.max_bytes:
+                size = self._evict(self.max_bytes * EVICTION_TARGET_RATIO - len(data))
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._write_size(size + len(data))
+
+    def stats(self) -> Dict[str, int]:
+        """Sum of hits and misses of all processes that used the cache."""
+        self._flush_stats()
+        stats = {"hits": 0, "misses": 0}
+        for stats_file in os.scandir(self.stats_dir):
+            if stats_file.name.endswith(".tmp"):
+                continue
+            try:
+                with open(stats_file.path, "r") as f:
+                    hits, misses = (int(count) for count in f.read().split())
+            except (FileNotFoundError, ValueError):
+                continue
+            stats["hits"] += hits
+            stats["misses"] += misses
+        stats["size"] = self._read_size()
+        return stats
+
+    def clear(self) -> None:
+        """Delete the cache, freeing up its memory."""
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def _mark_in_use(self) -> None:
+        """Create the cache directory if needed, and hold a shared lock on its in_use file."""
+        while True:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            try:
+                in_use_file = open(self._in_use_path, "a")
+            except FileNotFoundError:
+                continue
+            fcntl.flock(in_use_file, fcntl.LOCK_SH)
+            try:
+                in_use = os.stat(self._in_use_path).st_ino == os.fstat(in_use_file.fileno()).st_ino
+            except FileNotFoundError:
+                in_use = False
+            if in_use:
+                break
+            # The cache was deleted as unused before the lock was acquired: create it again.
+            in_use_file.close()
+        self._in_use_file = in_use_file
+        os.makedirs(self.samples_dir, exist_ok=True)
+        os.makedirs(self.stats_dir, exist_ok=True)
+
+    def _delete_unused_sibling_caches(self) -> None:
+        """Delete other caches of the parent directory that no process uses.
+
+        A cache is moved out of the way before its deletion, so that a process that starts using it
+        in the meantime creates it again rather than using a partly deleted cache.
+
+        """
+        cache_dir = os.path.abspath(self.cache_dir)
+        for entry in os.scandir(os.path.dirname(cache_dir)):
+            if (
+                entry.path == cache_dir
+                or not CACHE_DIR_NAME_PATTERN.fullmatch(entry.name)
+                or not os.path.isdir(os.path.join(entry.path, "samples"))
+            ):
+                continue
+            try:
+                with open(os.path.join(entry.path, "in_use"), "a") as in_use_file:
+                    fcntl.flock(in_use_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    deleted_path = f"{entry.path}.{os.getpid()}.deleted"
+                    os.rename(entry.path, deleted_path)
+                shutil.rmtree(deleted_path, ignore_errors=True)
+            except (BlockingIOError, FileNotFoundError):
+                continue
+
+    def _get_sample_path(self, key: str) -> str:
+        return os.path.join(self.samples_dir, hashlib.md5(key.encode("utf-8")).hexdigest())
+
+    def _evict(self, target_bytes: float) -> int:
+        """Delete least recently used samples until the cache holds at most target_bytes.
+
+        Returns:
+            int: the new size of the cache.
+
+        """
+        entries = [
+            entry for entry in os.scandir(self.samples_dir) if not entry.name.endswith(".tmp")
+        ]
+        entries = sorted(entries, key=lambda entry: entry.stat().st_mtime)
+        size = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if size <= target_bytes:
+                break
+            size -= entry.stat().st_size
+            os.remove(entry.path)
+        return size
+
+    def _count(self, event: str) -> None:
+        # Counters are reset in each new process (e.g. DataLoader workers) that uses the cache, and
+        # flushed when the process exits.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._stats = {"hits": 0, "misses": 0}
+            multiprocessing_util.Finalize(self, self._flush_stats, exitpriority=0)
+        self._stats[event] += 1
+        if self._stats["hits"] + self._stats["misses"] >= STATS_FLUSH_INTERVAL:
+            self._flush_stats()
+
+    def _flush_stats(self) -> None:
+        """Add hits and misses counted since the last flush to the stats file of this slot."""
+        if self._pid != os.getpid() or not self._stats["hits"] + self._stats["misses"]:
+            return
+        worker_info = get_worker_info()
+        worker_id = "main" if worker_info is None else worker_info.id
+        slot = f"rank{os.environ.get('LOCAL_RANK', 0)}-worker{worker_id}"
+        stats_path = os.path.join(self.stats_dir, slot)
+        # Processes may share a slot (e.g. workers of training and validation DataLoaders).
+        with self._lock(self._stats_lock_path):
+            hits, misses = 0, 0
+            try:
+                with open(stats_path, "r") as f:
+                    hits, misses = (int(count) for count in f.read().split())
+            except (FileNotFoundError, ValueError):
+                pass
+            tmp_path = f"{stats_path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(f"{hits + self._stats['hits']} {misses + self._stats['misses']}")
+            os.replace(tmp_path, stats_path)
+        self._stats = {"hits": 0, "misses": 0}
+
+    def _read_size(self) -> int:
+        try:
+            with open(self._size_path, "r") as f:
+                return int(f.read())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_size(self, size: int) -> None:
+        with open(self._size_path, "w") as f:
+            f.write(str(size))
+
+    @contextmanager
+    def _lock(self, lock_path: Optional[str] = None):
+        with open(lock_path or self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
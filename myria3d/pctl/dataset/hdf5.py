@@ -1,22 +1,52 @@
 import copy
+import functools
+import hashlib
+import itertools
 import os
-import os.path as osp
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from numbers import Number
-from typing import Callable, List, Optional
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
 
 import h5py
+import numpy as np
 import torch
 from torch.utils.data import Dataset
 from torch_geometric.data import Data
 from tqdm import tqdm
 
+from myria3d.pctl.dataset.cache import SharedMemorySampleCache
+from myria3d.pctl.dataset.hdf5_layout import (
+    HDF5_LAYOUT_TYPE,
+    HDF5_SCHEMA_TYPE,
+    HDF5_STORAGE_TYPE,
+    SAMPLE_TYPE,
+    SPLITS,
+    build_samples_index,
+    delete_samples_index,
+    get_complete_tiles,
+    get_sample_hdf5_path,
+    get_sample_split,
+    iter_tiles_samples,
+    mark_tile_as_complete,
+    read_sample,
+    read_samples_index,
+    remove_incomplete_tiles,
+    set_layout,
+    set_schema,
+    write_sample,
+    write_samples_index,
+)
+from myria3d.pctl.dataset.prefix_cache import DeterministicPrefixCache
 from myria3d.pctl.dataset.utils import (
     LAS_PATHS_BY_SPLIT_DICT_TYPE,
     SPLIT_TYPE,
+    SUBTILE_SPLITTING_METHOD_TYPE,
     pre_filter_below_n_points,
     split_cloud_into_samples,
 )
 from myria3d.pctl.points_pre_transform.lidar_hd import lidar_hd_pre_transform
+from myria3d.pctl.transforms.compose import CustomCompose
 from myria3d.utils import utils
 
 log = utils.get_logger(__name__)
@@ -37,6 +67,14 @@ class HDF5Dataset(Dataset):
         pre_filter=pre_filter_below_n_points,
         train_transform: List[Callable] = None,
         eval_transform: List[Callable] = None,
+        create_hdf5_num_workers: int = 1,
+        subtile_splitting_method: SUBTILE_SPLITTING_METHOD_TYPE = "kdtree",
+        hdf5_layout: HDF5_LAYOUT_TYPE = "groups",
+        hdf5_storage: Optional[HDF5_STORAGE_TYPE] = None,
+        hdf5_schema: HDF5_SCHEMA_TYPE = "standard",
+        sample_cache_bytes: int = 0,
+        sample_cache_dir: str = "/dev/shm/myria3d",
+        prefix_cache_path: Optional[str] = None,
     ):
         """Initialization, taking care of HDF5 dataset preparation if needed, and indexation of its content.
 
@@ -51,6 +89,19 @@ class HDF5Dataset(Dataset):
             pre_filter (_type_, optional): Function to filter out specific subtiles. Defaults to None.
             train_transform (List[Callable], optional): Transforms to apply to a sample for training. Defaults to None.
             eval_transform (List[Callable], optional): Transforms to apply to a sample for evaluation (test/val sets). Defaults to None.
+            create_hdf5_num_workers (int, optional): Number of processes preparing LAS tiles in parallel. Defaults to 1.
+            subtile_splitting_method (str, optional): Method to split LAS tiles into subtiles, "kdtree" or "grid". Defaults to "kdtree".
+            hdf5_layout (str, optional): Layout of the HDF5 file to create, "groups" or "flat". Files with either layout can be read.
+                Defaults to "groups".
+            hdf5_storage (HDF5_STORAGE_TYPE, optional): Compression and chunking of the datasets of the HDF5 file to create.
+                See myria3d.pctl.dataset.hdf5_layout.get_storage_kwargs. Defaults to None (uncompressed).
+            hdf5_schema (str, optional): Data types of the HDF5 file to create, "standard" or "compact" (float16 features,
+                quantized positions, uint8 classes). Files with either schema can be read. Defaults to "standard".
+            sample_cache_bytes (int, optional): Budget in bytes of a cache of samples in shared memory, shared by all
+                DataLoader workers and all ranks on a node. Defaults to 0 (no cache).
+            sample_cache_dir (str, optional): Directory of the cache, which should be on a tmpfs. Defaults to "/dev/shm/myria3d".
+            prefix_cache_path (str, optional): Path to a side HDF5 file holding samples after the deterministic prefix of
+                their transforms, which is then skipped. See materialize_prefix_cache. Defaults to None (no precomputation).
 
         """
 
@@ -64,11 +115,18 @@ class HDF5Dataset(Dataset):
         self.subtile_overlap_train = subtile_overlap_train
 
         self.hdf5_file_path = hdf5_file_path
+        self.sample_cache_bytes = sample_cache_bytes
+        self.sample_cache_dir = sample_cache_dir
+        self.prefix_cache = None
+        if prefix_cache_path:
+            self.prefix_cache = DeterministicPrefixCache(prefix_cache_path)
 
         # Instantiates these to null;
         # They are loaded within __getitem__ to support multi-processing training.
         self.dataset = None
-        self._samples_hdf5_paths = None
+        self._samples_index = None
+        self._sample_cache = None
+        self._prefix_cache_keys = None
 
         if not las_paths_by_split_dict:
             log.warning(
@@ -86,23 +144,35 @@ class HDF5Dataset(Dataset):
             pre_filter,
             subtile_overlap_train,
             points_pre_transform,
+            num_workers=create_hdf5_num_workers,
+            subtile_splitting_method=subtile_splitting_method,
+            layout=hdf5_layout,
+            storage=hdf5_storage,
+            schema=hdf5_schema,
         )
 
         # Use property once to be sure that samples are all indexed into the hdf5 file.
-        self.samples_hdf5_paths
+        self.samples_index
 
     def __getitem__(self, idx: int) -> Optional[Data]:
-        sample_hdf5_path = self.samples_hdf5_paths[idx]
-        data = self._get_data(sample_hdf5_path)
-
-        # filter if empty
-        if self.pre_filter and self.pre_filter(data):
-            return None
+        transform_kind = self._get_transform_kind(idx)
+        transform = self.train_transform if transform_kind == "train" else self.eval_transform
+
+        prefix_cache_key = self.prefix_cache_keys.get(transform_kind)
+        if prefix_cache_key:
+            # Deterministic transforms were precomputed: only the remaining ones are applied.
+            data = self.prefix_cache.read(prefix_cache_key, idx)
+            if data is None:
+                return None
+            transform = transform.split_deterministic_prefix()[1]
+        else:
+            data = self._get_data(get_sample_hdf5_path(self.samples_index, idx))
+
+            # filter if empty
+            if self.pre_filter and self.pre_filter(data):
+                return None
 
         # Transforms, including sampling and some augmentations.
-        transform = self.train_transform
-        if sample_hdf5_path.startswith("val") or sample_hdf5_path.startswith("test"):
-            transform = self.eval_transform
         if transform:
             data = transform(data)
 
@@ -121,24 +191,109 @@ class HDF5Dataset(Dataset):
         See https://discuss.pytorch.org/t/dataloader-when-num-worker-0-there-is-bug/25643/16?u=piojanu.
 
         """
-        if self.dataset is None:
-            self.dataset = h5py.File(self.hdf5_file_path, "r")
-
-        grp = self.dataset[sample_hdf5_path]
-        # [...] needed to make a copy of content and avoid closing HDF5.
+        sample = self.sample_cache.get(sample_hdf5_path) if self.sample_cache else None
+        if sample is None:
+            if self.dataset is None:
+                self.dataset = h5py.File(self.hdf5_file_path, "r")
+            sample = read_sample(self.dataset, sample_hdf5_path)
+            if self.sample_cache:
+                self.sample_cache.put(sample_hdf5_path, sample)
         # Nota: idx_in_original_cloud SHOULD be np.ndarray, in order to be batched into a list,
         # which serves to keep track of indivual sample sizes in a simpler way for interpolation.
         return Data(
-            x=torch.from_numpy(grp["x"][...]),
-            pos=torch.from_numpy(grp["pos"][...]),
-            y=torch.from_numpy(grp["y"][...]),
-            idx_in_original_cloud=grp["idx_in_original_cloud"][...],
-            x_features_names=grp["x"].attrs["x_features_names"].tolist(),
-            # num_nodes=grp["pos"][...].shape[0],  # Not needed - performed under the hood.
+            x=torch.from_numpy(sample["x"]),
+            pos=torch.from_numpy(sample["pos"]),
+            y=torch.from_numpy(sample["y"]),
+            idx_in_original_cloud=sample["idx_in_original_cloud"],
+            x_features_names=sample["x_features_names"],
+            # num_nodes=sample["pos"].shape[0],  # Not needed - performed under the hood.
         )
 
     def __len__(self):
-        return len(self.samples_hdf5_paths)
+        return self.samples_index["tile_ids"].shape[0]
+
+    def materialize_prefix_cache(self, num_workers: int = 0) -> None:
+        """Precompute samples after the deterministic prefix of their transforms, if not already done before.
+
+        Transforms of train and eval samples are split into their longest deterministic prefix
+        (e.g. TargetTransform, DropPointsByClass, GridSampling), whose outputs are written to the
+        prefix cache, and their remaining tail (e.g. random sampling, augmentations), which is
+        applied at each access.
+
+        Args:
+            num_workers (int, optional): number of DataLoader workers computing samples. Defaults to 0.
+
+        """
+        if not self.prefix_cache:
+            return
+        keys_indices = {}
+        for transform_kind, splits in [("train", ["train"]), ("eval", ["val", "test"])]:
+            key = self._get_prefix_cache_key(transform_kind)
+            if key is None:
+                continue
+            keys_indices[key] = [
+                idx
+                for split in splits
+                for idx in range(*self.samples_index["split_ranges"][SPLITS.index(split)])
+            ]
+        self.prefix_cache.materialize(
+            keys_indices, len(self), self._compute_prefix, num_workers=num_workers
+        )
+        # Keys are looked up again, now that samples are precomputed.
+        self._prefix_cache_keys = None
+        # The HDF5 file may have been opened here, and should not be inherited by DataLoader workers.
+        if self.dataset is not None:
+            self.dataset.close()
+            self.dataset = None
+
+    @property
+    def prefix_cache_keys(self) -> dict:
+        """Keys of precomputed samples in the prefix cache, by kind of transform ("train" or "eval").
+
+        Kinds of transforms without deterministic prefix, or whose samples are not fully
+        precomputed, are left out.
+
+        """
+        if self._prefix_cache_keys is not None:
+            return self._prefix_cache_keys
+        self._prefix_cache_keys = {}
+        if self.prefix_cache:
+            for transform_kind in ["train", "eval"]:
+                key = self._get_prefix_cache_key(transform_kind)
+                if key is not None and self.prefix_cache.is_complete(key):
+                    self._prefix_cache_keys[transform_kind] = key
+        return self._prefix_cache_keys
+
+    def _get_transform_kind(self, idx: int) -> str:
+        return "eval" if get_sample_split(self.samples_index, idx) in ["val", "test"] else "train"
+
+    def _get_prefix_cache_key(self, transform_kind: str) -> Optional[str]:
+        """Key of samples after the deterministic prefix of a kind of transform. None if there is no such prefix."""
+        transform = self.train_transform if transform_kind == "train" else self.eval_transform
+        if not isinstance(transform, CustomCompose):
+            return None
+        prefix = transform.split_deterministic_prefix()[0]
+        if not prefix.transforms:
+            return None
+        pre_filter = self.pre_filter
+        if isinstance(pre_filter, functools.partial):
+            # The repr of a function holds its memory address, which changes from run to run.
+            pre_filter = (pre_filter.func.__qualname__, pre_filter.args, pre_filter.keywords)
+        elif pre_filter is not None:
+            pre_filter = getattr(pre_filter, "__qualname__", type(pre_filter).__qualname__)
+        key = hashlib.md5(self._get_fingerprint().encode("utf-8"))
+        key.update(f"{transform_kind}{prefix.fingerprint()}{pre_filter}".encode("utf-8"))
+        return key.hexdigest()
+
+    def _compute_prefix(self, idx: int, key: str) -> Optional[Data]:
+        """Load a sample and apply the deterministic prefix of its transforms. None if it is filtered out."""
+        data = self._get_data(get_sample_hdf5_path(self.samples_index, idx))
+        if self.pre_filter and self.pre_filter(data):
+            return None
+        transform = self.train_transform
+        if self._get_transform_kind(idx) == "eval":
+            transform = self.eval_transform
+        return transform.split_deterministic_prefix()[0](data)
 
     @property
     def traindata(self):
@@ -154,44 +309,63 @@ class HDF5Dataset(Dataset):
 
     def _get_split_subset(self, split: SPLIT_TYPE):
         """Get a sub-dataset of a specific (train/val/test) split."""
-        indices = [idx for idx, p in enumerate(self.samples_hdf5_paths) if p.startswith(split)]
-        return torch.utils.data.Subset(self, indices)
+        start, stop = self.samples_index["split_ranges"][SPLITS.index(split)]
+        return torch.utils.data.Subset(self, range(start, stop))
+
+    def get_split_num_points(self, split: SPLIT_TYPE) -> np.ndarray:
+        """Get the number of points of each sample of a split, aligned with its sub-dataset."""
+        start, stop = self.samples_index["split_ranges"][SPLITS.index(split)]
+        return np.diff(self.samples_index["offsets"][start : stop + 1])
 
     @property
-    def samples_hdf5_paths(self):
-        """Index all samples in the dataset, if not already done before."""
+    def samples_index(self):
+        """Index all samples in the dataset, if not already done before.
+
+        The index is a few numpy arrays (see myria3d.pctl.dataset.hdf5_layout.build_samples_index),
+        which are persisted in the HDF5 file, and are cheap to copy to DataLoader workers.
+
+        """
         # Use existing if already loaded as variable.
-        if self._samples_hdf5_paths:
-            return self._samples_hdf5_paths
+        if self._samples_index is not None:
+            return self._samples_index
 
-        # Load as variable if already indexed in hdf5 file. Need to decode b-string.
+        # Load as variable if already indexed in hdf5 file.
         with h5py.File(self.hdf5_file_path, "r") as hdf5_file:
-            if "samples_hdf5_paths" in hdf5_file:
-                self._samples_hdf5_paths = [
-                    sample_path.decode("utf-8") for sample_path in hdf5_file["samples_hdf5_paths"]
-                ]
-                return self._samples_hdf5_paths
-
-        # Otherwise, index samples, and add the index as an attribute to the HDF5 file.
-        self._samples_hdf5_paths = []
-        with h5py.File(self.hdf5_file_path, "r") as hdf5_file:
-            for split in hdf5_file.keys():
-                if split not in ["train", "val", "test"]:
-                    continue
-                for basename in hdf5_file[split].keys():
-                    for sample_number in hdf5_file[split][basename].keys():
-                        self._samples_hdf5_paths.append(osp.join(split, basename, sample_number))
+            self._samples_index = read_samples_index(hdf5_file)
+        if self._samples_index is not None:
+            return self._samples_index
 
+        # Otherwise, index samples, and persist the index into the HDF5 file.
         with h5py.File(self.hdf5_file_path, "a") as hdf5_file:
-            # special type to avoid silent string truncation in hdf5 datasets.
-            variable_lenght_str_datatype = h5py.special_dtype(vlen=str)
-            hdf5_file.create_dataset(
-                "samples_hdf5_paths",
-                (len(self.samples_hdf5_paths),),
-                dtype=variable_lenght_str_datatype,
-                data=self._samples_hdf5_paths,
-            )
-        return self._samples_hdf5_paths
+            self._samples_index = build_samples_index(hdf5_file)
+            write_samples_index(hdf5_file, self._samples_index)
+        return self._samples_index
+
+    @property
+    def sample_cache(self) -> Optional[SharedMemorySampleCache]:
+        """Cache of samples in shared memory, if enabled.
+
+        Its directory is specific to the HDF5 file and to its content (as described by the index of
+        samples), so that it is shared by all processes using the same dataset, and never stale.
+
+        """
+        if not self.sample_cache_bytes or self._sample_cache is not None:
+            return self._sample_cache
+        cache_dir = os.path.join(self.sample_cache_dir, self._get_fingerprint())
+        self._sample_cache = SharedMemorySampleCache(cache_dir, self.sample_cache_bytes)
+        return self._sample_cache
+
+    def _get_fingerprint(self) -> str:
+        """A hash of the path of the HDF5 file and of the index of its samples, which changes with its content."""
+        fingerprint = hashlib.md5(os.path.abspath(self.hdf5_file_path).encode("utf-8"))
+        for key in ["tiles", "tile_ids", "sample_numbers", "offsets"]:
+            fingerprint.update(np.asarray(self.samples_index[key]).tobytes())
+        return fingerprint.hexdigest()
+
+    @property
+    def samples_hdf5_paths(self) -> List[str]:
+        """Paths of all samples in the HDF5 file."""
+        return [get_sample_hdf5_path(self.samples_index, idx) for idx in range(len(self))]
 
 
 def create_hdf5(
@@ -203,9 +377,19 @@ def create_hdf5(
     pre_filter: Optional[Callable[[Data], bool]] = pre_filter_below_n_points,
     subtile_overlap_train: Number = 0,
     points_pre_transform: Callable = lidar_hd_pre_transform,
+    num_workers: int = 1,
+    subtile_splitting_method: SUBTILE_SPLITTING_METHOD_TYPE = "kdtree",
+    layout: HDF5_LAYOUT_TYPE = "groups",
+    storage: Optional[HDF5_STORAGE_TYPE] = None,
+    schema: HDF5_SCHEMA_TYPE = "standard",
 ):
     """Create a HDF5 dataset file from las.
 
+    With num_workers > 1, LAS tiles are read, split into subtiles and preprocessed in parallel by
+    a pool of worker processes, while the current process is the single writer to the HDF5 file.
+    A tile is flagged as complete only once all of its subtiles are written, so that an interrupted
+    preparation can be resumed in both modes.
+
     Args:
         las_paths_by_split_dict ([LAS_PATHS_BY_SPLIT_DICT_TYPE]): should look like
                 las_paths_by_split_dict = {'train': ['dir/las1.las','dir/las2.las'], 'val': [...], , 'test': [...]},
@@ -216,78 +400,180 @@ def create_hdf5(
         pre_filter: Function to filter out specific subtiles. "pre_filter_below_n_points" by default,
         subtile_overlap_train (Number, optional): Overlap for data augmentation of train set. 0 by default,
         points_pre_transform (Callable): Function to turn pdal points into a pyg Data object.
+        num_workers (int, optional): number of processes preparing tiles in parallel. 1 by default (no parallelism).
+        subtile_splitting_method (str, optional): method to split LAS tiles into subtiles, "kdtree" or "grid". "kdtree" by default.
+        layout (str, optional): layout of the HDF5 file, "groups" (one group per subtile) or "flat" (one dataset per field,
+        with offsets of subtiles). See myria3d.pctl.dataset.hdf5_layout. "groups" by default.
+        storage (HDF5_STORAGE_TYPE, optional): compression and chunking of datasets, for all fields or per field.
+        See myria3d.pctl.dataset.hdf5_layout.get_storage_kwargs. None by default (uncompressed).
+        schema (str, optional): data types of the HDF5 file, "standard" or "compact" (float16 features, positions quantized
+        at 1 cm, uint8 classes). See myria3d.pctl.dataset.hdf5_layout. "standard" by default.
 
     """
     os.makedirs(os.path.dirname(hdf5_file_path), exist_ok=True)
+    with h5py.File(hdf5_file_path, "a") as hdf5_file:
+        set_layout(hdf5_file, layout)
+        set_schema(hdf5_file, schema)
     for split, las_paths in las_paths_by_split_dict.items():
-        with h5py.File(hdf5_file_path, "a") as f:
-            if split not in f:
-                f.create_group(split)
-        for las_path in tqdm(las_paths, desc=f"Preparing {split} set..."):
-            basename = os.path.basename(las_path)
-
-            # Delete dataset for incomplete LAS entry, to start from scratch.
-            # Useful in case data preparation was interrupted.
-            with h5py.File(hdf5_file_path, "a") as hdf5_file:
-                if (
-                    basename in hdf5_file[split]
-                    and "is_complete" not in hdf5_file[split][basename].attrs
-                ):
-                    del hdf5_file[split][basename]
-                    # Parse and add subtiles to split group.
+        las_paths_to_prepare = _get_las_paths_to_prepare(hdf5_file_path, split, las_paths)
+        subtile_overlap = subtile_overlap_train if split == "train" else 0  # No overlap at eval time.
+        prepare_kwargs = dict(
+            epsg=epsg,
+            tile_width=tile_width,
+            subtile_width=subtile_width,
+            subtile_overlap=subtile_overlap,
+            subtile_splitting_method=subtile_splitting_method,
+            pre_filter=pre_filter,
+            points_pre_transform=points_pre_transform,
+        )
+        if num_workers > 1:
+            prepared_tiles = _prepare_tiles_in_parallel(
+                las_paths_to_prepare, num_workers, **prepare_kwargs
+            )
+        else:
+            prepared_tiles = (
+                (las_path, _iter_tile_samples(las_path, **prepare_kwargs))
+                for las_path in las_paths_to_prepare
+            )
+        for las_path, samples in tqdm(
+            prepared_tiles, desc=f"Preparing {split} set...", total=len(las_paths_to_prepare)
+        ):
             with h5py.File(hdf5_file_path, "a") as hdf5_file:
-                if basename in hdf5_file[split]:
-                    continue
-
-                subtile_overlap = (
-                    subtile_overlap_train if split == "train" else 0
-                )  # No overlap at eval time.
-                for sample_number, (sample_idx, sample_points) in enumerate(
-                    split_cloud_into_samples(
-                        las_path,
-                        tile_width,
-                        subtile_width,
-                        epsg,
-                        subtile_overlap,
-                    )
-                ):
-                    if not points_pre_transform:
-                        continue
-                    data = points_pre_transform(sample_points)
-                    if pre_filter is not None and pre_filter(data):
-                        # e.g. pre_filter spots situations where num_nodes is too small.
-                        continue
-                    hdf5_path = os.path.join(split, basename, str(sample_number).zfill(5))
-                    hd5f_path_x = os.path.join(hdf5_path, "x")
-                    hdf5_file.create_dataset(
-                        hd5f_path_x,
-                        data.x.shape,
-                        dtype="f",
-                        data=data.x,
-                    )
-                    hdf5_file[hd5f_path_x].attrs["x_features_names"] = copy.deepcopy(
-                        data.x_features_names
-                    )
-                    hdf5_file.create_dataset(
-                        os.path.join(hdf5_path, "pos"),
-                        data.pos.shape,
-                        dtype="f",
-                        data=data.pos,
-                    )
-                    hdf5_file.create_dataset(
-                        os.path.join(hdf5_path, "y"),
-                        data.y.shape,
-                        dtype="i",
-                        data=data.y,
-                    )
-                    hdf5_file.create_dataset(
-                        os.path.join(hdf5_path, "idx_in_original_cloud"),
-                        sample_idx.shape,
-                        dtype="i",
-                        data=sample_idx,
-                    )
-
-                # A termination flag to report that all samples for this point cloud were included in the df5 file.
-                # Group may not have been created if source cloud had no patch passing the pre_filter step, hence the "if" here.
-                if basename in hdf5_file[split]:
-                    hdf5_file[split][basename].attrs["is_complete"] = True
+                _write_tile(hdf5_file, split, os.path.basename(las_path), samples, storage)
+
+
+def convert_hdf5_layout(
+    src_hdf5_file_path: str,
+    dst_hdf5_file_path: str,
+    layout: HDF5_LAYOUT_TYPE,
+    storage: Optional[HDF5_STORAGE_TYPE] = None,
+    schema: HDF5_SCHEMA_TYPE = "standard",
+) -> str:
+    """Copy the samples of a HDF5 dataset file into a new file with a different layout, storage options, or schema.
+
+    Only fully prepared LAS tiles are copied. Conversion can be resumed if interrupted.
+
+    Args:
+        src_hdf5_file_path (str): path to the HDF5 dataset to convert.
+        dst_hdf5_file_path (str): path to the converted HDF5 dataset.
+        layout (str): layout of the converted HDF5 dataset, "groups" or "flat".
+        storage (HDF5_STORAGE_TYPE, optional): compression and chunking of the converted HDF5 dataset.
+        None by default (uncompressed).
+        schema (str, optional): schema of the converted HDF5 dataset, "standard" or "compact". "standard" by default.
+
+    Returns:
+        str: path to the converted HDF5 dataset.
+
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(dst_hdf5_file_path)), exist_ok=True)
+    with h5py.File(src_hdf5_file_path, "r") as src_file, h5py.File(
+        dst_hdf5_file_path, "a"
+    ) as dst_file:
+        set_layout(dst_file, layout)
+        set_schema(dst_file, schema)
+        for split, basename, samples in tqdm(
+            iter_tiles_samples(src_file), desc=f"Converting to {layout} layout..."
+        ):
+            remove_incomplete_tiles(dst_file, split)
+            if basename in get_complete_tiles(dst_file, split):
+                continue
+            _write_tile(dst_file, split, basename, samples, storage)
+    return dst_hdf5_file_path
+
+
+def _write_tile(
+    hdf5_file: h5py.File,
+    split: SPLIT_TYPE,
+    basename: str,
+    samples: Iterable[Tuple[int, SAMPLE_TYPE]],
+    storage: Optional[HDF5_STORAGE_TYPE] = None,
+):
+    """Write all samples of a LAS tile, then flag the tile as complete."""
+    for sample_number, sample in samples:
+        write_sample(hdf5_file, split, basename, sample_number, sample, storage)
+    mark_tile_as_complete(hdf5_file, split, basename)
+    # Samples were added: the index of samples is outdated.
+    delete_samples_index(hdf5_file)
+
+
+def _get_las_paths_to_prepare(hdf5_file_path: str, split: SPLIT_TYPE, las_paths: List[str]):
+    """Get LAS paths that are not already fully prepared in the HDF5 file.
+
+    Delete dataset for incomplete LAS entry, to start from scratch.
+    Useful in case data preparation was interrupted.
+
+    """
+    with h5py.File(hdf5_file_path, "a") as hdf5_file:
+        remove_incomplete_tiles(hdf5_file, split)
+        complete_tiles = get_complete_tiles(hdf5_file, split)
+    return [
+        las_path for las_path in las_paths if os.path.basename(las_path) not in complete_tiles
+    ]
+
+
+def _iter_tile_samples(
+    las_path: str,
+    epsg: str,
+    tile_width: Number,
+    subtile_width: Number,
+    subtile_overlap: Number,
+    subtile_splitting_method: SUBTILE_SPLITTING_METHOD_TYPE,
+    pre_filter: Optional[Callable[[Data], bool]],
+    points_pre_transform: Callable,
+) -> Iterator[Tuple[int, SAMPLE_TYPE]]:
+    """Split a LAS tile into subtiles and yield them as numpy arrays, ready to be written."""
+    for sample_number, (sample_idx, sample_points) in enumerate(
+        split_cloud_into_samples(
+            las_path,
+            tile_width,
+            subtile_width,
+            epsg,
+            subtile_overlap,
+            subtile_splitting_method,
+        )
+    ):
+        if not points_pre_transform:
+            continue
+        data = points_pre_transform(sample_points)
+        if pre_filter is not None and pre_filter(data):
+            # e.g. pre_filter spots situations where num_nodes is too small.
+            continue
+        # Numpy arrays rather than tensors, since samples may be sent between processes.
+        yield sample_number, {
+            "x": np.asarray(data.x, dtype=np.float32),
+            "x_features_names": copy.deepcopy(data.x_features_names),
+            "pos": np.asarray(data.pos, dtype=np.float32),
+            "y": np.asarray(data.y, dtype=np.int32),
+            "idx_in_original_cloud": np.asarray(sample_idx, dtype=np.int32),
+        }
+
+
+def _prepare_tile(las_path: str, **prepare_kwargs) -> List[Tuple[int, SAMPLE_TYPE]]:
+    """Prepare all samples of a LAS tile at once, in a worker process."""
+    return list(_iter_tile_samples(las_path, **prepare_kwargs))
+
+
+def _prepare_tiles_in_parallel(
+    las_paths: List[str], num_workers: int, **prepare_kwargs
+) -> Iterator[Tuple[str, List[Tuple[int, SAMPLE_TYPE]]]]:
+    """Prepare LAS tiles in a pool of processes, and yield them in order of submission.
+
+    Tiles are therefore written in the same order as by a sequential preparation, and so are the
+    samples of the flat layout. The number of tiles in flight is bounded, so that prepared tiles
+    do not pile up in memory when the writer, or a slow tile, holds back the others.
+
+    """
+    max_tiles_in_flight = 2 * num_workers
+    las_paths_iterator = iter(las_paths)
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = deque(
+            (las_path, executor.submit(_prepare_tile, las_path, **prepare_kwargs))
+            for las_path in itertools.islice(las_paths_iterator, max_tiles_in_flight)
+        )
+        while futures:
+            las_path, future = futures.popleft()
+            samples = future.result()
+            for next_las_path in itertools.islice(las_paths_iterator, 1):
+                next_future = executor.submit(_prepare_tile, next_las_path, **prepare_kwargs)
+                futures.append((next_las_path, next_future))
+            yield las_path, samples
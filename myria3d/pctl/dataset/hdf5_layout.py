@@ -0,0 +1,493 @@
+"""Reading and writing of samples (subtiles) in the HDF5 dataset file, for each of its layouts.
+
+Two layouts are supported:
+
+groups (default):
+    One group per sample, at path {split}/{basename}/{sample_number}, containing small datasets
+    x, pos, y, and idx_in_original_cloud. A LAS tile is fully prepared when its group
+    {split}/{basename} has an `is_complete` attribute.
+
+flat:
+    One large, chunked dataset per field in each split group, in which samples are concatenated
+    along the first axis. The points of the i-th sample of a split are at rows
+    offsets[i]:offsets[i+1]. Samples of a split also have a tile_id (index in the `tiles` dataset,
+    which lists fully prepared tiles) and a sample_number.
+
+In both layouts, the compression and chunking of datasets can be set with storage options, for all
+fields or per field (see get_storage_kwargs).
+
+Two schemas are supported for the data types of fields:
+
+standard (default):
+    float32 features and positions, int32 classes and indices.
+
+compact:
+    float16 features (clipped to the float16 range), int32 positions quantized at 1 cm relative to
+    a per-sample origin (stored as float64), uint8 classes, and int32 indices. Samples are decoded
+    back to the standard data types on read, which is transparent to the rest of the code.
+
+"""
+
+import os
+from typing import Any, Callable, Dict, Iterator, List, Literal, Optional, Set, Tuple, Union
+
+import h5py
+import numpy as np
+
+try:
+    # Registers the blosc filter, needed to write and to read blosc-compressed datasets.
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+from myria3d.pctl.dataset.utils import SPLIT_TYPE
+
+HDF5_LAYOUT_TYPE = Union[Literal["groups"], Literal["flat"]]
+SAMPLE_TYPE = Dict[str, Any]
+HDF5_STORAGE_TYPE = Dict[str, Any]
+HDF5_SCHEMA_TYPE = Union[Literal["standard"], Literal["compact"]]
+SAMPLES_INDEX_TYPE = Dict[str, Any]
+
+LAYOUT_ATTRIBUTE = "layout"
+SCHEMA_ATTRIBUTE = "schema"
+POS_SCALE_ATTRIBUTE = "pos_scale"
+SAMPLES_INDEX_GROUP = "samples_index"
+SPLITS = ["train", "val", "test"]
+POINTS_FIELDS = ["x", "pos", "y", "idx_in_original_cloud"]
+SCHEMAS_FIELDS_DTYPES = {
+    "standard": {"x": "f4", "pos": "f4", "y": "i4", "idx_in_original_cloud": "i4"},
+    "compact": {"x": "f2", "pos": "i4", "y": "u1", "idx_in_original_cloud": "i4"},
+}
+# Quantization step of positions with the compact schema, the usual scale of LAS coordinates.
+COMPACT_POS_SCALE = 0.01
+COMPRESSIONS = [None, "lzf", "gzip", "blosc"]
+
+# special type to avoid silent string truncation in hdf5 datasets.
+VARIABLE_LENGTH_STR_DATATYPE = h5py.special_dtype(vlen=str)
+
+
+def get_layout(hdf5_file: h5py.File) -> HDF5_LAYOUT_TYPE:
+    """Get the layout of a HDF5 dataset file. Files without layout attribute use groups."""
+    return hdf5_file.attrs.get(LAYOUT_ATTRIBUTE, "groups")
+
+
+def set_layout(hdf5_file: h5py.File, layout: HDF5_LAYOUT_TYPE) -> None:
+    """Set the layout of a new HDF5 dataset file, or check that it matches an existing file."""
+    _set_format_attribute(hdf5_file, LAYOUT_ATTRIBUTE, layout, ["groups", "flat"], get_layout)
+
+
+def get_schema(hdf5_file: h5py.File) -> HDF5_SCHEMA_TYPE:
+    """Get the schema of a HDF5 dataset file. Files without schema attribute are standard."""
+    return hdf5_file.attrs.get(SCHEMA_ATTRIBUTE, "standard")
+
+
+def set_schema(hdf5_file: h5py.File, schema: HDF5_SCHEMA_TYPE) -> None:
+    """Set the schema of a new HDF5 dataset file, or check that it matches an existing file."""
+    _set_format_attribute(hdf5_file, SCHEMA_ATTRIBUTE, schema, ["standard", "compact"], get_schema)
+    if schema == "compact" and POS_SCALE_ATTRIBUTE not in hdf5_file.attrs:
+        hdf5_file.attrs[POS_SCALE_ATTRIBUTE] = COMPACT_POS_SCALE
+
+
+def _set_format_attribute(
+    hdf5_file: h5py.File,
+    name: str,
+    value: str,
+    choices: List[str],
+    getter: Callable[[h5py.File], str],
+) -> None:
+    if value not in choices:
+        raise ValueError(f"Unknown HDF5 {name} {value}. Valid choices are: {', '.join(choices)}.")
+    if any(split in hdf5_file for split in SPLITS):
+        if getter(hdf5_file) != value:
+            raise ValueError(
+                f"HDF5 file {hdf5_file.filename} uses the {getter(hdf5_file)} {name}, "
+                f"and cannot be completed with the {value} {name}. "
+                "Use convert_hdf5_layout to convert it first."
+            )
+        return
+    hdf5_file.attrs[name] = value
+
+
+def get_storage_kwargs(
+    storage: Optional[HDF5_STORAGE_TYPE], field: str, shape: Tuple[int, ...]
+) -> Dict[str, Any]:
+    """Get the compression and chunking arguments of h5py's create_dataset for a field.
+
+    Storage options are: compression (None, "lzf", "gzip", or "blosc" with the lz4 codec, which
+    requires the hdf5plugin package), compression_level (for gzip and blosc), shuffle (bool), and
+    chunk_rows (number of points per chunk, None for automatic chunking). They can be overriden
+    for a specific field under the "fields" key, e.g.
+    {"compression": "lzf", "fields": {"y": {"shuffle": True}}}.
+
+    Args:
+        storage (HDF5_STORAGE_TYPE, optional): storage options. None for uncompressed datasets.
+        field (str): name of the field, e.g. "x".
+        shape (Tuple[int, ...]): shape of the dataset at creation.
+
+    Returns:
+        Dict[str, Any]: keyword arguments for create_dataset.
+
+    """
+    if not storage:
+        return {}
+    options = {key: value for key, value in storage.items() if key != "fields"}
+    options.update((storage.get("fields") or {}).get(field) or {})
+
+    compression = options.get("compression")
+    compression_level = options.get("compression_level")
+    shuffle = bool(options.get("shuffle", False))
+    if compression not in COMPRESSIONS:
+        raise ValueError(
+            f"Unknown HDF5 compression {compression}. Valid choices are: {COMPRESSIONS}."
+        )
+    if compression == "blosc":
+        if hdf5plugin is None:
+            raise ImportError(
+                "Blosc compression of HDF5 datasets requires the hdf5plugin package."
+            )
+        kwargs = dict(
+            hdf5plugin.Blosc(
+                cname="lz4",
+                clevel=5 if compression_level is None else compression_level,
+                shuffle=hdf5plugin.Blosc.SHUFFLE if shuffle else hdf5plugin.Blosc.NOSHUFFLE,
+            )
+        )
+    else:
+        kwargs = {"compression": compression, "shuffle": shuffle}
+        if compression == "gzip" and compression_level is not None:
+            kwargs["compression_opts"] = compression_level
+
+    chunk_rows = options.get("chunk_rows")
+    if chunk_rows:
+        # Chunks cannot be larger than a dataset of fixed size.
+        if shape[0]:
+            chunk_rows = min(chunk_rows, shape[0])
+        kwargs["chunks"] = (chunk_rows, *shape[1:])
+    return kwargs
+
+
+def get_complete_tiles(hdf5_file: h5py.File, split: SPLIT_TYPE) -> Set[str]:
+    """Get basenames of the LAS tiles that were fully prepared for a split."""
+    if split not in hdf5_file:
+        return set()
+    if get_layout(hdf5_file) == "flat":
+        return {tile.decode("utf-8") for tile in hdf5_file[split]["tiles"]}
+    return {
+        basename
+        for basename, tile_group in hdf5_file[split].items()
+        if "is_complete" in tile_group.attrs
+    }
+
+
+def remove_incomplete_tiles(hdf5_file: h5py.File, split: SPLIT_TYPE) -> None:
+    """Delete samples of LAS tiles whose preparation was interrupted, to start them over."""
+    if split not in hdf5_file:
+        hdf5_file.create_group(split)
+    if get_layout(hdf5_file) == "groups":
+        for basename in list(hdf5_file[split].keys()):
+            if "is_complete" not in hdf5_file[split][basename].attrs:
+                del hdf5_file[split][basename]
+        return
+
+    split_group = _require_flat_split_group(hdf5_file, split)
+    # Tiles are written one after the other: samples of the incomplete tile are the last ones.
+    num_complete_tiles = split_group["tiles"].shape[0]
+    num_samples = int(np.searchsorted(split_group["tile_ids"][...], num_complete_tiles))
+    num_points = int(split_group["offsets"][num_samples])
+    for field in POINTS_FIELDS:
+        if field in split_group:
+            split_group[field].resize(num_points, axis=0)
+    for field in ["tile_ids", "sample_numbers", "pos_origin"]:
+        if field in split_group:
+            split_group[field].resize(num_samples, axis=0)
+    split_group["offsets"].resize(num_samples + 1, axis=0)
+
+
+def write_sample(
+    hdf5_file: h5py.File,
+    split: SPLIT_TYPE,
+    basename: str,
+    sample_number: int,
+    sample: SAMPLE_TYPE,
+    storage: Optional[HDF5_STORAGE_TYPE] = None,
+) -> None:
+    """Write a single sample (subtile) of a LAS tile, with optional storage options."""
+    sample, pos_origin = _encode_sample(hdf5_file, sample)
+    if get_layout(hdf5_file) == "flat":
+        _append_flat_sample(hdf5_file, split, sample_number, sample, pos_origin, storage)
+        return
+
+    hdf5_path = os.path.join(split, basename, str(sample_number).zfill(5))
+    fields_dtypes = SCHEMAS_FIELDS_DTYPES[get_schema(hdf5_file)]
+    for field in POINTS_FIELDS:
+        hdf5_file.create_dataset(
+            os.path.join(hdf5_path, field),
+            sample[field].shape,
+            dtype=fields_dtypes[field],
+            data=sample[field],
+            **get_storage_kwargs(storage, field, sample[field].shape),
+        )
+    hdf5_file[os.path.join(hdf5_path, "x")].attrs["x_features_names"] = sample["x_features_names"]
+    if pos_origin is not None:
+        hdf5_file[os.path.join(hdf5_path, "pos")].attrs["origin"] = pos_origin
+
+
+def mark_tile_as_complete(hdf5_file: h5py.File, split: SPLIT_TYPE, basename: str) -> None:
+    """A termination flag to report that all samples for a LAS tile were written."""
+    if get_layout(hdf5_file) == "flat":
+        tiles = _require_flat_split_group(hdf5_file, split)["tiles"]
+        tiles.resize(tiles.shape[0] + 1, axis=0)
+        tiles[-1] = basename
+        return
+    # Group may not have been created if source cloud had no patch passing the pre_filter step,
+    # hence the "if" here.
+    if basename in hdf5_file[split]:
+        hdf5_file[split][basename].attrs["is_complete"] = True
+
+
+def build_samples_index(hdf5_file: h5py.File) -> SAMPLES_INDEX_TYPE:
+    """Index the samples of fully prepared tiles, split after split (train, val, then test).
+
+    The index holds, for each split, the range of its samples (split_ranges), and for each sample
+    the id of its tile (in tiles), its sample number in the tile, and its offset among all points
+    (offsets, with one more element than samples, so that sizes of samples are given by np.diff).
+
+    """
+    layout = get_layout(hdf5_file)
+    tiles, tile_ids, sample_numbers, num_points, split_ranges = [], [], [], [], []
+    for split in SPLITS:
+        start = len(tile_ids)
+        if split in hdf5_file and layout == "flat":
+            split_group = hdf5_file[split]
+            split_tiles = [tile.decode("utf-8") for tile in split_group["tiles"]]
+            split_tile_ids = split_group["tile_ids"][...]
+            # Samples of an interrupted tile, if any, are the last ones.
+            num_samples = int(np.searchsorted(split_tile_ids, len(split_tiles)))
+            tile_ids += (split_tile_ids[:num_samples] + len(tiles)).tolist()
+            sample_numbers += split_group["sample_numbers"][:num_samples].tolist()
+            num_points += np.diff(split_group["offsets"][: num_samples + 1]).tolist()
+            tiles += split_tiles
+        elif split in hdf5_file:
+            for basename, tile_group in hdf5_file[split].items():
+                if "is_complete" not in tile_group.attrs:
+                    continue
+                for sample_number, sample_group in tile_group.items():
+                    tile_ids.append(len(tiles))
+                    sample_numbers.append(int(sample_number))
+                    num_points.append(sample_group["pos"].shape[0])
+                tiles.append(basename)
+        split_ranges.append((start, len(tile_ids)))
+    return {
+        "layout": layout,
+        "split_ranges": np.array(split_ranges, dtype=np.int64),
+        "tiles": tiles,
+        "tile_ids": np.array(tile_ids, dtype=np.int32),
+        "sample_numbers": np.array(sample_numbers, dtype=np.int32),
+        "offsets": np.concatenate([[0], np.cumsum(num_points, dtype=np.int64)]),
+    }
+
+
+def write_samples_index(hdf5_file: h5py.File, samples_index: SAMPLES_INDEX_TYPE) -> None:
+    """Persist the index of samples in the HDF5 file, replacing an outdated one if any."""
+    delete_samples_index(hdf5_file)
+    index_group = hdf5_file.create_group(SAMPLES_INDEX_GROUP)
+    for key in ["split_ranges", "tile_ids", "sample_numbers", "offsets"]:
+        index_group.create_dataset(key, data=samples_index[key])
+    index_group.create_dataset(
+        "tiles",
+        (len(samples_index["tiles"]),),
+        dtype=VARIABLE_LENGTH_STR_DATATYPE,
+        data=samples_index["tiles"],
+    )
+
+
+def read_samples_index(hdf5_file: h5py.File) -> Optional[SAMPLES_INDEX_TYPE]:
+    """Read the index of samples persisted in the HDF5 file. None if not indexed yet."""
+    if SAMPLES_INDEX_GROUP not in hdf5_file:
+        return None
+    index_group = hdf5_file[SAMPLES_INDEX_GROUP]
+    samples_index = {
+        key: index_group[key][...]
+        for key in ["split_ranges", "tile_ids", "sample_numbers", "offsets"]
+    }
+    samples_index["tiles"] = [tile.decode("utf-8") for tile in index_group["tiles"]]
+    samples_index["layout"] = get_layout(hdf5_file)
+    return samples_index
+
+
+def delete_samples_index(hdf5_file: h5py.File) -> None:
+    """Delete the index of samples, e.g. when samples are added and it becomes outdated."""
+    # samples_hdf5_paths is the index of previous versions, a list of paths of samples.
+    for key in [SAMPLES_INDEX_GROUP, "samples_hdf5_paths"]:
+        if key in hdf5_file:
+            del hdf5_file[key]
+
+
+def get_sample_split(samples_index: SAMPLES_INDEX_TYPE, idx: int) -> SPLIT_TYPE:
+    """Get the split of a sample from its index."""
+    split_stops = samples_index["split_ranges"][:, 1]
+    return SPLITS[int(np.searchsorted(split_stops, idx, side="right"))]
+
+
+def get_sample_hdf5_path(samples_index: SAMPLES_INDEX_TYPE, idx: int) -> str:
+    """Get the path of a sample from its index. With the flat layout, paths are {split}/{row}."""
+    split = get_sample_split(samples_index, idx)
+    if samples_index["layout"] == "flat":
+        split_start = samples_index["split_ranges"][SPLITS.index(split), 0]
+        return f"{split}/{idx - split_start}"
+    basename = samples_index["tiles"][samples_index["tile_ids"][idx]]
+    return os.path.join(split, basename, str(samples_index["sample_numbers"][idx]).zfill(5))
+
+
+def list_samples_hdf5_paths(hdf5_file: h5py.File) -> List[str]:
+    """List paths of all samples of fully prepared tiles in the file."""
+    samples_index = build_samples_index(hdf5_file)
+    num_samples = samples_index["tile_ids"].shape[0]
+    return [get_sample_hdf5_path(samples_index, idx) for idx in range(num_samples)]
+
+
+def read_sample(hdf5_file: h5py.File, sample_hdf5_path: str) -> SAMPLE_TYPE:
+    """Read a sample from its path, as listed by list_samples_hdf5_paths."""
+    if get_layout(hdf5_file) == "flat":
+        split, row = sample_hdf5_path.split("/")
+        split_group = hdf5_file[split]
+        start, stop = split_group["offsets"][int(row) : int(row) + 2]
+        sample = {field: split_group[field][start:stop] for field in POINTS_FIELDS}
+        sample["x_features_names"] = split_group["x"].attrs["x_features_names"].tolist()
+        if "pos_origin" in split_group:
+            return _decode_sample(hdf5_file, sample, split_group["pos_origin"][int(row)])
+        return sample
+
+    grp = hdf5_file[sample_hdf5_path]
+    # [...] needed to make a copy of content and avoid closing HDF5.
+    sample = {field: grp[field][...] for field in POINTS_FIELDS}
+    sample["x_features_names"] = grp["x"].attrs["x_features_names"].tolist()
+    if "origin" in grp["pos"].attrs:
+        return _decode_sample(hdf5_file, sample, grp["pos"].attrs["origin"])
+    return sample
+
+
+def iter_tiles_samples(
+    hdf5_file: h5py.File,
+) -> Iterator[Tuple[SPLIT_TYPE, str, Iterator[Tuple[int, SAMPLE_TYPE]]]]:
+    """Iterate over fully prepared tiles, and lazily over their samples."""
+    for split in hdf5_file.keys():
+        if split not in SPLITS:
+            continue
+        if get_layout(hdf5_file) == "groups":
+            for basename, tile_group in hdf5_file[split].items():
+                if "is_complete" not in tile_group.attrs:
+                    continue
+                yield split, basename, (
+                    (int(sample_number), read_sample(hdf5_file, tile_group[sample_number].name))
+                    for sample_number in tile_group.keys()
+                )
+            continue
+
+        split_group = hdf5_file[split]
+        tile_ids = split_group["tile_ids"][...]
+        sample_numbers = split_group["sample_numbers"][...]
+        for tile_id, basename in enumerate(split_group["tiles"]):
+            rows = np.flatnonzero(tile_ids == tile_id)
+            yield split, basename.decode("utf-8"), (
+                (int(sample_numbers[row]), read_sample(hdf5_file, f"{split}/{row}"))
+                for row in rows
+            )
+
+
+def _require_flat_split_group(hdf5_file: h5py.File, split: SPLIT_TYPE) -> h5py.Group:
+    """Get a split group with the flat layout, creating its (empty) datasets if needed."""
+    split_group = hdf5_file.require_group(split)
+    if "offsets" in split_group:
+        return split_group
+    split_group.create_dataset("offsets", data=np.zeros(1), maxshape=(None,), dtype="i8")
+    split_group.create_dataset("tile_ids", (0,), maxshape=(None,), dtype="i4")
+    split_group.create_dataset("sample_numbers", (0,), maxshape=(None,), dtype="i4")
+    split_group.create_dataset("tiles", (0,), maxshape=(None,), dtype=VARIABLE_LENGTH_STR_DATATYPE)
+    # Datasets of points are created with the first sample, e.g. since the number of features is
+    # unknown yet.
+    return split_group
+
+
+def _append_flat_sample(
+    hdf5_file: h5py.File,
+    split: SPLIT_TYPE,
+    sample_number: int,
+    sample: SAMPLE_TYPE,
+    pos_origin: Optional[np.ndarray] = None,
+    storage: Optional[HDF5_STORAGE_TYPE] = None,
+) -> None:
+    split_group = _require_flat_split_group(hdf5_file, split)
+    if "x" not in split_group:
+        fields_dtypes = SCHEMAS_FIELDS_DTYPES[get_schema(hdf5_file)]
+        for field in POINTS_FIELDS:
+            shape = (0, *sample[field].shape[1:])
+            split_group.create_dataset(
+                field,
+                shape,
+                maxshape=(None, *shape[1:]),
+                dtype=fields_dtypes[field],
+                **get_storage_kwargs(storage, field, shape),
+            )
+        split_group["x"].attrs["x_features_names"] = sample["x_features_names"]
+        if pos_origin is not None:
+            split_group.create_dataset("pos_origin", (0, 3), maxshape=(None, 3), dtype="f8")
+
+    offsets = split_group["offsets"]
+    start = int(offsets[-1])
+    stop = start + sample["pos"].shape[0]
+    for field in POINTS_FIELDS:
+        split_group[field].resize(stop, axis=0)
+        split_group[field][start:stop] = sample[field]
+
+    num_samples = offsets.shape[0] - 1
+    offsets.resize(num_samples + 2, axis=0)
+    offsets[-1] = stop
+    tile_ids, sample_numbers = split_group["tile_ids"], split_group["sample_numbers"]
+    tile_ids.resize(num_samples + 1, axis=0)
+    tile_ids[-1] = split_group["tiles"].shape[0]
+    sample_numbers.resize(num_samples + 1, axis=0)
+    sample_numbers[-1] = sample_number
+    if pos_origin is not None:
+        split_group["pos_origin"].resize(num_samples + 1, axis=0)
+        split_group["pos_origin"][-1] = pos_origin
+
+
+def _encode_sample(
+    hdf5_file: h5py.File, sample: SAMPLE_TYPE
+) -> Tuple[SAMPLE_TYPE, Optional[np.ndarray]]:
+    """Encode a sample to the schema of the file.
+
+    Returns:
+        SAMPLE_TYPE, np.ndarray: the encoded sample, and the origin of its positions (if any).
+
+    """
+    if get_schema(hdf5_file) == "standard":
+        return sample, None
+
+    # Rare values beyond the range of float16 (e.g. intensities above 65504) are clipped.
+    float16_info = np.finfo(np.float16)
+    x = np.clip(sample["x"], float16_info.min, float16_info.max).astype(np.float16)
+    y = sample["y"]
+    if y.size and (y.min() < 0 or y.max() > np.iinfo(np.uint8).max):
+        raise ValueError(
+            "Classes exceed the range of uint8 and cannot be stored with the compact schema."
+        )
+
+    scale = hdf5_file.attrs[POS_SCALE_ATTRIBUTE]
+    pos = sample["pos"].astype(np.float64)
+    pos_origin = np.floor(pos.min(axis=0) / scale) * scale if pos.size else np.zeros(3)
+    encoded_sample = dict(sample, x=x, y=y.astype(np.uint8))
+    encoded_sample["pos"] = np.round((pos - pos_origin) / scale).astype(np.int32)
+    return encoded_sample, pos_origin
+
+
+def _decode_sample(
+    hdf5_file: h5py.File, sample: SAMPLE_TYPE, pos_origin: np.ndarray
+) -> SAMPLE_TYPE:
+    """Decode a sample stored with the compact schema back to the standard data types."""
+    scale = hdf5_file.attrs[POS_SCALE_ATTRIBUTE]
+    sample["pos"] = (pos_origin + sample["pos"] * scale).astype(np.float32)
+    sample["x"] = sample["x"].astype(np.float32)
+    sample["y"] = sample["y"].astype(np.int32)
+    return sample
@@ -1,12 +1,14 @@
 from numbers import Number
 from typing import Callable, Optional
 
+import numpy as np
 import torch
 from numpy.typing import ArrayLike
 from torch.utils.data.dataset import IterableDataset
 from torch_geometric.data import Data
 
 from myria3d.pctl.dataset.utils import (
+    SUBTILE_SPLITTING_METHOD_TYPE,
     pre_filter_below_n_points,
     split_cloud_into_samples,
 )
@@ -26,6 +28,8 @@ class InferenceDataset(IterableDataset):
         tile_width: Number = 1000,
         subtile_width: Number = 50,
         subtile_overlap: Number = 0,
+        subtile_splitting_method: SUBTILE_SPLITTING_METHOD_TYPE = "kdtree",
+        points: Optional[np.ndarray] = None,
     ):
         self.las_file = las_file
         self.epsg = epsg
@@ -37,6 +41,9 @@ class InferenceDataset(IterableDataset):
         self.tile_width = tile_width
         self.subtile_width = subtile_width
         self.subtile_overlap = subtile_overlap
+        self.subtile_splitting_method = subtile_splitting_method
+        # Points already read from las_file (see pdal_read_las_array), to avoid reading it again.
+        self.points = points
 
     def __iter__(self):
         return self.get_iterator()
@@ -49,6 +56,8 @@ class InferenceDataset(IterableDataset):
             self.subtile_width,
             self.epsg,
             self.subtile_overlap,
+            self.subtile_splitting_method,
+            points=self.points,
         ):
             sample_data = self.points_pre_transform(sample_points)
             sample_data["x"] = torch.from_numpy(sample_data["x"])
@@ -0,0 +1,174 @@
+"""Reading of LAS/LAZ metadata from the public header and (extended) variable length records only.
+
+Points are never read, so that metadata of a tile is available in constant time, whatever its
+size. The spatial reference system (SRS) of a tile is found in the records of the
+LASF_Projection user: OGC coordinate system WKT (2112), OGC math transform WKT (2111), or
+GeoTIFF keys (34735).
+
+Metadata are cached per path and version of the file (modification time and size), so that code
+paths that need the header of a tile (get_pdal_reader, Interpolator) read it once. get_metadata and
+get_pdal_info_metadata, which run pdal, share the same cache: each of them still reads a file once
+per version, since they return different metadata.
+
+"""
+
+import copy
+import functools
+import os
+import struct
+from typing import Any, Callable, NamedTuple, Optional, Tuple
+
+LAS_SIGNATURE = b"LASF"
+PROJECTION_USER_ID = "LASF_Projection"
+OGC_MATH_TRANSFORM_WKT_RECORD_ID = 2111
+OGC_COORDINATE_SYSTEM_WKT_RECORD_ID = 2112
+GEO_KEY_DIRECTORY_RECORD_ID = 34735
+SRS_RECORD_IDS = [
+    OGC_COORDINATE_SYSTEM_WKT_RECORD_ID,
+    OGC_MATH_TRANSFORM_WKT_RECORD_ID,
+    GEO_KEY_DIRECTORY_RECORD_ID,
+]
+# GeoTIFF keys of the horizontal coordinate system, by order of precedence.
+PROJECTED_CS_TYPE_GEO_KEY = 3072
+GEOGRAPHIC_TYPE_GEO_KEY = 2048
+USER_DEFINED_GEO_KEY_VALUE = 32767
+
+VLR_HEADER_SIZE = 54
+EVLR_HEADER_SIZE = 60
+METADATA_CACHE_SIZE = 256
+
+
+class LasHeader(NamedTuple):
+    """Metadata of a LAS/LAZ file, from its header and records."""
+
+    version: str
+    point_format: int
+    point_record_length: int
+    point_count: int
+    scales: Tuple[float, float, float]
+    offsets: Tuple[float, float, float]
+    mins: Tuple[float, float, float]
+    maxs: Tuple[float, float, float]
+    has_srs: bool
+    srs_wkt: Optional[str]
+    epsg: Optional[int]
+
+
+@functools.lru_cache(maxsize=METADATA_CACHE_SIZE)
+def _call_cached(function: Callable[[str], Any], path: str, mtime_ns: int, size: int) -> Any:
+    """Cache shared by all functions decorated with cached_per_file_version."""
+    return function(path)
+
+
+def cached_per_file_version(function: Callable[[str], Any]) -> Callable[[str], Any]:
+    """Cache results of a function of a file path, until the file is modified.
+
+    Results are copied on each call, so that callers may modify them. All decorated functions
+    share a single cache of METADATA_CACHE_SIZE results, keyed by function, path and version of
+    the file, which cache_clear empties.
+
+    """
+
+    @functools.wraps(function)
+    def wrapper(path: str):
+        stat = os.stat(path)
+        result = _call_cached(function, os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        return copy.deepcopy(result)
+
+    wrapper.cache_clear = _call_cached.cache_clear
+    return wrapper
+
+
+@cached_per_file_version
+def read_las_header(las_path: str) -> LasHeader:
+    """Read metadata of a LAS/LAZ file, without reading its points.
+
+    Args:
+        las_path (str): path to a LAS or LAZ file, of any version from 1.0 to 1.4.
+
+    Raises:
+        ValueError: if the file is not a LAS file.
+
+    Returns:
+        LasHeader: metadata of the file.
+
+    """
+    with open(las_path, "rb") as f:
+        header = f.read(375)
+        if header[:4] != LAS_SIGNATURE:
+            raise ValueError(f"{las_path} is not a LAS file (no LASF signature).")
+        version_major, version_minor = header[24], header[25]
+        header_size, offset_to_point_data, num_vlrs = struct.unpack_from("<HII", header, 94)
+        point_format, point_record_length, point_count = struct.unpack_from("<BHI", header, 104)
+        scales = struct.unpack_from("<3d", header, 131)
+        offsets = struct.unpack_from("<3d", header, 155)
+        max_x, min_x, max_y, min_y, max_z, min_z = struct.unpack_from("<6d", header, 179)
+        start_of_first_evlr, num_evlrs = 0, 0
+        if (version_major, version_minor) >= (1, 4):
+            start_of_first_evlr, num_evlrs, point_count = struct.unpack_from("<QIQ", header, 235)
+
+        f.seek(header_size)
+        vlrs = f.read(offset_to_point_data - header_size)
+        srs_records = {}
+        position = 0
+        for _ in range(num_vlrs):
+            _, user_id, record_id, length = struct.unpack_from("<H16sHH", vlrs, position)
+            position += VLR_HEADER_SIZE
+            if _is_srs_record(user_id, record_id):
+                srs_records[record_id] = vlrs[position : position + length]
+            position += length
+
+        position = start_of_first_evlr
+        for _ in range(num_evlrs):
+            f.seek(position)
+            _, user_id, record_id, length = struct.unpack("<H16sHQ", f.read(28))
+            position += EVLR_HEADER_SIZE
+            if _is_srs_record(user_id, record_id):
+                f.seek(position)
+                srs_records[record_id] = f.read(length)
+            position += length
+
+    srs_wkt = srs_records.get(OGC_COORDINATE_SYSTEM_WKT_RECORD_ID)
+    geo_keys = srs_records.get(GEO_KEY_DIRECTORY_RECORD_ID)
+    return LasHeader(
+        version=f"{version_major}.{version_minor}",
+        # Bits 6 and 7 of the point format flag compressed points (LAZ).
+        point_format=point_format & 0x3F,
+        point_record_length=point_record_length,
+        point_count=point_count,
+        scales=scales,
+        offsets=offsets,
+        mins=(min_x, min_y, min_z),
+        maxs=(max_x, max_y, max_z),
+        has_srs=bool(srs_records),
+        srs_wkt=_decode_wkt(srs_wkt) if srs_wkt else None,
+        epsg=_get_epsg_from_geo_keys(geo_keys) if geo_keys else None,
+    )
+
+
+def _is_srs_record(user_id: bytes, record_id: int) -> bool:
+    return user_id.rstrip(b"\0").decode(errors="replace") == PROJECTION_USER_ID and (
+        record_id in SRS_RECORD_IDS
+    )
+
+
+def _decode_wkt(record: bytes) -> Optional[str]:
+    """WKT of an OGC coordinate system record. None if the record is empty."""
+    return record.rstrip(b"\0").decode("utf-8", errors="replace").strip() or None
+
+
+def _get_epsg_from_geo_keys(geo_key_directory: bytes) -> Optional[int]:
+    """EPSG code of the horizontal coordinate system in a GeoKeyDirectoryTag record, if any."""
+    num_keys = struct.unpack_from("<H", geo_key_directory, 6)[0]
+    num_keys = min(num_keys, len(geo_key_directory) // 8 - 1)
+    values = {}
+    for i in range(num_keys):
+        key_entry = struct.unpack_from("<4H", geo_key_directory, 8 * (i + 1))
+        key_id, tiff_tag_location, _, value = key_entry
+        if tiff_tag_location == 0:
+            # The value is in the key entry itself.
+            values[key_id] = value
+    for key_id in [PROJECTED_CS_TYPE_GEO_KEY, GEOGRAPHIC_TYPE_GEO_KEY]:
+        if values.get(key_id) not in [None, 0, USER_DEFINED_GEO_KEY_VALUE]:
+            return values[key_id]
+    return None
@@ -0,0 +1,123 @@
+"""A side HDF5 file holding samples after the deterministic prefix of their transforms (e.g. GridSampling).
+
+Each set of precomputed samples lives in a group named after a key, which hashes the transforms
+config and the content of the dataset: a change in either leads to a new key, and stale groups are
+deleted when new ones are materialized.
+
+"""
+
+import pickle
+from typing import Callable, Iterable, Optional
+
+import h5py
+import numpy as np
+from torch.utils.data import DataLoader, Dataset
+from torch_geometric.data import Data
+from tqdm import tqdm
+
+# Rows of samples that were filtered out (None) are left empty.
+VARIABLE_LENGTH_BYTES_DATATYPE = h5py.vlen_dtype(np.uint8)
+
+
+class _PrefixDataset(Dataset):
+    """Computes samples to precompute, in DataLoader workers."""
+
+    def __init__(
+        self,
+        indices: Iterable[int],
+        key: str,
+        compute_fn: Callable[[int, str], Optional[Data]],
+    ):
+        self.indices = list(indices)
+        self.key = key
+        self.compute_fn = compute_fn
+
+    def __getitem__(self, i: int):
+        data = self.compute_fn(self.indices[i], self.key)
+        serialized = b"" if data is None else pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        return self.indices[i], np.frombuffer(bytearray(serialized), dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.indices)
+
+
+class DeterministicPrefixCache:
+    """Precomputed outputs of deterministic transforms, stored in a side HDF5 file."""
+
+    def __init__(self, cache_file_path: str):
+        self.cache_file_path = cache_file_path
+        # Opened within each process that reads from the cache, as for the HDF5 dataset.
+        self._file = None
+
+    def is_complete(self, key: str) -> bool:
+        """Whether the samples of a key were all materialized."""
+        try:
+            with h5py.File(self.cache_file_path, "r") as cache_file:
+                return key in cache_file and "is_complete" in cache_file[key].attrs
+        except FileNotFoundError:
+            return False
+
+    def materialize(
+        self,
+        keys_indices: dict,
+        num_samples: int,
+        compute_fn: Callable[[int, str], Optional[Data]],
+        num_workers: int = 0,
+    ) -> None:
+        """Precompute samples for each key that is not complete yet, and delete stale keys.
+
+        Args:
+            keys_indices (dict): maps keys to the indices of the samples to precompute with them.
+            num_samples (int): number of samples of the dataset.
+            compute_fn (Callable[[int, str], Optional[Data]]): computes the sample of an index for a key.
+            num_workers (int, optional): number of DataLoader workers computing samples. Defaults to 0.
+
+        """
+        with h5py.File(self.cache_file_path, "a") as cache_file:
+            for stale_key in set(cache_file.keys()) - set(keys_indices):
+                del cache_file[stale_key]
+            keys_to_materialize = [
+                key
+                for key in keys_indices
+                if key not in cache_file or "is_complete" not in cache_file[key].attrs
+            ]
+            for key in keys_to_materialize:
+                if key in cache_file:
+                    del cache_file[key]
+                cache_file.create_group(key).create_dataset(
+                    "samples", (num_samples,), dtype=VARIABLE_LENGTH_BYTES_DATATYPE
+                )
+
+        for key in keys_to_materialize:
+            dataloader = DataLoader(
+                _PrefixDataset(keys_indices[key], key, compute_fn),
+                batch_size=None,
+                num_workers=num_workers,
+            )
+            # Workers are started before the cache file is opened, so that they do not inherit
+            # its writable handle.
+            samples_iterator = iter(dataloader)
+            with h5py.File(self.cache_file_path, "a") as cache_file:
+                samples = cache_file[key]["samples"]
+                for idx, serialized in tqdm(
+                    samples_iterator,
+                    total=len(dataloader),
+                    desc="Precomputing deterministic transforms...",
+                ):
+                    samples[idx] = np.asarray(serialized)
+                cache_file[key].attrs["is_complete"] = True
+
+    def read(self, key: str, idx: int) -> Optional[Data]:
+        """Read a precomputed sample. None if it was filtered out."""
+        if self._file is None:
+            self._file = h5py.File(self.cache_file_path, "r")
+        serialized = self._file[key]["samples"][idx]
+        if not serialized.size:
+            return None
+        return pickle.loads(serialized.tobytes())
+
+    def __getstate__(self):
+        # Opened files cannot be pickled, e.g. to DataLoader workers.
+        state = self.__dict__.copy()
+        state["_file"] = None
+        return state
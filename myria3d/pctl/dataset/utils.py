@@ -3,15 +3,18 @@ import json
 from pathlib import Path
 import subprocess as sp
 from numbers import Number
-from typing import Dict, List, Literal, Union
+from typing import Dict, Iterator, List, Literal, Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
 import pdal
 from scipy.spatial import cKDTree
 
+from myria3d.pctl.dataset.las_header import cached_per_file_version, read_las_header
+
 SPLIT_TYPE = Union[Literal["train"], Literal["val"], Literal["test"]]
 LAS_PATHS_BY_SPLIT_DICT_TYPE = Dict[SPLIT_TYPE, List[str]]
+SUBTILE_SPLITTING_METHOD_TYPE = Union[Literal["kdtree"], Literal["grid"]]
 
 
 def find_file_in_dir(data_dir: str, basename: str) -> str:
@@ -49,20 +52,44 @@ def pdal_read_las_array(las_path: str, epsg: str):
         np.ndarray: named array with all LAS dimensions, including extra ones, with dict-like access.
 
     """
-    p1 = pdal.Pipeline() | get_pdal_reader(las_path, epsg)
-    p1.execute()
-    return p1.arrays[0]
+    return pdal_read_las_array_and_metadata(las_path, epsg)[0]
 
 
-def pdal_read_las_array_as_float32(las_path: str, epsg: str):
-    """Read LAS as a a named array, casted to floats."""
-    arr = pdal_read_las_array(las_path, epsg)
+def pdal_read_las_array_and_metadata(las_path: str, epsg: str) -> Tuple[np.ndarray, Dict]:
+    """Read LAS as a named array, together with the metadata of the pdal pipeline.
+
+    Args:
+        las_path (str): input LAS path
+        epsg (str): epsg to force the reading with
+
+    Returns:
+        np.ndarray, Dict: named array with all LAS dimensions, and metadata of the pipeline, e.g.
+        to get the parameters of a writer with pdaltools.las_info.
+
+    """
+    pipeline = pdal.Pipeline() | get_pdal_reader(las_path, epsg)
+    pipeline.execute()
+    return pipeline.arrays[0], pipeline.metadata
+
+
+def cast_to_float32(arr: np.ndarray) -> np.ndarray:
+    """Cast all dimensions of a named array to floats."""
     all_floats = np.dtype({"names": arr.dtype.names, "formats": ["f4"] * len(arr.dtype.names)})
     return arr.astype(all_floats)
 
 
+def pdal_read_las_array_as_float32(las_path: str, epsg: str):
+    """Read LAS as a a named array, casted to floats."""
+    return cast_to_float32(pdal_read_las_array(las_path, epsg))
+
+
+@cached_per_file_version
 def get_metadata(las_path: str) -> dict:
     """ returns metadata contained in a las file
+
+    This reads all points of the file: use read_las_header when header metadata are enough.
+    Results are cached per path and version of the file.
+
     Args:
         las_path (str): input LAS path to get metadata from.
     Returns:
@@ -92,18 +119,29 @@ def get_pdal_reader(las_path: str, epsg: str) -> pdal.Reader.las:
             override_srs=f"EPSG:{epsg}" if str(epsg).isdigit() else epsg,
         )
 
-    try :
-        if get_metadata(las_path)['metadata']['readers.las']['srs']['compoundwkt']:
-            # read the lidar file with pdal default
-            return pdal.Reader.las(filename=las_path)
-    except Exception:
-        pass  # we will go to the "raise exception" anyway
+    # Only the header and records of the file are read, not its points.
+    header = read_las_header(las_path)
+    if header.srs_wkt or header.epsg:
+        # read the lidar file with pdal default
+        return pdal.Reader.las(filename=las_path)
+    if header.has_srs:
+        # SRS records that the header parser cannot resolve (e.g. user-defined GeoTIFF keys, or a
+        # math transform WKT only) may still be understood by pdal, which reads the whole file.
+        try:
+            if get_metadata(las_path)["metadata"]["readers.las"]["srs"]["compoundwkt"]:
+                return pdal.Reader.las(filename=las_path)
+        except KeyError:
+            pass  # we will go to the "raise exception" anyway
 
     raise Exception("No EPSG provided, neither in the lidar file or as parameter")
 
 
+@cached_per_file_version
 def get_pdal_info_metadata(las_path: str) -> Dict:
-    """Read las metadata using pdal info
+    """Read las metadata using pdal info, cached per path and version of the file.
+
+    For the number of points or the SRS of a file, read_las_header is faster.
+
     Args:
         las_path (str): input LAS path to read.
     Returns:
@@ -129,6 +167,8 @@ def split_cloud_into_samples(
     subtile_width: Number,
     epsg: str,
     subtile_overlap: Number = 0,
+    subtile_splitting_method: SUBTILE_SPLITTING_METHOD_TYPE = "kdtree",
+    points: Optional[np.ndarray] = None,
 ):
     """Split LAS point cloud into samples.
 
@@ -138,24 +178,101 @@ def split_cloud_into_samples(
         subtile_width (Number): width of receptive field.
         epsg (str): epsg to force the reading with
         subtile_overlap (Number, optional): overlap between adjacent tiles. Defaults to 0.
+        subtile_splitting_method (str, optional): "kdtree" or "grid". Defaults to "kdtree".
+        points (np.ndarray, optional): points of the LAS, as read by pdal_read_las_array, to split
+            them without reading the LAS again. Samples are then casted to floats one by one.
+            Defaults to None, to read the LAS.
 
     Yields:
         _type_: idx_in_original_cloud, and points of sample in pdal input format casted as floats.
 
     """
-    points = pdal_read_las_array_as_float32(las_path, epsg)
+    cast_samples = points is not None
+    if points is None:
+        points = pdal_read_las_array_as_float32(las_path, epsg)
     pos = np.asarray([points["X"], points["Y"], points["Z"]], dtype=np.float32).transpose()
-    kd_tree = cKDTree(pos[:, :2] - pos[:, :2].min(axis=0))
+    for sample_idx in split_xy_into_samples_idx(
+        pos[:, :2] - pos[:, :2].min(axis=0),
+        tile_width,
+        subtile_width,
+        subtile_overlap,
+        subtile_splitting_method,
+    ):
+        sample_points = points[sample_idx]
+        if cast_samples:
+            sample_points = cast_to_float32(sample_points)
+        yield sample_idx, sample_points
+
+
+def split_xy_into_samples_idx(
+    xy: np.ndarray,
+    tile_width: Number,
+    subtile_width: Number,
+    subtile_overlap: Number = 0,
+    subtile_splitting_method: SUBTILE_SPLITTING_METHOD_TYPE = "kdtree",
+) -> Iterator[np.ndarray]:
+    """Get indices of the points in each (non-empty) square receptive field of a tile.
+
+    Both methods select the same points, i.e. points within the closed square of half-width
+    `subtile_width // 2` around each center of the mosaic. "kdtree" runs one ball query per center,
+    while "grid" sorts points once by X, and then once by Y within each column of receptive fields,
+    so that the points of a receptive field are found by binary search.
+
+    Args:
+        xy (np.ndarray): (N, 2) XY coordinates, relative to the lower left corner of the tile.
+        tile_width (Number): width of input LAS file
+        subtile_width (Number): width of receptive field.
+        subtile_overlap (Number, optional): overlap between adjacent tiles. Defaults to 0.
+        subtile_splitting_method (str, optional): "kdtree" or "grid". Defaults to "kdtree".
+
+    Yields:
+        np.ndarray: indices of points in each receptive field.
+
+    """
     XYs = get_mosaic_of_centers(tile_width, subtile_width, subtile_overlap=subtile_overlap)
-    for center in XYs:
-        radius = subtile_width // 2  # Square receptive field.
-        minkowski_p = np.inf
-        sample_idx = np.array(kd_tree.query_ball_point(center, r=radius, p=minkowski_p))
+    radius = subtile_width // 2  # Square receptive field.
+    if subtile_splitting_method == "kdtree":
+        samples_idx = _split_xy_with_kdtree(xy, XYs, radius)
+    elif subtile_splitting_method == "grid":
+        samples_idx = _split_xy_with_grid(xy, XYs, radius)
+    else:
+        raise ValueError(
+            f"Unknown subtile_splitting_method {subtile_splitting_method}. "
+            "Valid choices are: kdtree, grid."
+        )
+    for sample_idx in samples_idx:
         if not len(sample_idx):
             # no points in this receptive fields
             continue
-        sample_points = points[sample_idx]
-        yield sample_idx, sample_points
+        yield sample_idx
+
+
+def _split_xy_with_kdtree(xy: np.ndarray, XYs: List[np.ndarray], radius: Number):
+    kd_tree = cKDTree(xy)
+    minkowski_p = np.inf
+    for center in XYs:
+        yield np.array(kd_tree.query_ball_point(center, r=radius, p=minkowski_p))
+
+
+def _split_xy_with_grid(xy: np.ndarray, XYs: List[np.ndarray], radius: Number):
+    # Float64 comparisons, like the ones performed by the kdtree.
+    xy = xy.astype(np.float64)
+    order_by_x = np.argsort(xy[:, 0], kind="stable")
+    sorted_x = xy[order_by_x, 0]
+    column_center_x = None
+    for center_x, center_y in XYs:
+        if center_x != column_center_x:
+            # Points of the column of receptive fields sharing this X, sorted by Y.
+            column_center_x = center_x
+            start = np.searchsorted(sorted_x, center_x - radius, side="left")
+            stop = np.searchsorted(sorted_x, center_x + radius, side="right")
+            column_idx = order_by_x[start:stop]
+            order_by_y = np.argsort(xy[column_idx, 1], kind="stable")
+            column_idx = column_idx[order_by_y]
+            sorted_y = xy[column_idx, 1]
+        start = np.searchsorted(sorted_y, center_y - radius, side="left")
+        stop = np.searchsorted(sorted_y, center_y + radius, side="right")
+        yield column_idx[start:stop]
 
 
 def pre_filter_below_n_points(data, min_num_nodes=1):
@@ -1,6 +1,32 @@
-from typing import Callable, List
+import hashlib
+from typing import Callable, List, Tuple
 
-from torch_geometric.transforms import BaseTransform
+from torch_geometric.transforms import BaseTransform, Center, GridSampling
+
+from myria3d.pctl.transforms.transforms import (
+    CopyFullPos,
+    CopyFullPreparedTargets,
+    CopySampledPos,
+    DropPointsByClass,
+    NormalizePos,
+    NullifyLowestZ,
+    StandardizeRGBAndIntensity,
+    TargetTransform,
+)
+
+# Transforms whose output only depends on their input, and which can therefore be precomputed once.
+DETERMINISTIC_TRANSFORMS = (
+    Center,
+    CopyFullPos,
+    CopyFullPreparedTargets,
+    CopySampledPos,
+    DropPointsByClass,
+    GridSampling,
+    NormalizePos,
+    NullifyLowestZ,
+    StandardizeRGBAndIntensity,
+    TargetTransform,
+)
 
 
 class CustomCompose(BaseTransform):
@@ -26,3 +52,29 @@ class CustomCompose(BaseTransform):
                 if data is None or data.num_nodes == 0:
                     return None
         return data
+
+    def split_deterministic_prefix(self) -> Tuple["CustomCompose", "CustomCompose"]:
+        """Split transforms into their longest deterministic prefix, and the remaining (stochastic) tail."""
+        num_deterministic = 0
+        for transform in self.transforms:
+            if not isinstance(transform, DETERMINISTIC_TRANSFORMS):
+                break
+            num_deterministic += 1
+        return (
+            CustomCompose(self.transforms[:num_deterministic]),
+            CustomCompose(self.transforms[num_deterministic:]),
+        )
+
+    def fingerprint(self) -> str:
+        """A hash of the transforms and of their parameters, which changes whenever their config does."""
+        fingerprint = hashlib.md5()
+        for transform in self.transforms:
+            parameters = {
+                name: value
+                for name, value in sorted(vars(transform).items())
+                # Skips e.g. mappers built from other parameters, whose repr is not stable.
+                if isinstance(value, (bool, int, float, str, list, tuple, dict, type(None)))
+                or hasattr(value, "items")
+            }
+            fingerprint.update(f"{type(transform).__qualname__}{parameters}".encode("utf-8"))
+        return fingerprint.hexdigest()
@@ -1,6 +1,6 @@
 import math
 import re
-from typing import Dict, List
+from typing import TYPE_CHECKING, Dict, List, Optional
 
 import numpy as np
 import torch
@@ -9,9 +9,15 @@ from torch_geometric.transforms import BaseTransform
 
 from myria3d.utils import utils
 
+if TYPE_CHECKING:
+    from myria3d.models.modules.pyg_randla_net import NeighborsHierarchy
+
 log = utils.get_logger(__name__)
 
 COMMON_CODE_FOR_ALL_ARTEFACTS = 65
+# Classification codes of LAS 1.4 point formats 6 to 10 are unsigned bytes.
+NUM_LAS_CLASSIFICATION_CODES = 256
+UNKNOWN_CLASS_INDEX = -1
 
 
 class ToTensor(BaseTransform):
@@ -185,8 +191,7 @@ class TargetTransform(BaseTransform):
         classification_preprocessing_dict: Dict[int, int],
         classification_dict: Dict[int, str],
     ):
-        self._set_preprocessing_mapper(classification_preprocessing_dict)
-        self._set_mapper(classification_dict)
+        self._set_lookup_tables(classification_preprocessing_dict, classification_dict)
 
         # Set to attribute to log potential type errors
         self.classification_dict = classification_dict
@@ -197,31 +202,45 @@ class TargetTransform(BaseTransform):
         return data
 
     def transform(self, y):
-        y = self.preprocessing_mapper(y)
-        try:
-            y = self.mapper(y)
-        except TypeError as e:
-            log.error(
-                "A TypeError occured when mapping target from arbitrary integers "
-                "to consecutive integers (0-(n-1)) using the provided classification_dict "
-                "This usually happens when an unknown classification code was encounterd. "
-                "Check that all classification codes in your data are either "
-                "specified via the classification_dict "
-                "or transformed into a specified code via the preprocessing_mapper. \n"
-                f"Current classification_dict: \n{self.classification_dict}\n"
-                f"Current preprocessing_mapper: \n{self.classification_preprocessing_dict}\n"
-                f"Current unique values in preprocessed target array: \n{np.unique(y)}\n"
-            )
-            raise e
-        return torch.LongTensor(y)
-
-    def _set_preprocessing_mapper(self, classification_preprocessing_dict):
-        """Set mapper from source classification code to another code."""
-        d = {key: value for key, value in classification_preprocessing_dict.items()}
-        self.preprocessing_mapper = np.vectorize(lambda class_code: d.get(class_code, class_code))
-
-    def _set_mapper(self, classification_dict):
-        """Set mapper from source classification code to consecutive integers."""
+        """Map classification codes to consecutive integers with lookup tables, in numpy or torch."""
+        is_tensor = isinstance(y, torch.Tensor)
+        lookup_table = self.torch_lookup_table if is_tensor else self.lookup_table
+        if len(y) and (y.min() < 0 or y.max() >= len(lookup_table)):
+            self._raise_unknown_code_error(y)
+        # Codes may be floats, e.g. in tensors created with torch.Tensor.
+        mapped_y = lookup_table[y.long() if is_tensor else y.astype(np.int64)]
+        if (mapped_y == UNKNOWN_CLASS_INDEX).any():
+            self._raise_unknown_code_error(y)
+        return torch.as_tensor(mapped_y)
+
+    def _raise_unknown_code_error(self, y):
+        preprocessed_codes = [
+            self.classification_preprocessing_dict.get(code, code)
+            for code in np.unique(np.asarray(y)).tolist()
+        ]
+        message = (
+            "A TypeError occured when mapping target from arbitrary integers "
+            "to consecutive integers (0-(n-1)) using the provided classification_dict "
+            "This usually happens when an unknown classification code was encounterd. "
+            "Check that all classification codes in your data are either "
+            "specified via the classification_dict "
+            "or transformed into a specified code via the preprocessing_mapper. \n"
+            f"Current classification_dict: \n{self.classification_dict}\n"
+            f"Current preprocessing_mapper: \n{self.classification_preprocessing_dict}\n"
+            "Current unique values in preprocessed target array: \n"
+            f"{np.unique(preprocessed_codes)}\n"
+        )
+        log.error(message)
+        raise TypeError(message)
+
+    def _set_lookup_tables(self, classification_preprocessing_dict, classification_dict):
+        """Set tables that map source classification codes to consecutive integers.
+
+        Codes are first mapped to another code with classification_preprocessing_dict, then to
+        their index in classification_dict. Tables cover at least all LAS classification codes
+        (0-255), and unknown codes are mapped to UNKNOWN_CLASS_INDEX.
+
+        """
         d = {
             class_code: class_index
             for class_index, class_code in enumerate(classification_dict.keys())
@@ -229,7 +248,14 @@ class TargetTransform(BaseTransform):
         # Here we update the dict so that code 65 remains unchanged.
         # Indeed, 65 is reserved for noise/artefacts points, that will be deleted by transform "DropPointsByClass".
         d.update({65: 65})
-        self.mapper = np.vectorize(lambda class_code: d.get(class_code))
+        codes = [*classification_preprocessing_dict.keys(), *classification_dict.keys()]
+        size = max([NUM_LAS_CLASSIFICATION_CODES - 1, *codes]) + 1
+        preprocessing = classification_preprocessing_dict
+        self.lookup_table = np.array(
+            [d.get(preprocessing.get(code, code), UNKNOWN_CLASS_INDEX) for code in range(size)],
+            dtype=np.int64,
+        )
+        self.torch_lookup_table = torch.from_numpy(self.lookup_table)
 
 
 class DropPointsByClass(BaseTransform):
@@ -246,3 +272,70 @@ class DropPointsByClass(BaseTransform):
                 data.idx_in_original_cloud = data.idx_in_original_cloud[points_to_keep.numpy()]
 
         return data
+
+
+class HierarchicalData(Data):
+    """Data holding the neighbors of its points at each level of PyGRandLANet (see NeighborsHierarchy).
+
+    Indices of each level are offset by the number of points of the same level in previous samples
+    when samples are collated into a batch, rather than by the number of points of level 0.
+
+    """
+
+    def __inc__(self, key: str, value, *args, **kwargs):
+        if key.startswith(("edge_index_", "idx_decim_")):
+            # Indices of points of level l.
+            return self[f"upsample_idx_{key.rsplit('_', 1)[1]}"].size(0)
+        if key.startswith("upsample_idx_"):
+            # Indices of points of level l + 1.
+            return self[f"idx_decim_{key.rsplit('_', 1)[1]}"].size(0)
+        return super().__inc__(key, value, *args, **kwargs)
+
+    def __cat_dim__(self, key: str, value, *args, **kwargs):
+        if key.startswith("edge_index_"):
+            return -1
+        return super().__cat_dim__(key, value, *args, **kwargs)
+
+
+class BuildNeighborsHierarchy(BaseTransform):
+    """Precompute decimations and neighbors of points at all levels of PyGRandLANet.
+
+    Running the knn searches in DataLoader workers spares them to the training or inference
+    device. Should be the last transform, since it refers to points by their index.
+
+    """
+
+    def __init__(self, num_neighbors: int = 16, decimation: int = 4, num_levels: int = 4):
+        self.num_neighbors = num_neighbors
+        self.decimation = decimation
+        self.num_levels = num_levels
+
+    def __call__(self, data: Data) -> HierarchicalData:
+        # Imported here so that transforms do not depend on models (and their torch_cluster ops).
+        from myria3d.models.modules.pyg_randla_net import build_neighbors_hierarchy
+
+        batch = torch.zeros(data.num_nodes, dtype=torch.long)
+        ptr = torch.LongTensor([0, data.num_nodes])
+        hierarchy = build_neighbors_hierarchy(
+            data.pos, batch, ptr, self.num_neighbors, self.decimation, self.num_levels
+        )
+        data = HierarchicalData(**{key: value for key, value in data})
+        for level in range(self.num_levels):
+            data[f"edge_index_{level}"] = hierarchy.edge_index[level]
+            data[f"idx_decim_{level}"] = hierarchy.idx_decim[level]
+            data[f"upsample_idx_{level}"] = hierarchy.upsample_idx[level]
+        return data
+
+
+def get_neighbors_hierarchy(batch: Data) -> Optional["NeighborsHierarchy"]:
+    """Get the neighbors hierarchy of a batch, if precomputed by BuildNeighborsHierarchy."""
+    if "edge_index_0" not in batch:
+        return None
+    from myria3d.models.modules.pyg_randla_net import NeighborsHierarchy
+
+    levels = range(sum(1 for key in batch.keys() if key.startswith("edge_index_")))
+    return NeighborsHierarchy(
+        [batch[f"edge_index_{level}"] for level in levels],
+        [batch[f"idx_decim_{level}"] for level in levels],
+        [batch[f"upsample_idx_{level}"] for level in levels],
+    )
@@ -1,17 +1,21 @@
 import os
 import os.path as osp
 import sys
+from typing import Dict, Optional, Tuple
 
 import hydra
+import numpy as np
 import torch
 from omegaconf import DictConfig
 from pytorch_lightning import LightningDataModule
 from tqdm import tqdm
 
 from myria3d.models.model import Model
+from myria3d.models.quantization import check_quantization_device, optimize_for_cpu_inference
 
 sys.path.append(osp.dirname(osp.dirname(__file__)))
 from myria3d.models.interpolation import Interpolator  # noqa
+from myria3d.pctl.dataloader.dataloader import transfer_batch_to_device  # noqa
 from myria3d.utils import utils  # noqa
 
 log = utils.get_logger(__name__)
@@ -42,17 +46,48 @@ def predict(config: DictConfig) -> str:
     assert os.path.exists(config.predict.src_las)
 
     datamodule: LightningDataModule = hydra.utils.instantiate(config.datamodule)
-    datamodule._set_predict_data(config.predict.src_las)
+    model, device = load_model_for_prediction(config)
+    itp = make_interpolator(config)
+    las, writer_params = prepare_las_for_prediction(
+        config, datamodule, itp, config.predict.src_las
+    )
+
+    autocast = utils.get_autocast_context(config.predict.get("precision", "32"), device)
+    for batch in tqdm(datamodule.predict_dataloader()):
+        batch = transfer_batch_to_device(batch, device)
+        with autocast:
+            logits = model.predict_step(batch)["logits"]
+        itp.store_predictions(logits, batch.idx_in_original_cloud)
+
+    out_f = itp.reduce_predictions_and_save(
+        config.predict.src_las,
+        config.predict.output_dir,
+        config.datamodule.get("epsg"),
+        las=las,
+        writer_params=writer_params,
+    )
+    return out_f
 
+
+def load_model_for_prediction(config: DictConfig) -> Tuple[Model, torch.device]:
+    """Load the model of predict.ckpt_path on its device, in eval mode and without gradients."""
     # Do not require gradient for faster predictions
     torch.set_grad_enabled(False)
     model = Model.load_from_checkpoint(config.predict.ckpt_path)
     device = utils.define_device_from_config_param(config.predict.gpus)
     model.to(device)
     model.eval()
+    quantization = config.predict.get("quantization")
+    if quantization:
+        check_quantization_device(device)
+        model.model = optimize_for_cpu_inference(model.model, quantization)
+    return model, device
+
 
+def make_interpolator(config: DictConfig) -> Interpolator:
+    """Interpolator of predictions, from the predict.interpolator config."""
     # TODO: Interpolator could be instantiated directly via hydra.
-    itp = Interpolator(
+    return Interpolator(
         interpolation_k=config.predict.interpolator.interpolation_k,
         classification_dict=config.dataset_description.get("classification_dict"),
         probas_to_save=config.predict.interpolator.probas_to_save,
@@ -60,14 +95,26 @@ def predict(config: DictConfig) -> str:
             "predicted_classification_channel", "PredictedClassification"
         ),
         entropy_channel=config.predict.interpolator.get("entropy_channel", "entropy"),
+        accumulator_dtype=config.predict.interpolator.get("accumulator_dtype", "float32"),
+        accumulator_dir=config.predict.interpolator.get("accumulator_dir"),
     )
 
-    for batch in tqdm(datamodule.predict_dataloader()):
-        batch.to(device)
-        logits = model.predict_step(batch)["logits"]
-        itp.store_predictions(logits, batch.idx_in_original_cloud)
 
-    out_f = itp.reduce_predictions_and_save(
-        config.predict.src_las, config.predict.output_dir, config.datamodule.get("epsg")
-    )
-    return out_f
+def prepare_las_for_prediction(
+    config: DictConfig, datamodule: LightningDataModule, itp: Interpolator, src_las: str
+) -> Tuple[Optional[np.ndarray], Optional[Dict]]:
+    """Set the data to predict on in the datamodule, and allocate the accumulator of predictions.
+
+    Returns:
+        np.ndarray, Dict: the LAS and writer parameters with predict.read_las_once, else None.
+
+    """
+    las, writer_params = None, None
+    if config.predict.get("read_las_once", False):
+        # The same array is split into samples, and then updated with predictions.
+        las, writer_params = itp.read_las_with_prediction_dimensions(
+            src_las, config.datamodule.get("epsg")
+        )
+    datamodule._set_predict_data(src_las, points=las)
+    itp.allocate_accumulator(src_las, None if las is None else len(las))
+    return las, writer_params
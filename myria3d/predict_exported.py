@@ -0,0 +1,139 @@
+"""Lightweight inference with a package exported by `python run.py task.task_name=export`.
+
+Unlike `task.task_name=predict`, neither a Lightning checkpoint nor a hydra configuration is
+loaded: the package holds the neural network and all preprocessing and interpolation settings.
+
+Usage:
+    python -m myria3d.predict_exported --package path/to/model.package.pt \
+        --src-las "path/to/*.las" --output-dir path/to/output_dir/
+
+"""
+
+import argparse
+from glob import glob
+from typing import Optional, Union
+
+import torch
+from tqdm import tqdm
+
+from myria3d.models.export import ExportedModel, load_package
+from myria3d.models.interpolation import Interpolator
+from myria3d.models.quantization import (
+    QUANTIZATION_TYPE,
+    check_quantization_device,
+    optimize_for_cpu_inference,
+)
+from myria3d.pctl.dataloader.dataloader import (
+    GeometricNoneProofDataloader,
+    transfer_batch_to_device,
+)
+from myria3d.pctl.dataset.iterable import InferenceDataset
+from myria3d.utils import utils
+
+log = utils.get_logger(__name__)
+
+
+@utils.eval_time
+def predict_exported(
+    package_path: str,
+    src_las: str,
+    output_dir: str,
+    gpus: Union[int, list] = 0,
+    epsg: Optional[str] = None,
+    batch_size: Optional[int] = None,
+    precision: str = "32",
+    quantization: QUANTIZATION_TYPE = None,
+    read_las_once: bool = False,
+) -> str:
+    """Inference pipeline of myria3d.predict, with a package instead of a checkpoint and a configuration.
+
+    Args:
+        package_path (str): path to a package exported with task.task_name=export.
+        src_las (str): path to the LAS to predict on.
+        output_dir (str): directory where the LAS with predictions is saved.
+        gpus (Union[int, list], optional): 0 for cpu, or [i] to use GPU number i. Defaults to 0.
+        epsg (Optional[str], optional): epsg to force the reading with. Defaults to the epsg at export time.
+        batch_size (Optional[int], optional): number of subtiles per batch. Defaults to the batch size at export time.
+        precision (str, optional): "32", "16-mixed" or "bf16-mixed". Defaults to "32".
+        quantization (QUANTIZATION_TYPE, optional): "fold_bn" or "dynamic_int8" for inference on CPU.
+            Defaults to None.
+        read_las_once (bool, optional): read the LAS once, for both inference and update with
+            predictions. Defaults to False.
+
+    Returns:
+        str: path to output LAS.
+
+    """
+    package = load_package(package_path)
+    inference_dataset_kwargs = dict(package["inference_dataset"])
+    if epsg is not None:
+        inference_dataset_kwargs["epsg"] = epsg
+    itp = Interpolator(**package["interpolator"])
+    las, writer_params = None, None
+    if read_las_once:
+        # The same array is split into samples, and then updated with predictions.
+        las, writer_params = itp.read_las_with_prediction_dimensions(
+            src_las, inference_dataset_kwargs["epsg"]
+        )
+    itp.allocate_accumulator(src_las, None if las is None else len(las))
+    dataloader = GeometricNoneProofDataloader(
+        dataset=InferenceDataset(src_las, points=las, **inference_dataset_kwargs),
+        batch_size=batch_size or package["batch_size"],
+        num_workers=1,  # always 1 because this is an iterable dataset
+    )
+
+    # Do not require gradient for faster predictions
+    torch.set_grad_enabled(False)
+    model = ExportedModel(package)
+    device = utils.define_device_from_config_param(gpus)
+    model.to(device)
+    model.eval()
+    if quantization:
+        check_quantization_device(device)
+        model.model = optimize_for_cpu_inference(model.model, quantization)
+
+    autocast = utils.get_autocast_context(precision, device)
+    for batch in tqdm(dataloader):
+        batch = transfer_batch_to_device(batch, device)
+        with autocast:
+            logits = model(batch)
+        itp.store_predictions(logits, batch.idx_in_original_cloud)
+
+    return itp.reduce_predictions_and_save(
+        src_las,
+        output_dir,
+        inference_dataset_kwargs["epsg"],
+        las=las,
+        writer_params=writer_params,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--package", required=True, help="Exported package.")
+    parser.add_argument("--src-las", required=True, help="LAS to predict on. Any glob pattern.")
+    parser.add_argument("--output-dir", required=True, help="Where to save LAS with predictions.")
+    parser.add_argument("--gpu", type=int, default=None, help="GPU number. Defaults to cpu.")
+    parser.add_argument("--epsg", default=None, help="Defaults to the epsg at export time.")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--precision", default="32", choices=["32", "16-mixed", "bf16-mixed"])
+    parser.add_argument("--quantization", default=None, choices=["fold_bn", "dynamic_int8"])
+    parser.add_argument("--read-las-once", action="store_true", help="Single read of each LAS.")
+    args = parser.parse_args()
+
+    for src_las in tqdm(glob(args.src_las)):
+        predict_exported(
+            args.package,
+            src_las,
+            args.output_dir,
+            gpus=0 if args.gpu is None else [args.gpu],
+            epsg=args.epsg,
+            batch_size=args.batch_size,
+            precision=args.precision,
+            quantization=args.quantization,
+            read_las_once=args.read_las_once,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""Prediction on several LAS files with a model loaded once, and overlapped stages.
+
+Three stages run at the same time, connected by bounded queues:
+
+reading:
+    `num_readers` threads read files, split them into subtiles and collate these into batches,
+    one file per thread at a time.
+inference:
+    the calling thread predicts the logits of batches, and accumulates them in the Interpolator
+    of their file.
+saving:
+    `num_writers` threads compute probabilities of fully predicted files, and write them.
+
+Queues bound the number of batches read ahead of inference (`max_queued_batches`), and the number
+of predicted files waiting to be saved (`num_writers`), so that memory stays bounded while the
+model is kept busy during I/O. Threads are enough for overlap: pdal, numpy, scipy and torch
+release the GIL in their heavy operations.
+
+"""
+
+import queue
+import threading
+import time
+from typing import Dict, List
+
+import hydra
+from omegaconf import DictConfig
+
+from myria3d.pctl.dataloader.dataloader import (
+    GeometricNoneProofDataloader,
+    transfer_batch_to_device,
+)
+from myria3d.predict import (
+    load_model_for_prediction,
+    make_interpolator,
+    prepare_las_for_prediction,
+)
+from myria3d.utils import utils
+
+log = utils.get_logger(__name__)
+
+
+class StageStats:
+    """Throughput of a stage of the pipeline, updated by its threads."""
+
+    def __init__(self, name: str, unit: str, num_threads: int):
+        self.name = name
+        self.unit = unit
+        self.num_threads = num_threads
+        self.items = 0
+        self.points = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, items: int = 0, points: int = 0, busy_seconds: float = 0.0) -> None:
+        with self._lock:
+            self.items += items
+            self.points += points
+            self.busy_seconds += busy_seconds
+
+    def log(self, wall_seconds: float) -> None:
+        """Log items and points per second of wall time, and the busy fraction of the threads."""
+        utilization = self.busy_seconds / max(wall_seconds * self.num_threads, 1e-9)
+        log.info(
+            f"{self.name}: {self.items} {self.unit}, {self.points} points, "
+            f"{self.items / wall_seconds:.2f} {self.unit}/s, "
+            f"{self.points / wall_seconds:.0f} points/s, "
+            f"{utilization:.0%} busy ({self.num_threads} thread(s))."
+        )
+
+
+@utils.eval_time
+def predict_files(config: DictConfig, src_las_paths: List[str]) -> List[str]:
+    """Inference pipeline of myria3d.predict, for several files and with overlapped stages.
+
+    Args:
+        config (DictConfig): Configuration composed by Hydra, with the predict.pipeline config.
+        src_las_paths (List[str]): paths to the LAS to predict on.
+
+    Returns:
+        List[str]: paths to output LAS, in the order of src_las_paths.
+
+    """
+    pipeline_config = config.predict.get("pipeline") or {}
+    num_readers = max(1, min(pipeline_config.get("num_readers", 2), len(src_las_paths)))
+    num_writers = max(1, pipeline_config.get("num_writers", 2))
+    model, device = load_model_for_prediction(config)
+    autocast = utils.get_autocast_context(config.predict.get("precision", "32"), device)
+
+    paths_queue = queue.Queue()
+    for src_las in src_las_paths:
+        paths_queue.put(src_las)
+    batches_queue = queue.Queue(maxsize=pipeline_config.get("max_queued_batches", 16))
+    files_queue = queue.Queue(maxsize=num_writers)
+    stop = threading.Event()
+    output_paths: Dict[str, str] = {}
+    writer_errors: List[BaseException] = []
+    reading = StageStats("Reading", "files", num_readers)
+    inference = StageStats("Inference", "batches", 1)
+    saving = StageStats("Saving", "files", num_writers)
+
+    readers = [
+        threading.Thread(
+            target=_read_files,
+            args=(config, paths_queue, batches_queue, stop, reading),
+            daemon=True,
+        )
+        for _ in range(num_readers)
+    ]
+    writers = [
+        threading.Thread(
+            target=_save_files,
+            args=(config, files_queue, output_paths, writer_errors, saving),
+            daemon=True,
+        )
+        for _ in range(num_writers)
+    ]
+    start = time.perf_counter()
+    for thread in readers + writers:
+        thread.start()
+
+    num_finished_readers = 0
+    try:
+        while num_finished_readers < num_readers:
+            kind, itp, item = batches_queue.get()
+            if kind == "batch":
+                batch_start = time.perf_counter()
+                batch = transfer_batch_to_device(item, device)
+                with autocast:
+                    logits = model.predict_step(batch)["logits"]
+                itp.store_predictions(logits, batch.idx_in_original_cloud)
+                inference.add(1, batch.num_nodes, time.perf_counter() - batch_start)
+            elif kind == "file":
+                files_queue.put((itp, *item))
+            elif kind == "error":
+                raise item
+            else:
+                num_finished_readers += 1
+    except BaseException:
+        # Readers stop at their next batch, and are not left waiting for a full queue.
+        stop.set()
+        while num_finished_readers < num_readers:
+            num_finished_readers += batches_queue.get()[0] == "done"
+        raise
+    finally:
+        for _ in writers:
+            files_queue.put(None)
+    for thread in writers:
+        thread.join()
+    if writer_errors:
+        raise writer_errors[0]
+
+    wall_seconds = time.perf_counter() - start
+    for stats in [reading, inference, saving]:
+        stats.log(wall_seconds)
+    return [output_paths[src_las] for src_las in src_las_paths]
+
+
+def _read_files(
+    config: DictConfig,
+    paths_queue: queue.Queue,
+    batches_queue: queue.Queue,
+    stop: threading.Event,
+    stats: StageStats,
+) -> None:
+    """Read files into batches, each file followed by the data needed to save its predictions."""
+    try:
+        # Each reader has its own datamodule, which holds the dataset of its current file.
+        datamodule = hydra.utils.instantiate(config.datamodule)
+        while not stop.is_set():
+            try:
+                src_las = paths_queue.get_nowait()
+            except queue.Empty:
+                break
+            start = time.perf_counter()
+            itp = make_interpolator(config)
+            las, writer_params = prepare_las_for_prediction(config, datamodule, itp, src_las)
+            # Subtiles are read in this thread: DataLoader workers would be forked from a process
+            # with running threads.
+            dataloader = GeometricNoneProofDataloader(
+                dataset=datamodule.predict_dataset, batch_size=datamodule.batch_size, num_workers=0
+            )
+            for batch in dataloader:
+                if stop.is_set():
+                    return
+                stats.add(busy_seconds=time.perf_counter() - start)
+                batches_queue.put(("batch", itp, batch))
+                start = time.perf_counter()
+            stats.add(1, itp.nb_points, time.perf_counter() - start)
+            batches_queue.put(("file", itp, (src_las, las, writer_params)))
+    except BaseException as e:
+        batches_queue.put(("error", None, e))
+    finally:
+        batches_queue.put(("done", None, None))
+
+
+def _save_files(
+    config: DictConfig,
+    files_queue: queue.Queue,
+    output_paths: Dict[str, str],
+    errors: List[BaseException],
+    stats: StageStats,
+) -> None:
+    """Save predictions of files, until a None is received."""
+    while True:
+        item = files_queue.get()
+        if item is None:
+            return
+        if errors:
+            # Keep on consuming files, so that inference does not wait for a full queue.
+            continue
+        itp, src_las, las, writer_params = item
+        start = time.perf_counter()
+        try:
+            output_paths[src_las] = itp.reduce_predictions_and_save(
+                src_las,
+                config.predict.output_dir,
+                config.datamodule.get("epsg"),
+                las=las,
+                writer_params=writer_params,
+            )
+        except BaseException as e:
+            errors.append(e)
+            continue
+        stats.add(1, itp.nb_points, time.perf_counter() - start)
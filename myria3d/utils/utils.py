@@ -1,7 +1,8 @@
+import contextlib
 import logging
 import time
 import warnings
-from typing import List, Sequence
+from typing import ContextManager, List, Sequence, Union
 
 import pytorch_lightning as pl
 import rich.syntax
@@ -176,3 +177,30 @@ def define_device_from_config_param(gpus_param):
         else (torch.device("cuda") if gpus_param == 1 else f"cuda:{int(gpus_param[0])}")
     )
     return device
+
+
+def get_autocast_context(precision: Union[str, int], device: torch.device) -> ContextManager:
+    """Context of automatic mixed precision, with the same precision names as lightning's Trainer.
+
+    Args:
+        precision (Union[str, int]): "32" (or "32-true") for full precision, "16-mixed" for float16
+            autocast (GPU only), or "bf16-mixed" for bfloat16 autocast (GPU or CPU).
+        device (torch.device): device on which the neural network runs.
+
+    Returns:
+        ContextManager: autocast context, or a null context for full precision.
+
+    """
+    precision = str(precision)
+    device_type = torch.device(device).type
+    if precision in ["32", "32-true"]:
+        return contextlib.nullcontext()
+    if precision == "bf16-mixed":
+        return torch.autocast(device_type=device_type, dtype=torch.bfloat16)
+    if precision == "16-mixed":
+        if device_type == "cpu":
+            raise ValueError("Precision 16-mixed is only supported on GPU. Use bf16-mixed on CPU.")
+        return torch.autocast(device_type=device_type, dtype=torch.float16)
+    raise ValueError(
+        f"Precision should be one of '32', '16-mixed', or 'bf16-mixed'. (Current value: {precision})"
+    )
@@ -33,6 +33,7 @@ class TASK_NAMES(Enum):
     FINETUNE = "finetune"
     PREDICT = "predict"
     HDF5 = "create_hdf5"
+    EXPORT = "export"
 
 
 DEFAULT_TASK = TASK_NAMES.FIT.value
@@ -76,10 +77,34 @@ def launch_predict(config: DictConfig):
 
     # Iterate over the files and predict.
     src_las_iterable = glob(config.predict.src_las)
+    pipeline_config = config.predict.get("pipeline") or {}
+    if pipeline_config.get("enabled", False):
+        from myria3d.predict_pipeline import predict_files
+
+        predict_files(config, src_las_iterable)
+        return
     for config.predict.src_las in tqdm(src_las_iterable):
         predict(config)
 
 
+@hydra.main(config_path=DEFAULT_DIRECTORY, config_name=DEFAULT_CONFIG_FILE)
+def launch_export(config: DictConfig):
+    """Export a trained model and its preprocessing as a package for lightweight inference."""
+    from myria3d.export import export
+
+    # hydra changes current directory, so we make sure the checkpoint has an absolute path
+    if not os.path.isabs(config.predict.ckpt_path):
+        config.predict.ckpt_path = os.path.join(
+            os.path.dirname(__file__), config.predict.ckpt_path
+        )
+
+    # Pretty print config using Rich library
+    if config.get("print_config"):
+        utils.print_config(config, resolve=False)
+
+    export(config)
+
+
 @hydra.main(config_path="configs/", config_name="config.yaml")
 def launch_hdf5(config: DictConfig):
     """Build an HDF5 file from a directory with las files."""
@@ -102,6 +127,11 @@ def launch_hdf5(config: DictConfig):
         points_pre_transform=hydra.utils.instantiate(
             config.datamodule.get("points_pre_transform")
         ),
+        num_workers=config.datamodule.get("create_hdf5_num_workers", 1),
+        subtile_splitting_method=config.datamodule.get("subtile_splitting_method", "kdtree"),
+        layout=config.datamodule.get("hdf5_layout", "groups"),
+        storage=config.datamodule.get("hdf5_storage"),
+        schema=config.datamodule.get("hdf5_schema", "standard"),
     )
 
 
@@ -127,6 +157,10 @@ if __name__ == "__main__":
     elif task_name == TASK_NAMES.HDF5.value:
         launch_hdf5()
 
+    elif task_name == TASK_NAMES.EXPORT.value:
+        dotenv.load_dotenv(os.path.join(DEFAULT_DIRECTORY, DEFAULT_ENV))
+        launch_export()
+
     else:
         choices = ", ".join(task.value for task in TASK_NAMES)
         raise ValueError(
@@ -0,0 +1,24 @@
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from myria3d.callbacks.logging_callbacks import LogSampleCacheStats
+from myria3d.pctl.dataset.cache import SharedMemorySampleCache
+
+
+def test_sample_cache_hit_rate_ignores_accesses_of_previous_runs(tmp_path):
+    cache = SharedMemorySampleCache(str(tmp_path / "cache"), max_bytes=10**6)
+    cache.put("train/0", {"pos": np.zeros((10, 3), dtype=np.float32)})
+    # A previous run, of which stats persist in the cache directory.
+    for _ in range(3):
+        cache.get("train/1")
+    dataset = SimpleNamespace(sample_cache=cache)
+    trainer = SimpleNamespace(datamodule=SimpleNamespace(dataset=dataset))
+    pl_module = MagicMock()
+
+    callback = LogSampleCacheStats()
+    callback.on_train_start(trainer, pl_module)
+    cache.get("train/0")
+    callback.on_train_epoch_end(trainer, pl_module)
+    pl_module.log.assert_any_call("sample_cache/hit_rate", 1.0, on_step=False, on_epoch=True)
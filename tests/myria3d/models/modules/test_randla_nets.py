@@ -2,7 +2,13 @@ import pytest
 import torch
 from torch_geometric.data import Batch, Data
 
-from myria3d.models.modules.pyg_randla_net import PyGRandLANet
+from myria3d.models.modules.pyg_randla_net import (
+    DenseLocalFeatureAggregation,
+    LocalFeatureAggregation,
+    PyGRandLANet,
+    build_neighbors_hierarchy,
+    decimation_indices,
+)
 
 
 @pytest.mark.parametrize("num_nodes", [[12500, 12500], [50, 50], [12500, 10000]])
@@ -38,3 +44,93 @@ def test_fake_run_pyg_randlanet(num_nodes):
     )
     output = model(data.x, data.pos, data.batch, data.ptr)
     assert output.shape == torch.Size([sum(num_nodes), num_classes])
+
+
+def test_decimation_indices_samples_each_cloud():
+    ptr = torch.LongTensor([0, 12500, 22500, 22502, 22503])
+    idx_decim, ptr_decim = decimation_indices(ptr, 4)
+    assert ptr_decim.tolist() == [0, 3125, 5625, 5626, 5627]
+    # Indices are unique, and sampled within their own cloud, which is never emptied.
+    assert idx_decim.unique().numel() == idx_decim.numel()
+    batch = torch.repeat_interleave(torch.arange(4), ptr[1:] - ptr[:-1])
+    assert torch.equal(batch[idx_decim], torch.repeat_interleave(torch.arange(4), ptr_decim.diff()))
+
+
+@pytest.mark.parametrize("chunk_size,recompute", [(None, False), (100, True)])
+def test_dense_local_feature_aggregation_matches_sparse(chunk_size, recompute):
+    num_nodes, num_neighbors, channels = 500, 16, 32
+    pos = torch.rand((num_nodes, 3))
+    x = torch.rand((num_nodes, channels // 2), requires_grad=True)
+    neighbors = torch.cdist(pos, pos).topk(num_neighbors, largest=False).indices
+    edge_index = torch.stack(
+        [neighbors.flatten(), torch.arange(num_nodes).repeat_interleave(num_neighbors)]
+    )
+
+    sparse_lfa = LocalFeatureAggregation(channels)
+    dense_lfa = DenseLocalFeatureAggregation(
+        channels, num_neighbors, chunk_size=chunk_size, recompute=recompute
+    )
+    dense_lfa.load_state_dict(sparse_lfa.state_dict())
+
+    sparse_out = sparse_lfa(edge_index, x, pos)
+    (sparse_grad,) = torch.autograd.grad(sparse_out.sum(), x)
+    dense_out = dense_lfa(edge_index, x, pos)
+    (dense_grad,) = torch.autograd.grad(dense_out.sum(), x)
+    assert torch.allclose(sparse_out, dense_out, atol=1e-5)
+    assert torch.allclose(sparse_grad, dense_grad, atol=1e-5)
+
+
+def test_pyg_randlanet_with_neighbors_hierarchy():
+    num_nodes = [2000, 1000]
+    data = Batch.from_data_list(
+        [Data(x=torch.rand((n, 9)), pos=torch.rand((n, 3))) for n in num_nodes]
+    )
+    hierarchy = build_neighbors_hierarchy(data.pos, data.batch, data.ptr, 16, 4)
+    assert hierarchy.edge_index[0].size(1) == sum(num_nodes) * 16
+    # Points kept by decimation are upsampled from themselves.
+    idx_decim = hierarchy.idx_decim[0]
+    assert torch.equal(hierarchy.upsample_idx[0][idx_decim], torch.arange(idx_decim.numel()))
+
+    model = PyGRandLANet(9, 6)
+    output = model(data.x, data.pos, data.batch, data.ptr, hierarchy=hierarchy)
+    assert output.shape == torch.Size([sum(num_nodes), 6])
+
+
+@pytest.mark.parametrize("lfa_mode", ["sparse", "dense"])
+def test_pyg_randlanet_with_neighbors_hierarchy_compiles_without_graph_breaks(lfa_mode):
+    data = Batch.from_data_list(
+        [Data(x=torch.rand((n, 9)), pos=torch.rand((n, 3))) for n in [2000, 1000]]
+    )
+    hierarchy = build_neighbors_hierarchy(data.pos, data.batch, data.ptr, 16, 4)
+    model = PyGRandLANet(9, 6, lfa_mode=lfa_mode)
+    explanation = torch._dynamo.explain(model.forward)(
+        data.x, data.pos, data.batch, data.ptr, hierarchy=hierarchy
+    )
+    assert explanation.graph_count == 1
+    assert explanation.graph_break_count == 0
+
+
+@pytest.mark.parametrize("checkpointing", ["blocks", "lfa"])
+def test_pyg_randlanet_checkpointing_gives_same_gradients_and_statistics(checkpointing):
+    data = Batch.from_data_list(
+        [Data(x=torch.rand((n, 9)), pos=torch.rand((n, 3))) for n in [2000, 1000]]
+    )
+    hierarchy = build_neighbors_hierarchy(data.pos, data.batch, data.ptr, 16, 4)
+    model = PyGRandLANet(9, 6)
+    checkpointed_model = PyGRandLANet(9, 6, checkpointing=checkpointing)
+    checkpointed_model.load_state_dict(model.state_dict())
+
+    for m in [model, checkpointed_model]:
+        # Same dropout in the classification head.
+        torch.manual_seed(0)
+        m(data.x, data.pos, data.batch, data.ptr, hierarchy=hierarchy).sum().backward()
+
+    for (name, param), checkpointed_param in zip(
+        model.named_parameters(), checkpointed_model.parameters()
+    ):
+        assert torch.allclose(param.grad, checkpointed_param.grad, atol=1e-4), name
+    # Recomputations in backward do not update running statistics of BatchNorm layers again.
+    for (name, buffer), checkpointed_buffer in zip(
+        model.named_buffers(), checkpointed_model.buffers()
+    ):
+        assert torch.allclose(buffer.float(), checkpointed_buffer.float(), atol=1e-6), name
@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+import torch
+from torch_geometric.data import Data
+from torch_geometric.nn import knn_interpolate
+
+from myria3d.models.interpolation import (
+    Interpolator,
+    interpolate_logits_to_full_subtiles,
+    kdtree_interpolate,
+)
+from myria3d.pctl.dataloader.dataloader import GeometricNoneProofCollater
+
+
+def _make_batch(sizes, sampling_ratio=0.3):
+    samples = []
+    for num_points in sizes:
+        pos = torch.rand((num_points, 3)) * 10
+        sampled = torch.randperm(num_points)[: max(1, int(num_points * sampling_ratio))]
+        copies = {"pos_copy": pos, "pos_sampled_copy": pos[sampled]}
+        samples.append(Data(pos=pos[sampled], copies=copies))
+    return GeometricNoneProofCollater()(samples)
+
+
+@pytest.mark.parametrize("num_workers", [1, 3])
+def test_kdtree_interpolate_matches_knn_interpolate(num_workers):
+    torch.manual_seed(0)
+    batch = _make_batch([500, 300, 5])
+    logits = torch.rand((batch.num_nodes, 7))
+    kwargs = dict(
+        pos_x=batch.copies["pos_sampled_copy"],
+        pos_y=batch.copies["pos_copy"],
+        batch_x=batch.batch,
+        batch_y=batch.pos_copy_batch,
+        k=10,  # More neighbors than points in the last sample.
+    )
+    expected = knn_interpolate(logits, **kwargs)
+    interpolated = kdtree_interpolate(logits, num_workers=num_workers, **kwargs)
+    assert torch.allclose(interpolated, expected, atol=1e-5)
+
+
+def test_interpolate_logits_to_full_subtiles_checks_engine():
+    batch = _make_batch([50])
+    with pytest.raises(ValueError):
+        interpolate_logits_to_full_subtiles(torch.rand((batch.num_nodes, 7)), batch, 3, 1, "cuda")
+
+
+@pytest.mark.parametrize("accumulator_dtype", ["float32", "float16"])
+@pytest.mark.parametrize("memory_mapped", [False, True])
+def test_interpolator_sums_logits_of_points_predicted_several_times(
+    accumulator_dtype, memory_mapped, tmp_path
+):
+    itp = Interpolator(
+        classification_dict={1: "unclassified", 2: "ground", 6: "building"},
+        accumulator_dtype=accumulator_dtype,
+        accumulator_dir=str(tmp_path) if memory_mapped else None,
+    )
+    itp.allocate_accumulator("unused.las", nb_points=10)
+    # Two batches of two subtiles, with points 2 and 3 in overlapping subtiles, and no prediction for 9.
+    batches = [[np.array([0, 1, 2, 3]), np.array([2, 3, 4])], [np.array([5, 6, 7, 8, 3])]]
+    expected = torch.zeros((10, 3))
+    for idx_in_original_cloud in batches:
+        logits = torch.randn((sum(len(idx) for idx in idx_in_original_cloud), 3))
+        itp.store_predictions(logits, idx_in_original_cloud)
+        expected.index_add_(0, torch.from_numpy(np.concatenate(idx_in_original_cloud)), logits)
+
+    logits, idx_in_full_cloud = itp.reduce_predicted_logits()
+    assert idx_in_full_cloud.tolist() == list(range(9))
+    assert logits.dtype == torch.float32
+    assert torch.allclose(logits, expected[:9], atol=1e-2)
+    assert itp.prediction_counts.tolist() == [1, 1, 2, 3, 1, 1, 1, 1, 1, 0]
+
+
+def test_interpolator_adds_prediction_dimensions_as_pdal_filters_do():
+    itp = Interpolator(
+        classification_dict={1: "unclassified", 2: "ground", 6: "building"},
+        probas_to_save=["ground", "building"],
+    )
+    las = np.zeros(5, dtype=[("X", "f8"), ("Classification", "u1"), ("building", "f4")])
+    las["X"] = np.arange(5)
+    las["Classification"] = [1, 2, 6, 65, 2]
+    las["building"] = 0.5  # e.g. a LAS that was already predicted on.
+
+    extended_las = itp.add_prediction_dimensions(las)
+    assert extended_las.dtype.descr == [
+        ("X", "<f8"),
+        ("Classification", "|u1"),
+        ("building", "<f4"),
+        ("ground", "<f8"),
+        ("PredictedClassification", "|u1"),
+        ("entropy", "<f8"),
+    ]
+    assert np.array_equal(extended_las["X"], las["X"])
+    assert np.array_equal(extended_las["PredictedClassification"], las["Classification"])
+    for dim in ["building", "ground", "entropy"]:
+        assert not extended_las[dim].any()
@@ -1,4 +1,5 @@
 import hydra
+import torch
 from pytorch_lightning import LightningDataModule, LightningModule
 from tests.conftest import make_default_hydra_cfg
 
@@ -26,7 +27,9 @@ def test_model_get_batch_tensor_by_enumeration():
     )
     for batch in datamodule.predict_dataloader():
         # Check that no error is raised ("TypeError: object of type 'numpy.int64' has no len()")
-        _ = model._get_batch_tensor_by_enumeration(batch.idx_in_original_cloud)
+        batch_y = model._get_batch_tensor_by_enumeration(batch.idx_in_original_cloud)
+        # The collater makes the same batch vector of full positions.
+        assert torch.equal(batch.pos_copy_batch, batch_y)
 
 
 def test_model_forward():
@@ -0,0 +1,42 @@
+import pytest
+import torch
+from torch_geometric.data import Batch, Data
+
+from myria3d.models.modules.pyg_randla_net import PyGRandLANet, build_neighbors_hierarchy
+from myria3d.models.quantization import optimize_for_cpu_inference
+
+
+@pytest.fixture
+def trained_net_and_batch():
+    """A RandLa-Net with non-trivial BatchNorm statistics, and a batch of two clouds."""
+    data = Batch.from_data_list(
+        [Data(x=torch.rand((n, 9)), pos=torch.rand((n, 3))) for n in [2000, 1500]]
+    )
+    net = PyGRandLANet(9, 6, return_logits=True)
+    with torch.no_grad():
+        net(data.x, data.pos, data.batch, data.ptr)
+    return net.eval(), data
+
+
+@torch.no_grad()
+def test_folded_batch_norms_give_same_logits(trained_net_and_batch):
+    net, data = trained_net_and_batch
+    hierarchy = build_neighbors_hierarchy(data.pos, data.batch, data.ptr, 16, 4)
+    folded_net = optimize_for_cpu_inference(net, "fold_bn")
+    assert not any(isinstance(m, torch.nn.BatchNorm1d) for m in folded_net.modules())
+    logits = net(data.x, data.pos, data.batch, data.ptr, hierarchy=hierarchy)
+    folded_logits = folded_net(data.x, data.pos, data.batch, data.ptr, hierarchy=hierarchy)
+    assert torch.allclose(logits, folded_logits, atol=1e-5)
+
+
+@torch.no_grad()
+def test_dynamic_int8_quantization_keeps_predictions(trained_net_and_batch):
+    net, data = trained_net_and_batch
+    hierarchy = build_neighbors_hierarchy(data.pos, data.batch, data.ptr, 16, 4)
+    quantized_net = optimize_for_cpu_inference(net, "dynamic_int8")
+    logits = net(data.x, data.pos, data.batch, data.ptr, hierarchy=hierarchy)
+    quantized_logits = quantized_net(data.x, data.pos, data.batch, data.ptr, hierarchy=hierarchy)
+    agreement = (logits.argmax(dim=1) == quantized_logits.argmax(dim=1)).float().mean()
+    assert agreement > 0.9
+    # The float model is left untouched.
+    assert any(isinstance(m, torch.nn.BatchNorm1d) for m in net.modules())
@@ -0,0 +1,42 @@
+import numpy as np
+import torch
+from torch_geometric.data import Data
+
+from myria3d.pctl.dataloader.dataloader import (
+    GeometricNoneProofCollater,
+    make_batch_vector,
+    transfer_batch_to_device,
+)
+from myria3d.pctl.transforms.transforms import CopyFullPos, CopySampledPos
+
+
+def _make_sample(num_points, num_sampled_points):
+    data = Data(
+        x=torch.rand((num_points, 3)),
+        pos=torch.rand((num_points, 3)),
+        idx_in_original_cloud=np.arange(num_points),
+    )
+    data = CopyFullPos()(data)
+    data.x, data.pos = data.x[:num_sampled_points], data.pos[:num_sampled_points]
+    return CopySampledPos()(data)
+
+
+def test_make_batch_vector():
+    assert torch.equal(make_batch_vector([2, 0, 3]), torch.tensor([0, 0, 2, 2, 2]))
+    assert make_batch_vector([]).numel() == 0
+
+
+def test_collater_makes_batch_vector_of_full_positions():
+    samples = [_make_sample(n, n // 2) for n in [70, 30, 5]]
+    batch = GeometricNoneProofCollater()(samples + [None])
+    assert torch.equal(batch.pos_copy_batch, torch.repeat_interleave(torch.tensor([70, 30, 5])))
+    assert batch.pos_copy_batch.size(0) == batch.copies["pos_copy"].size(0)
+    assert torch.equal(batch.batch, torch.repeat_interleave(torch.tensor([35, 15, 2])))
+
+
+def test_transfer_batch_to_device_keeps_copies():
+    batch = GeometricNoneProofCollater()([_make_sample(n, n // 2) for n in [70, 30]])
+    pos_copy = batch.copies["pos_copy"]
+    batch = transfer_batch_to_device(batch, torch.device("cpu"))
+    assert batch.copies["pos_copy"] is pos_copy
+    assert "pos_copy_batch" in batch and "x" in batch
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from torch.utils.data import DistributedSampler, RandomSampler, SequentialSampler
+
+from myria3d.pctl.dataloader.sampler import PointBudgetBatchSampler
+
+
+def test_point_budget_batch_sampler_packs_samples():
+    num_points = [300, 500, 200, 1500, 100]
+    batch_sampler = PointBudgetBatchSampler(SequentialSampler(num_points), num_points, 1000)
+    # A sample larger than the budget forms a batch on its own.
+    assert list(batch_sampler) == [[0, 1, 2], [3], [4]]
+    assert len(batch_sampler) == 3
+
+    # Attributes of BatchSampler, read e.g. by Lightning when it re-instantiates batch samplers.
+    assert batch_sampler.batch_size is None
+    assert batch_sampler.drop_last is False
+
+
+def test_point_budget_batch_sampler_len_matches_iter_when_shuffled():
+    num_points = np.random.default_rng(0).integers(300, 40000, 200)
+    batch_sampler = PointBudgetBatchSampler(RandomSampler(num_points), num_points, 100000)
+    for _ in range(3):
+        num_batches = len(batch_sampler)
+        batches = list(batch_sampler)
+        assert len(batches) == num_batches
+        assert sorted(idx for batch in batches for idx in batch) == list(range(200))
+        assert all(num_points[batch].sum() <= 100000 for batch in batches if len(batch) > 1)
+
+
+@pytest.mark.parametrize("num_replicas", [2, 3])
+def test_point_budget_batch_sampler_shards_with_same_number_of_batches(num_replicas):
+    num_points = np.random.default_rng(0).integers(300, 40000, 100)
+    batches_by_rank = []
+    for rank in range(num_replicas):
+        sampler = DistributedSampler(num_points, num_replicas=num_replicas, rank=rank, seed=1)
+        sampler.set_epoch(2)
+        batches_by_rank.append(list(PointBudgetBatchSampler(sampler, num_points, 100000)))
+    assert len({len(batches) for batches in batches_by_rank}) == 1
+    seen = {idx for batches in batches_by_rank for batch in batches for idx in batch}
+    assert seen == set(range(100))
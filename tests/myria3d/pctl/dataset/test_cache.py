@@ -0,0 +1,86 @@
+import multiprocessing
+import os
+import pickle
+
+import numpy as np
+
+from myria3d.pctl.dataset.cache import SharedMemorySampleCache
+
+
+def make_sample(num_points: int):
+    return {"pos": np.zeros((num_points, 3), dtype=np.float32), "x_features_names": ["a"]}
+
+
+def test_sample_cache_get_and_put(tmp_path):
+    cache = SharedMemorySampleCache(str(tmp_path / "cache"), max_bytes=10**6)
+    assert cache.get("train/0") is None
+    cache.put("train/0", make_sample(10))
+    sample = cache.get("train/0")
+    assert np.array_equal(sample["pos"], make_sample(10)["pos"])
+    assert sample["x_features_names"] == ["a"]
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+    cache.clear()
+    assert not os.path.exists(tmp_path / "cache")
+
+
+def test_sample_cache_evicts_least_recently_used(tmp_path):
+    # Room for about three samples of 1000 points.
+    cache = SharedMemorySampleCache(str(tmp_path / "cache"), max_bytes=40000)
+    for idx in range(3):
+        cache.put(f"train/{idx}", make_sample(1000))
+        os.utime(cache._get_sample_path(f"train/{idx}"), (idx, idx))
+    cache.put("train/3", make_sample(1000))
+
+    # Least recently used samples are evicted first.
+    assert cache.get("train/0") is None
+    assert cache.get("train/2") is not None
+    assert cache.get("train/3") is not None
+    assert cache.stats()["size"] <= 40000
+
+
+def _get_samples(cache: SharedMemorySampleCache, num_gets: int):
+    for _ in range(num_gets):
+        cache.get("train/0")
+
+
+def test_sample_cache_stats_are_flushed_at_process_exit_to_one_file_per_slot(tmp_path):
+    cache = SharedMemorySampleCache(str(tmp_path / "cache"), max_bytes=10**6)
+    cache.put("train/0", make_sample(10))
+    for _ in range(2):
+        # Successive processes in the same slot, e.g. DataLoader workers of successive epochs.
+        process = multiprocessing.get_context("fork").Process(target=_get_samples, args=(cache, 3))
+        process.start()
+        process.join()
+    assert os.listdir(cache.stats_dir) == ["rank0-workermain"]
+    assert cache.stats()["hits"] == 6
+
+
+def test_sample_cache_get_is_a_hit_if_sample_is_evicted_after_load(tmp_path, monkeypatch):
+    cache = SharedMemorySampleCache(str(tmp_path / "cache"), max_bytes=10**6)
+    cache.put("train/0", make_sample(10))
+
+    def utime_of_evicted_sample(path):
+        os.remove(path)
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(os, "utime", utime_of_evicted_sample)
+    assert cache.get("train/0") is not None
+    assert cache.stats()["hits"] == 1
+
+
+def test_sample_cache_deletes_unused_sibling_caches(tmp_path):
+    used_cache = SharedMemorySampleCache(str(tmp_path / ("1" * 32)), max_bytes=10**6)
+    # Caches sent to other processes (e.g. spawned DataLoader workers) are still in use.
+    unpickled_cache = pickle.loads(pickle.dumps(used_cache))
+    used_cache._in_use_file.close()
+    unused_cache = SharedMemorySampleCache(str(tmp_path / ("0" * 32)), max_bytes=10**6)
+    unused_cache.put("train/0", make_sample(10))
+    unused_cache._in_use_file.close()
+    os.makedirs(tmp_path / "not_a_cache")
+
+    cache = SharedMemorySampleCache(str(tmp_path / ("2" * 32)), max_bytes=10**6)
+    assert sorted(os.listdir(tmp_path)) == ["1" * 32, "2" * 32, "not_a_cache"]
+    unpickled_cache.put("train/0", make_sample(10))
+    assert unpickled_cache.get("train/0") is not None
+    assert cache.get("train/0") is None
@@ -0,0 +1,309 @@
+import functools
+import os
+import shutil
+from concurrent.futures import Future
+
+import h5py
+import numpy as np
+import pytest
+import torch
+
+from myria3d.pctl.dataset import hdf5
+from myria3d.pctl.dataset.hdf5 import HDF5Dataset, create_hdf5
+from myria3d.pctl.dataset.hdf5_layout import (
+    build_samples_index,
+    iter_tiles_samples,
+    list_samples_hdf5_paths,
+    mark_tile_as_complete,
+    read_sample,
+    write_sample,
+)
+from myria3d.pctl.dataset.toy_dataset import TOY_EPSG, TOY_LAS_DATA
+from myria3d.pctl.points_pre_transform.lidar_hd import lidar_hd_pre_transform
+from myria3d.pctl.transforms.compose import CustomCompose
+from myria3d.pctl.transforms.transforms import (
+    DropPointsByClass,
+    MaximumNumNodes,
+    NormalizePos,
+    TargetTransform,
+)
+
+# Picklable, to be sent to worker processes.
+POINTS_PRE_TRANSFORM = functools.partial(
+    lidar_hd_pre_transform,
+    pos_keys=["X", "Y", "Z"],
+    features_keys=["Intensity", "ReturnNumber", "NumberOfReturns"],
+    color_keys=["Red", "Green", "Blue", "Infrared"],
+)
+
+
+@pytest.fixture
+def las_paths_by_split_dict(tmp_path):
+    """Copies of the toy LAS under different names, so that tiles differ by their basename."""
+    las_paths_by_split_dict = {}
+    for split, names in [("train", ["a", "b", "c"]), ("val", ["d"]), ("test", ["e"])]:
+        las_paths_by_split_dict[split] = []
+        for name in names:
+            las_path = str(tmp_path / "src" / f"{name}.las")
+            os.makedirs(os.path.dirname(las_path), exist_ok=True)
+            shutil.copy(TOY_LAS_DATA, las_path)
+            las_paths_by_split_dict[split].append(las_path)
+    return las_paths_by_split_dict
+
+
+def make_hdf5(las_paths_by_split_dict, hdf5_file_path, **kwargs):
+    create_hdf5(
+        las_paths_by_split_dict,
+        str(hdf5_file_path),
+        TOY_EPSG,
+        tile_width=110,
+        subtile_width=50,
+        pre_filter=None,
+        points_pre_transform=POINTS_PRE_TRANSFORM,
+        **kwargs,
+    )
+
+
+def read_all_samples(hdf5_file_path):
+    """Samples by split, tile, and sample number."""
+    with h5py.File(hdf5_file_path, "r") as hdf5_file:
+        return {
+            (split, basename, sample_number): sample
+            for split, basename, samples in iter_tiles_samples(hdf5_file)
+            for sample_number, sample in samples
+        }
+
+
+def assert_same_samples(hdf5_file_path, expected_hdf5_file_path):
+    samples = read_all_samples(hdf5_file_path)
+    expected_samples = read_all_samples(expected_hdf5_file_path)
+    assert samples.keys() == expected_samples.keys()
+    for key, expected_sample in expected_samples.items():
+        for field in ["x", "pos", "y", "idx_in_original_cloud"]:
+            np.testing.assert_array_equal(samples[key][field], expected_sample[field])
+        assert samples[key]["x_features_names"] == expected_sample["x_features_names"]
+
+
+def read_all_datasets(hdf5_file_path):
+    """Content of all HDF5 datasets of the file, by path."""
+    datasets = {}
+
+    def read_dataset(path, obj):
+        if isinstance(obj, h5py.Dataset):
+            datasets[path] = obj[()]
+
+    with h5py.File(hdf5_file_path, "r") as hdf5_file:
+        hdf5_file.visititems(read_dataset)
+    return datasets
+
+
+def read_samples_index(hdf5_file_path):
+    with h5py.File(hdf5_file_path, "r") as hdf5_file:
+        return build_samples_index(hdf5_file)
+
+
+@pytest.mark.parametrize("layout", ["groups", "flat"])
+def test_create_hdf5_in_parallel_matches_sequential(tmp_path, las_paths_by_split_dict, layout):
+    make_hdf5(las_paths_by_split_dict, tmp_path / "sequential.hdf5", layout=layout, num_workers=1)
+    make_hdf5(las_paths_by_split_dict, tmp_path / "parallel.hdf5", layout=layout, num_workers=2)
+
+    assert_same_samples(tmp_path / "parallel.hdf5", tmp_path / "sequential.hdf5")
+    index_1 = read_samples_index(tmp_path / "sequential.hdf5")
+    index_2 = read_samples_index(tmp_path / "parallel.hdf5")
+    assert index_1["tiles"] == index_2["tiles"]
+    for key in ["split_ranges", "tile_ids", "sample_numbers", "offsets"]:
+        np.testing.assert_array_equal(index_1[key], index_2[key])
+
+
+def test_create_hdf5_flat_layout_in_parallel_writes_same_file(tmp_path, las_paths_by_split_dict):
+    make_hdf5(las_paths_by_split_dict, tmp_path / "sequential.hdf5", layout="flat", num_workers=1)
+    make_hdf5(las_paths_by_split_dict, tmp_path / "parallel.hdf5", layout="flat", num_workers=2)
+
+    # Tiles are appended in the same order: datasets of the flat layout are equal row by row.
+    datasets = read_all_datasets(tmp_path / "parallel.hdf5")
+    expected_datasets = read_all_datasets(tmp_path / "sequential.hdf5")
+    assert datasets.keys() == expected_datasets.keys()
+    for path, expected_data in expected_datasets.items():
+        np.testing.assert_array_equal(datasets[path], expected_data)
+
+
+@pytest.mark.parametrize("layout", ["groups", "flat"])
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_create_hdf5_rebuilds_interrupted_tile(
+    tmp_path, las_paths_by_split_dict, layout, num_workers
+):
+    expected_hdf5_file_path = tmp_path / "expected.hdf5"
+    make_hdf5(las_paths_by_split_dict, expected_hdf5_file_path, layout=layout)
+
+    # Interrupt the last tile of the train split: its samples are partly written, and it is not
+    # flagged as complete.
+    hdf5_file_path = tmp_path / "interrupted.hdf5"
+    shutil.copy(expected_hdf5_file_path, hdf5_file_path)
+    with h5py.File(hdf5_file_path, "a") as hdf5_file:
+        if layout == "groups":
+            tile_group = hdf5_file["train"]["c.las"]
+            del tile_group.attrs["is_complete"]
+            del tile_group[list(tile_group.keys())[-1]]
+        else:
+            tiles = hdf5_file["train"]["tiles"]
+            tiles.resize(tiles.shape[0] - 1, axis=0)
+    samples = read_all_samples(hdf5_file_path)
+    assert not any(basename == "c.las" for _, basename, _ in samples)
+
+    make_hdf5(las_paths_by_split_dict, hdf5_file_path, layout=layout, num_workers=num_workers)
+    assert_same_samples(hdf5_file_path, expected_hdf5_file_path)
+    with h5py.File(hdf5_file_path, "r") as hdf5_file:
+        for sample_hdf5_path in list_samples_hdf5_paths(hdf5_file):
+            read_sample(hdf5_file, sample_hdf5_path)
+
+
+class SynchronousExecutor:
+    """Runs tasks at submission, and records the maximal number of tiles in flight."""
+
+    def __init__(self, max_workers: int):
+        self.num_submitted = 0
+        self.num_yielded = 0
+        self.max_tiles_in_flight = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def submit(self, function, *args, **kwargs) -> Future:
+        self.num_submitted += 1
+        self.max_tiles_in_flight = max(
+            self.max_tiles_in_flight, self.num_submitted - self.num_yielded
+        )
+        future = Future()
+        future.set_result(function(*args, **kwargs))
+        return future
+
+
+def test_prepare_tiles_in_parallel_bounds_tiles_in_flight(monkeypatch):
+    executor = SynchronousExecutor(max_workers=2)
+    monkeypatch.setattr(hdf5, "ProcessPoolExecutor", lambda max_workers: executor)
+    monkeypatch.setattr(hdf5, "_prepare_tile", lambda las_path: [(0, las_path)])
+    las_paths = [f"{idx}.las" for idx in range(10)]
+
+    prepared_tiles = []
+    for las_path, samples in hdf5._prepare_tiles_in_parallel(las_paths, num_workers=2):
+        executor.num_yielded += 1
+        prepared_tiles.append(las_path)
+        assert samples == [(0, las_path)]
+    # Tiles are yielded in order of submission.
+    assert prepared_tiles == las_paths
+    # 2 * num_workers tiles in the pool, and the tile being written.
+    assert executor.max_tiles_in_flight == 5
+
+
+CLASSIFICATION_DICT = {1: "unclassified", 2: "ground", 6: "building"}
+
+
+def make_transforms(subtile_width=50):
+    """Eval transforms are deterministic. Train transforms end with random subsampling."""
+    prefix = [
+        DropPointsByClass(),
+        TargetTransform({}, CLASSIFICATION_DICT),
+        NormalizePos(subtile_width),
+    ]
+    return CustomCompose(prefix + [MaximumNumNodes(20)]), CustomCompose(prefix)
+
+
+@pytest.fixture
+def hdf5_file_path(tmp_path):
+    """A small HDF5 dataset, written without LAS files."""
+    hdf5_file_path = str(tmp_path / "dataset.hdf5")
+    rng = np.random.default_rng(0)
+    with h5py.File(hdf5_file_path, "a") as hdf5_file:
+        for split, num_samples in [("train", 4), ("val", 2), ("test", 2)]:
+            hdf5_file.create_group(split)
+            for sample_number in range(num_samples):
+                num_points = int(rng.integers(25, 60))
+                sample = {
+                    "x": rng.random((num_points, 4), dtype=np.float32),
+                    "x_features_names": ["a", "b", "c", "d"],
+                    "pos": rng.random((num_points, 3), dtype=np.float32) * 50,
+                    "y": rng.choice([1, 2, 6, 65], num_points).astype(np.int32),
+                    "idx_in_original_cloud": np.arange(num_points, dtype=np.int32),
+                }
+                write_sample(hdf5_file, split, "tile.las", sample_number, sample)
+            mark_tile_as_complete(hdf5_file, split, "tile.las")
+    return hdf5_file_path
+
+
+def make_dataset(hdf5_file_path, subtile_width=50, **kwargs):
+    train_transform, eval_transform = make_transforms(subtile_width)
+    return HDF5Dataset(
+        hdf5_file_path,
+        TOY_EPSG,
+        las_paths_by_split_dict=None,
+        train_transform=train_transform,
+        eval_transform=eval_transform,
+        **kwargs,
+    )
+
+
+def assert_same_dataset_samples(dataset, expected_dataset):
+    assert len(dataset) == len(expected_dataset)
+    for idx in range(len(dataset)):
+        # Same seed for the stochastic tail of train transforms.
+        torch.manual_seed(idx)
+        data = dataset[idx]
+        torch.manual_seed(idx)
+        expected_data = expected_dataset[idx]
+        for key in ["x", "pos", "y"]:
+            assert torch.equal(data[key], expected_data[key])
+        np.testing.assert_array_equal(
+            data.idx_in_original_cloud, expected_data.idx_in_original_cloud
+        )
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_hdf5_dataset_with_prefix_cache_gives_same_samples(tmp_path, hdf5_file_path, num_workers):
+    dataset = make_dataset(hdf5_file_path, prefix_cache_path=str(tmp_path / "prefix.hdf5"))
+    dataset.materialize_prefix_cache(num_workers=num_workers)
+    assert set(dataset.prefix_cache_keys) == {"train", "eval"}
+    assert_same_dataset_samples(dataset, make_dataset(hdf5_file_path))
+
+
+def test_hdf5_dataset_prefix_cache_is_invalidated_by_transforms_config(tmp_path, hdf5_file_path):
+    prefix_cache_path = str(tmp_path / "prefix.hdf5")
+    dataset = make_dataset(hdf5_file_path, prefix_cache_path=prefix_cache_path)
+    dataset.materialize_prefix_cache()
+    keys = dataset.prefix_cache_keys
+
+    other_dataset = make_dataset(
+        hdf5_file_path, subtile_width=100, prefix_cache_path=prefix_cache_path
+    )
+    # Precomputed samples of the previous config are not used.
+    assert other_dataset.prefix_cache_keys == {}
+    other_dataset.materialize_prefix_cache()
+    assert set(other_dataset.prefix_cache_keys.values()).isdisjoint(keys.values())
+    assert_same_dataset_samples(other_dataset, make_dataset(hdf5_file_path, subtile_width=100))
+
+
+def test_hdf5_dataset_with_sample_cache_gives_same_samples(tmp_path, hdf5_file_path):
+    sample_cache_dir = tmp_path / "shm"
+    dataset = make_dataset(
+        hdf5_file_path, sample_cache_bytes=10**6, sample_cache_dir=str(sample_cache_dir)
+    )
+    expected_dataset = make_dataset(hdf5_file_path)
+    # Samples are read from the HDF5 file, then from the cache.
+    assert_same_dataset_samples(dataset, expected_dataset)
+    assert dataset.sample_cache.stats()["misses"] == len(dataset)
+    assert_same_dataset_samples(dataset, expected_dataset)
+    assert dataset.sample_cache.stats()["hits"] == len(dataset)
+
+    # The cache of another dataset is deleted once no process uses it, e.g. after its run.
+    previous_cache_dir = dataset.sample_cache.cache_dir
+    dataset.sample_cache._in_use_file.close()
+    other_hdf5_file_path = str(tmp_path / "other_dataset.hdf5")
+    shutil.copy(hdf5_file_path, other_hdf5_file_path)
+    other_dataset = make_dataset(
+        other_hdf5_file_path, sample_cache_bytes=10**6, sample_cache_dir=str(sample_cache_dir)
+    )
+    cache_dir = other_dataset.sample_cache.cache_dir
+    assert cache_dir != previous_cache_dir
+    assert os.listdir(sample_cache_dir) == [os.path.basename(cache_dir)]
@@ -0,0 +1,139 @@
+import h5py
+import numpy as np
+import pytest
+
+from myria3d.pctl.dataset.hdf5_layout import (
+    build_samples_index,
+    get_complete_tiles,
+    get_sample_hdf5_path,
+    get_sample_split,
+    get_storage_kwargs,
+    iter_tiles_samples,
+    list_samples_hdf5_paths,
+    mark_tile_as_complete,
+    read_sample,
+    read_samples_index,
+    remove_incomplete_tiles,
+    set_layout,
+    set_schema,
+    write_sample,
+    write_samples_index,
+)
+
+
+def make_sample(num_points: int, seed: int):
+    rng = np.random.default_rng(seed)
+    return {
+        "x": rng.random((num_points, 4), dtype=np.float32),
+        "x_features_names": ["a", "b", "c", "d"],
+        "pos": rng.random((num_points, 3), dtype=np.float32),
+        "y": rng.integers(0, 5, num_points).astype(np.int32),
+        "idx_in_original_cloud": np.arange(num_points, dtype=np.int32),
+    }
+
+
+def write_tile(hdf5_file, split, basename, samples, complete=True, storage=None):
+    remove_incomplete_tiles(hdf5_file, split)
+    for sample_number, sample in enumerate(samples):
+        write_sample(hdf5_file, split, basename, sample_number, sample, storage)
+    if complete:
+        mark_tile_as_complete(hdf5_file, split, basename)
+
+
+STORAGE = {"compression": "lzf", "chunk_rows": 16, "fields": {"y": {"compression": "gzip"}}}
+
+
+@pytest.mark.parametrize("layout", ["groups", "flat"])
+@pytest.mark.parametrize("storage", [None, STORAGE])
+def test_hdf5_layout_write_and_read(tmp_path, layout, storage):
+    samples = [make_sample(num_points, seed) for seed, num_points in enumerate([10, 1, 25])]
+    with h5py.File(tmp_path / "dataset.hdf5", "a") as hdf5_file:
+        set_layout(hdf5_file, layout)
+        write_tile(hdf5_file, "train", "tile_1.las", samples[:2], storage=storage)
+        write_tile(hdf5_file, "train", "tile_2.las", samples[2:], storage=storage)
+        # An interrupted tile is ignored, and then removed.
+        write_tile(hdf5_file, "train", "tile_3.las", samples, complete=False, storage=storage)
+        remove_incomplete_tiles(hdf5_file, "train")
+
+        assert get_complete_tiles(hdf5_file, "train") == {"tile_1.las", "tile_2.las"}
+        paths = list_samples_hdf5_paths(hdf5_file)
+        assert len(paths) == len(samples)
+        for path, expected in zip(paths, samples):
+            sample = read_sample(hdf5_file, path)
+            assert sample["x_features_names"] == expected["x_features_names"]
+            for field in ["x", "pos", "y", "idx_in_original_cloud"]:
+                assert np.array_equal(sample[field], expected[field])
+
+        tiles = {
+            basename: list(tile_samples)
+            for _, basename, tile_samples in iter_tiles_samples(hdf5_file)
+        }
+        assert [sample_number for sample_number, _ in tiles["tile_1.las"]] == [0, 1]
+
+
+@pytest.mark.parametrize("layout", ["groups", "flat"])
+def test_hdf5_compact_schema_decodes_samples(tmp_path, layout):
+    sample = make_sample(100, 0)
+    # Absolute Lambert-93 coordinates, at the 1 cm scale of LAS files.
+    pos = np.round(sample["pos"] * 50 + np.array([650000, 6860000, 100]), 2)
+    sample["pos"] = pos.astype(np.float32)
+    with h5py.File(tmp_path / "dataset.hdf5", "a") as hdf5_file:
+        set_layout(hdf5_file, layout)
+        set_schema(hdf5_file, "compact")
+        write_tile(hdf5_file, "train", "tile_1.las", [sample])
+        decoded = read_sample(hdf5_file, list_samples_hdf5_paths(hdf5_file)[0])
+
+    for field in ["x", "pos", "y", "idx_in_original_cloud"]:
+        assert decoded[field].dtype == sample[field].dtype
+    assert np.allclose(decoded["x"], sample["x"], atol=1e-3)
+    assert np.array_equal(decoded["pos"], sample["pos"])
+    assert np.array_equal(decoded["y"], sample["y"])
+    assert np.array_equal(decoded["idx_in_original_cloud"], sample["idx_in_original_cloud"])
+
+
+@pytest.mark.parametrize("layout", ["groups", "flat"])
+def test_samples_index(tmp_path, layout):
+    samples = [make_sample(num_points, seed) for seed, num_points in enumerate([10, 1, 25, 3])]
+    with h5py.File(tmp_path / "dataset.hdf5", "a") as hdf5_file:
+        set_layout(hdf5_file, layout)
+        write_tile(hdf5_file, "val", "tile_3.las", samples[3:])
+        write_tile(hdf5_file, "train", "tile_1.las", samples[:2])
+        write_tile(hdf5_file, "train", "tile_2.las", samples[2:3])
+        write_samples_index(hdf5_file, build_samples_index(hdf5_file))
+        samples_index = read_samples_index(hdf5_file)
+
+        assert samples_index["split_ranges"].tolist() == [[0, 3], [3, 4], [4, 4]]
+        assert samples_index["offsets"].tolist() == [0, 10, 11, 36, 39]
+        assert [get_sample_split(samples_index, idx) for idx in range(4)] == [
+            "train",
+            "train",
+            "train",
+            "val",
+        ]
+        for idx, expected in enumerate(samples):
+            sample = read_sample(hdf5_file, get_sample_hdf5_path(samples_index, idx))
+            assert np.array_equal(sample["pos"], expected["pos"])
+
+
+def test_get_storage_kwargs():
+    assert get_storage_kwargs(None, "x", (10, 4)) == {}
+    assert get_storage_kwargs(STORAGE, "x", (10, 4)) == {
+        "compression": "lzf",
+        "shuffle": False,
+        "chunks": (10, 4),
+    }
+    assert get_storage_kwargs(STORAGE, "y", (0,)) == {
+        "compression": "gzip",
+        "shuffle": False,
+        "chunks": (16,),
+    }
+    with pytest.raises(ValueError):
+        get_storage_kwargs({"compression": "zip"}, "x", (10, 4))
+
+
+def test_set_layout_of_existing_file_must_match(tmp_path):
+    with h5py.File(tmp_path / "dataset.hdf5", "a") as hdf5_file:
+        set_layout(hdf5_file, "groups")
+        write_tile(hdf5_file, "train", "tile_1.las", [make_sample(10, 0)])
+        with pytest.raises(ValueError):
+            set_layout(hdf5_file, "flat")
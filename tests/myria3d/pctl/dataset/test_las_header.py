@@ -0,0 +1,146 @@
+import os
+import struct
+
+import pytest
+
+from myria3d.pctl.dataset.las_header import cached_per_file_version, read_las_header
+from myria3d.pctl.dataset import utils
+from myria3d.pctl.dataset.utils import get_pdal_reader
+
+SINGLE_POINT_CLOUD = "tests/data/single-point-cloud.laz"
+WKT = 'PROJCS["RGF93 v1 / Lambert-93",AUTHORITY["EPSG","2154"]]'
+
+
+def _make_record(record_id, payload, extended=False):
+    user_id = b"LASF_Projection".ljust(16, b"\0")
+    description = b"".ljust(32, b"\0")
+    record_format = "<H16sHQ32s" if extended else "<H16sHH32s"
+    return struct.pack(record_format, 0, user_id, record_id, len(payload), description) + payload
+
+
+def _write_las(path, version_minor, vlrs=b"", num_vlrs=0, evlrs=b"", num_evlrs=0, count=42):
+    header_size = 375 if version_minor == 4 else 227
+    header = bytearray(header_size)
+    header[0:4] = b"LASF"
+    header[24], header[25] = 1, version_minor
+    offset_to_point_data = header_size + len(vlrs)
+    struct.pack_into("<HII", header, 94, header_size, offset_to_point_data, num_vlrs)
+    point_count = 0 if version_minor == 4 else count
+    struct.pack_into("<BHI", header, 104, 0x80 | 3, 34, point_count)
+    struct.pack_into("<3d", header, 131, 0.01, 0.01, 0.01)
+    struct.pack_into("<6d", header, 179, 10.0, 1.0, 20.0, 2.0, 30.0, 3.0)
+    if version_minor == 4:
+        start_of_first_evlr = offset_to_point_data + 34 * count
+        struct.pack_into("<QIQ", header, 235, start_of_first_evlr, num_evlrs, count)
+    with open(path, "wb") as f:
+        f.write(bytes(header) + vlrs + bytes(34 * count) + evlrs)
+
+
+def test_read_las_header_of_laz_file():
+    header = read_las_header(SINGLE_POINT_CLOUD)
+    assert header.version == "1.4"
+    assert header.point_format == 8
+    assert header.point_count == 1
+    assert not header.has_srs
+
+
+def test_read_las_header_with_geo_keys(tmp_path):
+    # GeoKeyDirectoryTag: header, then a model type key and the ProjectedCSTypeGeoKey.
+    geo_keys = struct.pack("<12H", 1, 1, 0, 2, 1024, 0, 1, 1, 3072, 0, 1, 2154)
+    path = str(tmp_path / "geo_keys.las")
+    _write_las(path, 2, vlrs=_make_record(34735, geo_keys), num_vlrs=1)
+    header = read_las_header(path)
+    assert header.version == "1.2"
+    assert header.point_format == 3
+    assert header.point_count == 42
+    assert header.mins == (1.0, 2.0, 3.0) and header.maxs == (10.0, 20.0, 30.0)
+    assert header.has_srs
+    assert header.epsg == 2154
+    assert header.srs_wkt is None
+
+
+def test_read_las_header_with_wkt_in_extended_record(tmp_path):
+    path = str(tmp_path / "wkt.las")
+    _write_las(path, 4, evlrs=_make_record(2112, WKT.encode() + b"\0", extended=True), num_evlrs=1)
+    header = read_las_header(path)
+    assert header.point_count == 42
+    assert header.has_srs
+    assert header.srs_wkt == WKT
+
+
+def _get_metadata_with_compound_wkt(compound_wkt):
+    def get_metadata(las_path):
+        return {"metadata": {"readers.las": {"srs": {"compoundwkt": compound_wkt}}}}
+
+    return get_metadata
+
+
+def test_srs_records_unresolved_by_header_are_checked_with_pdal(tmp_path, monkeypatch):
+    # User-defined ProjectedCSTypeGeoKey, from which pdal may still build a WKT.
+    geo_keys = struct.pack("<12H", 1, 1, 0, 2, 1024, 0, 1, 1, 3072, 0, 1, 32767)
+    path = str(tmp_path / "user_defined_geo_keys.las")
+    _write_las(path, 2, vlrs=_make_record(34735, geo_keys), num_vlrs=1)
+    header = read_las_header(path)
+    assert header.has_srs
+    assert header.srs_wkt is None and header.epsg is None
+
+    monkeypatch.setattr(utils, "get_metadata", _get_metadata_with_compound_wkt(WKT))
+    assert get_pdal_reader(path, epsg=None) is not None
+    monkeypatch.setattr(utils, "get_metadata", _get_metadata_with_compound_wkt(""))
+    with pytest.raises(Exception, match="No EPSG provided"):
+        get_pdal_reader(path, epsg=None)
+    # An EPSG given as parameter overrides the SRS of the file.
+    assert get_pdal_reader(path, epsg="2154") is not None
+
+
+def test_files_without_srs_record_are_not_read_without_epsg(tmp_path, monkeypatch):
+    path = str(tmp_path / "no_srs.las")
+    _write_las(path, 2)
+    # pdal is not needed to know that there is no SRS.
+    monkeypatch.setattr(utils, "get_metadata", None)
+    with pytest.raises(Exception, match="No EPSG provided"):
+        get_pdal_reader(path, epsg=None)
+
+
+def test_get_pdal_reader_does_not_hide_read_errors(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        get_pdal_reader(str(tmp_path / "missing.las"), epsg=None)
+
+
+def test_read_las_header_is_cached_until_file_is_modified(tmp_path):
+    path = str(tmp_path / "modified.las")
+    _write_las(path, 2, count=1)
+    assert read_las_header(path).point_count == 1
+    _write_las(path, 2, count=2)
+    os.utime(path, ns=(0, 123456789))  # in case modifications happen within the mtime resolution
+    assert read_las_header(path).point_count == 2
+
+
+def test_functions_share_a_cache_per_file_version(tmp_path):
+    calls = []
+
+    @cached_per_file_version
+    def get_size(path):
+        calls.append(("size", path))
+        return os.path.getsize(path)
+
+    @cached_per_file_version
+    def get_content(path):
+        calls.append(("content", path))
+        return open(path, "rb").read()
+
+    path = str(tmp_path / "file.las")
+    _write_las(path, 2, count=1)
+    for _ in range(2):
+        get_size(path)
+        get_content(path)
+    # Each function reads the file once, and their results are not mixed up.
+    assert calls == [("size", path), ("content", path)]
+    assert get_size(path) == len(get_content(path))
+
+
+def test_read_las_header_of_non_las_file(tmp_path):
+    path = tmp_path / "not_a_las.las"
+    path.write_bytes(b"not a LAS file")
+    with pytest.raises(ValueError):
+        read_las_header(str(path))
@@ -0,0 +1,38 @@
+import torch
+from torch_geometric.data import Data
+
+from myria3d.pctl.dataset.prefix_cache import DeterministicPrefixCache
+
+
+def compute_sample(idx: int, key: str):
+    if idx == 1:
+        # Filtered out.
+        return None
+    return Data(pos=torch.full((idx + 1, 3), float(idx)), key=key)
+
+
+def test_prefix_cache_materialize_and_read(tmp_path):
+    cache = DeterministicPrefixCache(str(tmp_path / "prefix_cache.hdf5"))
+    assert not cache.is_complete("a")
+    cache.materialize({"a": [0, 1, 2]}, num_samples=4, compute_fn=compute_sample)
+    assert cache.is_complete("a")
+    assert torch.equal(cache.read("a", 2).pos, torch.full((3, 3), 2.0))
+    assert cache.read("a", 2).key == "a"
+    assert cache.read("a", 1) is None
+
+
+def test_prefix_cache_deletes_stale_keys(tmp_path):
+    cache = DeterministicPrefixCache(str(tmp_path / "prefix_cache.hdf5"))
+    cache.materialize({"a": [0]}, num_samples=1, compute_fn=compute_sample)
+    cache.materialize({"b": [0]}, num_samples=1, compute_fn=compute_sample)
+    assert not cache.is_complete("a")
+    assert cache.is_complete("b")
+
+
+def test_prefix_cache_materialize_in_dataloader_workers(tmp_path):
+    cache = DeterministicPrefixCache(str(tmp_path / "prefix_cache.hdf5"))
+    cache.materialize({"a": [0, 1, 2, 3]}, num_samples=4, compute_fn=compute_sample, num_workers=2)
+    assert cache.is_complete("a")
+    for idx in [0, 2, 3]:
+        assert torch.equal(cache.read("a", idx).pos, torch.full((idx + 1, 3), float(idx)))
+    assert cache.read("a", 1) is None
@@ -1,7 +1,7 @@
 import numpy as np
 import pytest
 
-from myria3d.pctl.dataset.utils import get_mosaic_of_centers
+from myria3d.pctl.dataset.utils import get_mosaic_of_centers, split_xy_into_samples_idx
 
 
 @pytest.mark.parametrize(
@@ -13,3 +13,22 @@ def test_get_mosaic_of_centers(tile_width, subtile_width, subtile_overlap):
     for s in np.stack(mosaic).transpose():
         assert min(s - subtile_width / 2) <= 0
         assert max(s + subtile_width / 2) <= 1000
+
+
+@pytest.mark.parametrize(
+    "tile_width, subtile_width, subtile_overlap",
+    [(100, 50, 0), (110, 50, 25), (100, 20, 5)],
+)
+def test_split_xy_into_samples_idx_grid_matches_kdtree(tile_width, subtile_width, subtile_overlap):
+    rng = np.random.default_rng(0)
+    # Rounded coordinates, so that many points lie exactly on the borders of receptive fields.
+    xy = (np.round(rng.uniform(0, tile_width, (5000, 2)) * 2) / 2).astype(np.float32)
+    kdtree_samples = list(
+        split_xy_into_samples_idx(xy, tile_width, subtile_width, subtile_overlap, "kdtree")
+    )
+    grid_samples = list(
+        split_xy_into_samples_idx(xy, tile_width, subtile_width, subtile_overlap, "grid")
+    )
+    assert len(kdtree_samples) == len(grid_samples)
+    for kdtree_idx, grid_idx in zip(kdtree_samples, grid_samples):
+        assert np.array_equal(np.sort(kdtree_idx), np.sort(grid_idx))
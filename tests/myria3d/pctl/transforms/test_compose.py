@@ -0,0 +1,22 @@
+from torch_geometric.transforms import Center, GridSampling
+
+from myria3d.pctl.transforms.compose import CustomCompose
+from myria3d.pctl.transforms.transforms import DropPointsByClass, MaximumNumNodes, NormalizePos
+
+
+def test_split_deterministic_prefix():
+    transform = CustomCompose(
+        [DropPointsByClass(), GridSampling(0.25), MaximumNumNodes(100), Center()]
+    )
+    prefix, tail = transform.split_deterministic_prefix()
+    assert [type(t) for t in prefix.transforms] == [DropPointsByClass, GridSampling]
+    # Transforms after a stochastic one are never precomputed, even if deterministic.
+    assert [type(t) for t in tail.transforms] == [MaximumNumNodes, Center]
+
+
+def test_fingerprint_changes_with_transforms_config():
+    fingerprint = CustomCompose([GridSampling(0.25), NormalizePos(50)]).fingerprint()
+    assert CustomCompose([GridSampling(0.25), NormalizePos(50)]).fingerprint() == fingerprint
+    assert CustomCompose([GridSampling(0.5), NormalizePos(50)]).fingerprint() != fingerprint
+    assert CustomCompose([GridSampling(0.25), NormalizePos(100)]).fingerprint() != fingerprint
+    assert CustomCompose([GridSampling(0.25)]).fingerprint() != fingerprint
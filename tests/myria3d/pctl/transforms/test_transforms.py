@@ -3,10 +3,13 @@ import pytest
 import torch
 import torch_geometric
 
+from myria3d.pctl.dataloader.dataloader import GeometricNoneProofCollater
 from myria3d.pctl.transforms.transforms import (
+    BuildNeighborsHierarchy,
     DropPointsByClass,
     MinimumNumNodes,
     TargetTransform,
+    get_neighbors_hierarchy,
     subsample_data,
 )
 
@@ -124,6 +127,25 @@ def test_TargetTransform_throws_type_error_if_invalid_classification_dict():
         _ = tt(invalid_input_data)
 
 
+@pytest.mark.parametrize("as_tensor", [False, True])
+@pytest.mark.parametrize("dtype", [np.int32, np.float32])
+def test_TargetTransform_with_lookup_tables(as_tensor, dtype):
+    classification_preprocessing_dict = {3: 5, 4: 5, 300: 1}
+    classification_dict = {1: "unclassified", 2: "ground", 5: "vegetation", 6: "building"}
+    tt = TargetTransform(classification_preprocessing_dict, classification_dict)
+    assert len(tt.lookup_table) >= 256
+    y = np.array([1, 2, 3, 4, 5, 6, 65, 300], dtype=dtype)
+    y = torch.from_numpy(y) if as_tensor else y
+    mapped_y = tt.transform(y)
+    assert mapped_y.dtype == torch.long
+    assert mapped_y.tolist() == [0, 1, 2, 2, 2, 3, 65, 0]
+
+    for unknown_code in [7, -1, 256]:
+        invalid_y = np.array([1, unknown_code], dtype=dtype)
+        with pytest.raises(TypeError):
+            _ = tt.transform(torch.from_numpy(invalid_y) if as_tensor else invalid_y)
+
+
 def test_DropPointsByClass():
     # points with class 65 are droped.
     y = torch.Tensor([1, 65, 65, 2, 65])
@@ -174,3 +196,21 @@ def test_MinimumNumNodes(input_nodes, min_nodes):
     # Check that "idx_in_original_cloud" key is not modified
     assert isinstance(transformed_data.idx_in_original_cloud, np.ndarray)
     assert transformed_data.idx_in_original_cloud.shape[0] == input_nodes
+
+
+def test_build_neighbors_hierarchy_is_offset_by_level_when_collated():
+    transform = BuildNeighborsHierarchy(num_neighbors=16, decimation=4)
+    samples = [
+        transform(torch_geometric.data.Data(x=torch.rand((n, 3)), pos=torch.rand((n, 3))))
+        for n in [700, 300, 50]
+    ]
+    batch = GeometricNoneProofCollater()(samples)
+    hierarchy = get_neighbors_hierarchy(batch)
+
+    # Neighbors, decimated points and upsampling points of a point are all from its own cloud.
+    level_batch = batch.batch
+    for edge_index, idx_decim, upsample_idx in zip(*hierarchy):
+        assert torch.equal(level_batch[edge_index[0]], level_batch[edge_index[1]])
+        decimated_batch = level_batch[idx_decim]
+        assert torch.equal(decimated_batch[upsample_idx], level_batch)
+        level_batch = decimated_batch
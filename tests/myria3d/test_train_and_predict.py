@@ -1,4 +1,5 @@
 import os.path as osp
+import shutil
 from typing import List
 
 import numpy as np
@@ -8,9 +9,12 @@ from pathlib import Path
 from pdaltools import las_info
 
 
+from myria3d.export import export
 from myria3d.pctl.dataset.toy_dataset import TOY_LAS_DATA
 from myria3d.pctl.dataset.utils import pdal_read_las_array
 from myria3d.predict import predict
+from myria3d.predict_exported import predict_exported
+from myria3d.predict_pipeline import predict_files
 from myria3d.train import train
 from tests.conftest import (
     make_default_hydra_cfg,
@@ -187,6 +191,119 @@ def test_RandLaNet_predict_with_invariance_checks(one_epoch_trained_RandLaNet_ch
     check_las_invariance(TOY_LAS_DATA, path_to_output_las)
 
 
+def test_RandLaNet_predict_reading_las_once(one_epoch_trained_RandLaNet_checkpoint, tmpdir):
+    """Check that reading the LAS once gives the same output LAS as reading it twice.
+
+    Args:
+        one_epoch_trained_RandLaNet_checkpoint (fixture -> str): path to checkpoint of
+        a RandLa-Net model that was trained for once epoch at start of test session.
+        tmpdir (fixture -> str): temporary directory.
+
+    """
+    tmp_paths_overrides = _make_list_of_necesary_hydra_overrides_with_tmp_paths(
+        "placeholder_because_no_need_for_a_dataset_here", tmpdir
+    )
+    output_las = []
+    for read_las_once in [False, True]:
+        cfg_predict_using_trained_model = make_default_hydra_cfg(
+            overrides=[
+                "experiment=predict",
+                f"predict.ckpt_path={one_epoch_trained_RandLaNet_checkpoint}",
+                f"datamodule.epsg={DEFAULT_EPSG}",
+                f"predict.src_las={TOY_LAS_DATA}",
+                f"predict.output_dir={osp.join(tmpdir, str(read_las_once))}",
+                "predict.interpolator.probas_to_save=[building,unclassified]",
+                f"predict.read_las_once={read_las_once}",
+            ]
+            + tmp_paths_overrides
+        )
+        output_las.append(pdal_read_las_array(predict(cfg_predict_using_trained_model), "2154"))
+
+    assert output_las[0].dtype == output_las[1].dtype
+    for dim in output_las[0].dtype.names:
+        np.testing.assert_allclose(output_las[0][dim], output_las[1][dim], rtol=1e-5, atol=1e-6)
+
+
+def test_RandLaNet_predict_files_in_pipeline(one_epoch_trained_RandLaNet_checkpoint, tmpdir):
+    """Check that the pipeline of several files gives the same output LAS as predict on each file.
+
+    Args:
+        one_epoch_trained_RandLaNet_checkpoint (fixture -> str): path to checkpoint of
+        a RandLa-Net model that was trained for once epoch at start of test session.
+        tmpdir (fixture -> str): temporary directory.
+
+    """
+    tmp_paths_overrides = _make_list_of_necesary_hydra_overrides_with_tmp_paths(
+        "placeholder_because_no_need_for_a_dataset_here", tmpdir
+    )
+    src_las_paths = []
+    for name in ["a", "b", "c"]:
+        src_las_paths.append(osp.join(tmpdir, f"{name}.las"))
+        shutil.copy(TOY_LAS_DATA, src_las_paths[-1])
+    overrides = [
+        "experiment=predict",
+        f"predict.ckpt_path={one_epoch_trained_RandLaNet_checkpoint}",
+        f"datamodule.epsg={DEFAULT_EPSG}",
+        f"predict.src_las={TOY_LAS_DATA}",
+        "predict.interpolator.probas_to_save=[building,unclassified]",
+    ] + tmp_paths_overrides
+    cfg_predict = make_default_hydra_cfg(
+        overrides=overrides + [f"predict.output_dir={osp.join(tmpdir, 'predict')}"]
+    )
+    expected = pdal_read_las_array(predict(cfg_predict), "2154")
+
+    cfg_pipeline = make_default_hydra_cfg(
+        overrides=overrides
+        + [
+            f"predict.output_dir={osp.join(tmpdir, 'pipeline')}",
+            "predict.pipeline.enabled=true",
+            "predict.pipeline.num_readers=2",
+            "predict.pipeline.max_queued_batches=2",
+        ]
+    )
+    output_paths = predict_files(cfg_pipeline, src_las_paths)
+    assert [osp.basename(path) for path in output_paths] == ["a.las", "b.las", "c.las"]
+    for path in output_paths:
+        output_las = pdal_read_las_array(path, "2154")
+        assert output_las.dtype == expected.dtype
+        for dim in expected.dtype.names:
+            np.testing.assert_allclose(output_las[dim], expected[dim], rtol=1e-5, atol=1e-6)
+
+
+def test_RandLaNet_export_and_predict_exported(one_epoch_trained_RandLaNet_checkpoint, tmpdir):
+    """Export a trained model as a package, and run inference from the package only.
+
+    Args:
+        one_epoch_trained_RandLaNet_checkpoint (fixture -> str): path to checkpoint of
+        a RandLa-Net model that was trained for once epoch at start of test session.
+        tmpdir (fixture -> str): temporary directory.
+
+    """
+    tmp_paths_overrides = _make_list_of_necesary_hydra_overrides_with_tmp_paths(
+        "placeholder_because_no_need_for_a_dataset_here", tmpdir
+    )
+    cfg_export = make_default_hydra_cfg(
+        overrides=[
+            "experiment=predict",
+            f"predict.ckpt_path={one_epoch_trained_RandLaNet_checkpoint}",
+            f"datamodule.epsg={DEFAULT_EPSG}",
+            f"predict.output_dir={tmpdir}",
+            "predict.interpolator.probas_to_save=[building,unclassified]",
+        ]
+        + tmp_paths_overrides
+    )
+    package_path = export(cfg_export)
+    assert osp.isfile(package_path)
+
+    path_to_output_las = predict_exported(package_path, TOY_LAS_DATA, osp.join(tmpdir, "exported"))
+    check_las_contains_dims(
+        path_to_output_las,
+        dims_to_check=["PredictedClassification", "entropy", "building", "unclassified"],
+    )
+    check_las_does_not_contains_dims(path_to_output_las, dims_to_check=["ground"])
+    check_las_invariance(TOY_LAS_DATA, path_to_output_las)
+
+
 def test_run_test_with_trained_model_on_toy_dataset_on_cpu(
     one_epoch_trained_RandLaNet_checkpoint, toy_dataset_hdf5_path, tmpdir
 ):
@@ -204,8 +321,31 @@ def test_run_test_with_trained_model_on_toy_dataset_on_gpu(
     )
 
 
+def test_run_test_in_bf16_mixed_precision_on_cpu(
+    one_epoch_trained_RandLaNet_checkpoint, toy_dataset_hdf5_path, tmpdir
+):
+    """Check that IoU in mixed precision is close to IoU in full precision."""
+    trainer_fp32 = _run_test_right_after_training(
+        one_epoch_trained_RandLaNet_checkpoint, toy_dataset_hdf5_path, tmpdir, "cpu"
+    )
+    trainer_bf16 = _run_test_right_after_training(
+        one_epoch_trained_RandLaNet_checkpoint,
+        toy_dataset_hdf5_path,
+        tmpdir,
+        "cpu",
+        ["trainer.precision=bf16-mixed"],
+    )
+    iou_fp32 = trainer_fp32.callback_metrics["test/iou"].item()
+    iou_bf16 = trainer_bf16.callback_metrics["test/iou"].item()
+    assert iou_bf16 == pytest.approx(iou_fp32, abs=0.02)
+
+
 def _run_test_right_after_training(
-    one_epoch_trained_RandLaNet_checkpoint, toy_dataset_hdf5_path, tmpdir, accelerator
+    one_epoch_trained_RandLaNet_checkpoint,
+    toy_dataset_hdf5_path,
+    tmpdir,
+    accelerator,
+    overrides: List[str] = [],
 ):
     """Run test using the model that was just trained for one epoch.
 
@@ -230,9 +370,10 @@ def _run_test_right_after_training(
             f"trainer.devices={devices}",
             f"trainer.accelerator={accelerator}",
         ]
+        + overrides
         + tmp_paths_overrides
     )
-    train(cfg_test_using_trained_model)
+    return train(cfg_test_using_trained_model)
 
 
 def check_las_contains_dims(las_path: str, dims_to_check: List[str] = []):